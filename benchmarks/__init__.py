@@ -0,0 +1,2 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
@@ -0,0 +1,87 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+'''
+Compares Event.from_string with the original closure-based parser.
+Run from the top directory: python -m benchmarks.bench_event
+'''
+
+import random
+import sys
+import timeit
+
+from followermaze.event import Event
+
+
+class LegacyEvent(object):
+    '''Event as it was before it became a tuple with integer command codes.'''
+
+    command_lengths = { 'F': 4, 'U': 4, 'B': 2, 'P': 4, 'S': 3 }
+
+    def __init__(self, message, sequence_num, command, from_user=None, to_user=None):
+        self.message = message
+        self.sequence_num = int(sequence_num)
+        self.code = command
+        self.from_user = from_user
+        self.to_user = to_user
+
+    @classmethod
+    def from_string(cls, message):
+        def validate(tokens):
+            if len(tokens) < 2:
+                raise ValueError("invalid command; event: '%s'" % message)
+            int(tokens[0])
+            length = LegacyEvent.command_lengths.get(tokens[1])
+            if not length:
+                raise ValueError("invalid command code; event: '%s'" % message)
+            if len(tokens) != length:
+                raise ValueError("invalid command length; event: '%s'" % message)
+            for token in [tokens[i] for i in range(2, length)]:
+                if not token:
+                    raise ValueError("empty value for user id; event: '%s'" % message)
+
+        tokens = message.split('|')
+        validate(tokens)
+        return LegacyEvent(message, *tokens)
+
+
+def make_messages(n, users=1000, seed=42):
+    '''Returns n event strings with the mix of commands similar to the one of the reference event source.'''
+    rnd = random.Random(seed)
+    messages = []
+    for seq in range(1, n + 1):
+        command = rnd.choice('FFFUUBPPSSS')
+        a, b = rnd.randint(1, users), rnd.randint(1, users)
+        if command == 'B':
+            messages.append('%d|B' % seq)
+        elif command == 'S':
+            messages.append('%d|S|%d' % (seq, a))
+        else:
+            messages.append('%d|%s|%d|%d' % (seq, command, a, b))
+    return messages
+
+
+def parse_rate(parse, messages, repeat=5):
+    '''Returns best parse rate in events per second.'''
+    best = min(timeit.repeat(lambda: [parse(m) for m in messages], number=1, repeat=repeat))
+    return len(messages) / best
+
+
+def event_size(event):
+    size = sys.getsizeof(event)
+    if hasattr(event, '__dict__'):
+        size += sys.getsizeof(event.__dict__)
+    return size
+
+
+def main():
+    messages = make_messages(100000)
+    legacy = parse_rate(LegacyEvent.from_string, messages)
+    current = parse_rate(Event.from_string, messages)
+    print 'LegacyEvent.from_string: %10.0f events/s, %4d bytes per event' % (legacy, event_size(LegacyEvent.from_string(messages[0])))
+    print 'Event.from_string:       %10.0f events/s, %4d bytes per event' % (current, event_size(Event.from_string(messages[0])))
+    print 'speedup: %.2fx' % (current / legacy)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+'''
+Measures how fast the server registers a storm of user clients connecting all at once, as after a deploy.
+Every client connects and sends its id at the same moment; the time until the server reports all of them
+connected (through its metrics endpoint) is measured.
+Run from the top directory: python -m benchmarks.bench_handshake [--clients N] [--compare]
+With --compare the accept settings the server used to have (backlog 5, one accept per poll) are measured too.
+Clients dropped from a full listen queue retry with the kernel's SYN backoff, so the storm may not complete
+in --timeout-s; then the number of clients registered by that time is reported.
+'''
+
+import multiprocessing
+import optparse
+import socket
+import time
+import urllib2
+
+from benchmarks.loadgen import Config, raise_fd_limit, run_server_process, EVENT_PORT, CLIENT_PORT
+from followermaze.poller import make_poller, WRITE
+
+
+METRICS_PORT = 19091
+
+
+def storm(user_ids, ready, go, stop):
+    '''Connects clients with given ids at once when go is set and keeps them connected until stop is set.'''
+    ready.put(True)
+    go.wait()
+    poller = make_poller()
+    pending = {}
+    sockets = []
+    for user_id in user_ids:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(0)
+        s.connect_ex(('127.0.0.1', CLIENT_PORT))
+        poller.register(s, WRITE)
+        pending[s] = user_id
+        sockets.append(s)
+    while pending:
+        for s, ev in poller.poll(1):
+            user_id = pending.pop(s)
+            poller.unregister(s)
+            if s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                # refused: reconnect like a real client would
+                s.close()
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                s.setblocking(0)
+                s.connect_ex(('127.0.0.1', CLIENT_PORT))
+                poller.register(s, WRITE)
+                pending[s] = user_id
+                sockets.append(s)
+                continue
+            s.send('%d\r\n' % user_id)
+    stop.wait()
+    for s in sockets:
+        s.close()
+
+
+def connected_clients():
+    try:
+        metrics = urllib2.urlopen('http://localhost:%d/metrics' % METRICS_PORT).read()
+    except (urllib2.URLError, socket.error):
+        return 0
+    for line in metrics.splitlines():
+        if line.startswith('followermaze_clients_connected '):
+            return int(line.split()[1])
+    return 0
+
+
+def measure(clients, client_processes, listen_backlog, accept_batch, timeout_s=60):
+    '''Returns number of clients registered by the server and seconds it took, at most timeout_s.'''
+    config = Config(event_port=EVENT_PORT, client_port=CLIENT_PORT, metrics_port=METRICS_PORT,
+                    listen_backlog=listen_backlog, accept_batch=accept_batch, log_level='ERROR')
+    server_ready = multiprocessing.Queue()
+    server_results = multiprocessing.Queue()
+    stop_server = multiprocessing.Event()
+    server = multiprocessing.Process(target=run_server_process, args=(config, server_ready, stop_server, server_results))
+    server.start()
+    procs = []
+    stop = multiprocessing.Event()
+    try:
+        server_ready.get(timeout=60)
+        ready = multiprocessing.Queue()
+        go = multiprocessing.Event()
+        for i in range(client_processes):
+            user_ids = range(i + 1, clients + 1, client_processes)
+            p = multiprocessing.Process(target=storm, args=(user_ids, ready, go, stop))
+            p.start()
+            procs.append(p)
+        for p in procs:
+            ready.get(timeout=60)
+
+        start = time.time()
+        go.set()
+        registered = 0
+        while registered < clients and time.time() - start < timeout_s:
+            time.sleep(0.01)
+            registered = connected_clients()
+        return registered, time.time() - start
+    finally:
+        stop.set()
+        for p in procs:
+            p.join()
+        stop_server.set()
+        server_results.get(timeout=60)
+        server.join()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--clients', type='int', default=10000)
+    parser.add_option('--client-processes', type='int', default=multiprocessing.cpu_count())
+    parser.add_option('--backlog', type='int', default=Config().listen_backlog)
+    parser.add_option('--accept-batch', type='int', default=Config().accept_batch)
+    parser.add_option('--compare', action='store_true', help='also measure backlog 5 with one accept per poll')
+    parser.add_option('--timeout-s', type='float', default=60, help='give up waiting for the storm after this long')
+    options, args = parser.parse_args()
+
+    raise_fd_limit()
+    settings = [(options.backlog, options.accept_batch)]
+    if options.compare:
+        settings.insert(0, (5, 1))
+    for backlog, accept_batch in settings:
+        registered, elapsed = measure(options.clients, options.client_processes, backlog, accept_batch,
+                                      options.timeout_s)
+        print 'backlog %5d, accept batch %4d: %d of %d clients in %6.2f s  (%8.0f handshakes/s)' % (
+            backlog, accept_batch, registered, options.clients, elapsed, registered / elapsed)
+
+
+if __name__ == '__main__':
+    main()
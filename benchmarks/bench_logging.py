@@ -0,0 +1,88 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+'''
+Measures the cost of the event trace of EventHandler when INFO level is disabled (the default),
+comparing parse and dispatch throughput with a handler having the trace removed and with the
+eager formatting the handler used to do.
+Run from the top directory: python -m benchmarks.bench_logging
+'''
+
+import logging
+
+from benchmarks.bench_event import make_messages
+from benchmarks.micro import NullHandler, StubServer, measure
+from followermaze.event import Event, EventQueue
+from followermaze.eventhandler import EventHandler
+from followermaze.usergraph import UserGraph
+
+
+class UntracedEventHandler(EventHandler):
+    '''EventHandler with logging removed from the per-event paths.'''
+
+    def on_event_received(self, msg):
+        try:
+            self.queue.add(Event.from_string(msg))
+            self.events_parsed += 1
+            return True
+        except ValueError:
+            self.events_rejected += 1
+            return False
+
+    def on_event(self, event):
+        self.dispatch[event.code](event)
+
+
+class EagerEventHandler(UntracedEventHandler):
+    '''EventHandler formatting trace messages whether they are logged or not, as it used to.'''
+
+    def on_event_received(self, msg):
+        logging.info("EventHandler: new event string received from server: '%s'" % msg)
+        return UntracedEventHandler.on_event_received(self, msg)
+
+    def on_event(self, event):
+        logging.info("EventHandler: processing event '%s'" % event.message)
+        self.dispatch[event.code](event)
+
+
+def make_parse_bench(handler_class, messages):
+    def bench():
+        handler = handler_class(UserGraph(), StubServer(), None)
+        receive = handler.on_event_received
+        def run():
+            handler.queue = EventQueue()
+            handler.queue.set_handler(NullHandler())
+            for msg in messages:
+                receive(msg)
+        return run, len(messages)
+    return bench
+
+
+def make_dispatch_bench(handler_class, messages):
+    def bench():
+        graph = UserGraph()
+        for i in xrange(1, 1001, 2):
+            graph.register_user(str(i), connection=object())
+        handler = handler_class(graph, StubServer(), None)
+        events = [Event.from_string(m) for m in messages]
+        on_event = handler.on_event
+        def run():
+            for event in events:
+                on_event(event)
+        return run, len(events)
+    return bench
+
+
+def main():
+    logging.Logger.root.setLevel(logging.WARNING)
+    messages = make_messages(20000)
+    for name, make_bench in ('on_event_received', make_parse_bench), ('on_event', make_dispatch_bench):
+        removed = measure(make_bench(UntracedEventHandler, messages), 5)
+        for label, handler_class in ('trace removed', UntracedEventHandler), ('trace off', EventHandler), \
+                                    ('eager formatting', EagerEventHandler):
+            rate = removed if handler_class is UntracedEventHandler else measure(make_bench(handler_class, messages), 5)
+            print '%-18s %-17s %10.0f events/s  (%.2fx)' % (name, label, rate, rate / removed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+'''
+Measures broadcast delivery throughput of ShardedServer for different numbers of worker processes.
+Run from the top directory: python -m benchmarks.bench_sharding [--workers 1,2,4] [--clients N] [--events N]
+Clients are simulated by separate processes, so the machine should have enough cores for both sides.
+'''
+
+import multiprocessing
+import optparse
+import socket
+import time
+
+from followermaze.event import EventQueue
+from followermaze.poller import make_poller, READ
+from followermaze.sharding import ShardedServer
+
+
+EVENT_PORT = 19090
+CLIENT_PORT = 19099
+
+
+def run_clients(user_ids, events, ready, results):
+    '''Connects clients with given ids and reads until each of them receives the given number of lines.'''
+    poller = make_poller()
+    remaining = {}
+    for user_id in user_ids:
+        s = socket.create_connection(('localhost', CLIENT_PORT))
+        s.sendall('%d\r\n' % user_id)
+        s.setblocking(0)
+        poller.register(s, READ)
+        remaining[s] = events
+    ready.put(len(user_ids))
+
+    while remaining:
+        for s, ev in poller.poll(1):
+            data = s.recv(64 * 1024)
+            remaining[s] -= data.count('\n')
+            if not data or remaining[s] <= 0:
+                poller.unregister(s)
+                del remaining[s]
+                s.close()
+    results.put(time.time())
+
+
+def measure(workers, clients, events, client_processes):
+    '''Returns number of messages delivered per second.'''
+    server = ShardedServer(EVENT_PORT, CLIENT_PORT, EventQueue(), workers)
+    server.start()
+    try:
+        ready = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        procs = []
+        for i in range(client_processes):
+            user_ids = range(i + 1, clients + 1, client_processes)
+            p = multiprocessing.Process(target=run_clients, args=(user_ids, events, ready, results))
+            p.start()
+            procs.append(p)
+        for p in procs:
+            ready.get()
+        # let workers register all the clients
+        time.sleep(1)
+
+        source = socket.create_connection(('localhost', EVENT_PORT))
+        start = time.time()
+        source.sendall(''.join('%d|B\r\n' % seq for seq in range(1, events + 1)))
+        finish = max(results.get() for p in procs)
+        for p in procs:
+            p.join()
+        source.close()
+        return clients * events / (finish - start)
+    finally:
+        server.stop()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--workers', default='1,2,4', help='comma-separated numbers of workers to try')
+    parser.add_option('--clients', type='int', default=2000)
+    parser.add_option('--events', type='int', default=200, help='number of broadcast events')
+    parser.add_option('--client-processes', type='int', default=multiprocessing.cpu_count())
+    options, args = parser.parse_args()
+
+    baseline = None
+    for workers in [int(w) for w in options.workers.split(',')]:
+        rate = measure(workers, options.clients, options.events, options.client_processes)
+        baseline = baseline or rate
+        print 'workers: %2d  %10.0f messages/s  (%.2fx)' % (workers, rate, rate / baseline)
+
+
+if __name__ == '__main__':
+    main()
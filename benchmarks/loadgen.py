@@ -0,0 +1,307 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+'''
+End-to-end benchmark: starts the server (built by run_server.make_server() from followermaze_config with
+ports and the given options overridden) in a separate process, connects simulated user clients, drives
+the event source with a generated stream and prints throughput, delivery latency and peak RSS as JSON.
+
+Run from the top directory, e.g.:
+    python -m benchmarks.loadgen --events 100000 --users 5000 --clients 2000 --disorder 5 --output result.json
+
+Latency of a delivery is the time from sending the event to the server until a client reads it;
+only events with sequence numbers divisible by --latency-sample are measured.
+Simulated clients run in separate processes; make sure they are not the bottleneck (--client-processes).
+'''
+
+import array
+import json
+import logging
+import multiprocessing
+import optparse
+import random
+import resource
+import socket
+import time
+
+from followermaze import wire
+from followermaze.event import Event
+from followermaze.poller import make_poller, READ
+import followermaze_config
+import run_server
+
+
+EVENT_PORT = 19090
+CLIENT_PORT = 19099
+
+DEFAULT_MIX = 'F=30,U=10,B=5,P=25,S=30'
+
+
+class Config(object):
+    '''followermaze_config with some of its values overridden.'''
+
+    def __init__(self, **overrides):
+        for name in dir(followermaze_config):
+            if not name.startswith('_'):
+                setattr(self, name, getattr(followermaze_config, name))
+        for name, value in overrides.items():
+            setattr(self, name, value)
+
+
+def raise_fd_limit():
+    '''Raises the limit of open files to the maximum allowed; thousands of clients need that many sockets.'''
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def parse_mix(mix):
+    '''Parses 'F=30,U=10,...' into list of (command, weight).'''
+    result = []
+    for item in mix.split(','):
+        command, weight = item.split('=')
+        if command not in 'FUBPS' or len(command) != 1:
+            raise ValueError("unknown event type: '%s'" % command)
+        result.append((command, float(weight)))
+    return result
+
+
+def make_events(count, users, mix, disorder, seed=42, max_distance=8):
+    '''
+    Generates count events in the wire format. Roughly disorder percent of events are swapped with
+    one of the next max_distance events, so that the server has to put them back in order.
+    '''
+    rnd = random.Random(seed)
+    total = sum(weight for command, weight in mix)
+    bounds = []
+    acc = 0
+    for command, weight in mix:
+        acc += weight / total
+        bounds.append((acc, command))
+
+    events = []
+    for seq in xrange(1, count + 1):
+        x = rnd.random()
+        command = next((c for bound, c in bounds if x < bound), bounds[-1][1])
+        from_user = rnd.randint(1, users)
+        to_user = rnd.randint(1, users)
+        if command == 'B':
+            events.append('%d|B\r\n' % seq)
+        elif command == 'S':
+            events.append('%d|S|%d\r\n' % (seq, from_user))
+        else:
+            events.append('%d|%s|%d|%d\r\n' % (seq, command, from_user, to_user))
+
+    for i in xrange(count - 1):
+        if rnd.random() * 100 < disorder:
+            j = min(count - 1, i + rnd.randint(1, max_distance))
+            events[i], events[j] = events[j], events[i]
+    return events
+
+
+def run_server_process(config, ready, stop, results):
+    '''Runs the server until stop is set; reports its peak RSS (and that of its workers) in kilobytes.'''
+    logging.Logger.root.setLevel(config.log_level)
+    server = run_server.make_server(config)
+    server.start()
+    ready.put(True)
+    try:
+        stop.wait()
+    finally:
+        server.stop()
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    results.put((own, children))
+
+
+def run_clients(user_ids, sample, quiet_s, ready, source_done, results):
+    '''
+    Connects clients with given ids and reads from them until the event source is done and nothing
+    has been received for quiet_s seconds. Reports number of lines received and arrival times of sampled events.
+    '''
+    poller = make_poller()
+    inbufs = {}
+    for user_id in user_ids:
+        s = socket.create_connection(('localhost', CLIENT_PORT))
+        s.sendall('%d\r\n' % user_id)
+        s.setblocking(0)
+        poller.register(s, READ)
+        inbufs[s] = ''
+    ready.put(len(user_ids))
+
+    received = 0
+    seqs = array.array('i')
+    times = array.array('d')
+    last_received = time.time()
+    done_at = None
+    while inbufs:
+        ready_sockets = poller.poll(0.1)
+        now = time.time()
+        for s, ev in ready_sockets:
+            try:
+                data = s.recv(64 * 1024)
+            except socket.error:
+                data = ''
+            if not data:
+                poller.unregister(s)
+                del inbufs[s]
+                s.close()
+                continue
+            lines = (inbufs[s] + data).split('\n')
+            inbufs[s] = lines.pop()
+            received += len(lines)
+            last_received = now
+            for line in lines:
+                seq = int(line[:line.index('|')])
+                if seq % sample == 0:
+                    seqs.append(seq)
+                    times.append(now)
+        if done_at is None:
+            if source_done.is_set():
+                done_at = now
+        elif not ready_sockets and now - max(last_received, done_at) > quiet_s:
+            break
+    for s in inbufs:
+        s.close()
+    results.put((received, last_received, seqs, times))
+
+
+def percentile(values, p):
+    '''Nearest-rank percentile of sorted values.'''
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def encode_events(events):
+    '''Returns binary frames (see followermaze.wire) of the events in the text format.'''
+    frames = []
+    for line in events:
+        event = Event.from_string(line.rstrip())
+        frames.append(wire.encode_event(event.sequence_num, event.code,
+                                        int(event.from_user or 0), int(event.to_user or 0)))
+    return frames
+
+
+def measure(options):
+    events = make_events(options.events, options.users, parse_mix(options.mix), options.disorder, options.seed)
+    seqs = [int(line[:line.index('|')]) for line in events]
+    if options.binary:
+        events = encode_events(events)
+    config = Config(event_port=EVENT_PORT, client_port=CLIENT_PORT, server=options.server,
+                    workers=options.workers, user_graph=options.user_graph, event_queue=options.event_queue,
+                    log_level='ERROR')
+
+    server_ready = multiprocessing.Queue()
+    server_results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    server = multiprocessing.Process(target=run_server_process, args=(config, server_ready, stop, server_results))
+    server.start()
+    clients = []
+    try:
+        server_ready.get(timeout=60)
+
+        clients_ready = multiprocessing.Queue()
+        client_results = multiprocessing.Queue()
+        source_done = multiprocessing.Event()
+        for i in range(options.client_processes):
+            user_ids = range(i + 1, options.clients + 1, options.client_processes)
+            p = multiprocessing.Process(target=run_clients, args=(user_ids, options.latency_sample, options.quiet_s,
+                                                                  clients_ready, source_done, client_results))
+            p.start()
+            clients.append(p)
+        for p in clients:
+            clients_ready.get(timeout=600)
+        # let the server register all the clients
+        time.sleep(1)
+
+        sent_at = array.array('d', [0.0]) * (options.events + 1)
+        # batches are spread round-robin over the event source connections
+        sources = [socket.create_connection(('localhost', EVENT_PORT)) for i in range(options.sources)]
+        if options.binary:
+            for source in sources:
+                source.sendall(wire.PREAMBLE)
+        start = time.time()
+        for i in xrange(0, len(events), options.batch):
+            batch = events[i:i + options.batch]
+            if options.rate:
+                delay = start + float(i) / options.rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            now = time.time()
+            for seq in seqs[i:i + options.batch]:
+                sent_at[seq] = now
+            sources[i // options.batch % len(sources)].sendall(''.join(batch))
+        source_sent = time.time()
+        source_done.set()
+
+        received = 0
+        finish = source_sent
+        latencies = []
+        for p in clients:
+            count, last_received, seqs, times = client_results.get()
+            received += count
+            finish = max(finish, last_received)
+            latencies.extend(t - sent_at[seq] for seq, t in zip(seqs, times))
+        for p in clients:
+            p.join()
+        for source in sources:
+            source.close()
+    finally:
+        stop.set()
+        for p in clients:
+            if p.is_alive():
+                p.terminate()
+    own_rss, workers_rss = server_results.get(timeout=60)
+    server.join()
+
+    latencies.sort()
+    elapsed = finish - start
+    return {
+        'parameters': dict(vars(options)),
+        'elapsed_s': elapsed,
+        'events_per_s': options.events / elapsed,
+        'deliveries': received,
+        'deliveries_per_s': received / elapsed,
+        'latency_samples': len(latencies),
+        'latency_ms': dict((name, percentile(latencies, p) * 1000 if latencies else None)
+                           for name, p in (('p50', 0.5), ('p99', 0.99), ('p999', 0.999))),
+        # ru_maxrss is in kilobytes on Linux
+        'server_peak_rss_mb': own_rss / 1024.0,
+        'workers_peak_rss_mb': workers_rss / 1024.0,
+    }
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--events', type='int', default=100000)
+    parser.add_option('--users', type='int', default=5000, help='number of user ids in events')
+    parser.add_option('--clients', type='int', default=2000, help='number of connected clients (users 1..N)')
+    parser.add_option('--mix', default=DEFAULT_MIX, help='relative weights of event types [%default]')
+    parser.add_option('--disorder', type='float', default=5, help='percent of events sent out of order')
+    parser.add_option('--rate', type='float', default=0, help='events per second to send; 0 means as fast as possible')
+    parser.add_option('--batch', type='int', default=100, help='events sent in one call')
+    parser.add_option('--sources', type='int', default=1, help='number of event source connections')
+    parser.add_option('--binary', action='store_true', help='send events using binary framing')
+    parser.add_option('--seed', type='int', default=42)
+    parser.add_option('--latency-sample', type='int', default=10, help='measure latency of every N-th event')
+    parser.add_option('--quiet-s', type='float', default=2, help='clients stop after this long without data')
+    parser.add_option('--client-processes', type='int', default=multiprocessing.cpu_count())
+    parser.add_option('--server', default=followermaze_config.server, help="'poll' or 'asyncio'")
+    parser.add_option('--workers', type='int', default=followermaze_config.workers)
+    parser.add_option('--user-graph', default=followermaze_config.user_graph)
+    parser.add_option('--event-queue', default=followermaze_config.event_queue)
+    parser.add_option('--output', help='file to write results to instead of stdout')
+    options, args = parser.parse_args()
+
+    raise_fd_limit()
+    result = json.dumps(measure(options), indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(result + '\n')
+    else:
+        print result
+
+
+if __name__ == '__main__':
+    main()
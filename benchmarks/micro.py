@@ -0,0 +1,207 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+'''
+Microbenchmarks of the hot paths, run in-process without sockets:
+Event.from_string, binary event decoding, EventQueue add/poll under varying disorder, follower lookups on a high-fanout user
+(including CompactUserGraph loaded from a snapshot, 'csr') and EventHandler.on_event dispatch with a stub server.
+
+Run from the top directory:
+    python -m benchmarks.micro                  run all benchmarks and compare them with the stored baselines
+    python -m benchmarks.micro eventqueue       run only benchmarks whose names start with 'eventqueue'
+    python -m benchmarks.micro --save           store results as the new baselines
+
+Baselines are kept in benchmarks/baselines.json; they only make sense on the machine they were taken on,
+so re-save them before measuring an optimization. The exit status is 1 if some benchmark is slower than
+its baseline by more than --tolerance percent.
+'''
+
+import json
+import optparse
+import os
+import sys
+import tempfile
+import timeit
+
+from benchmarks.bench_event import make_messages
+from benchmarks.loadgen import make_events, encode_events, parse_mix, DEFAULT_MIX
+from followermaze import wire
+from followermaze.event import Event, make_event_queue
+from followermaze.eventhandler import EventHandler
+from followermaze.usergraph import make_user_graph
+
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+
+class NullHandler(object):
+    def on_event(self, event):
+        pass
+
+
+class StubServer(object):
+    '''Server replacement that only counts messages; EventHandler sends through it.'''
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, connection, data):
+        self.sent += 1
+
+    def send_many(self, connections, data):
+        self.sent += len(connections)
+
+
+def bench_from_string():
+    messages = make_messages(10000)
+    from_string = Event.from_string
+    def run():
+        for m in messages:
+            from_string(m)
+    return run, len(messages)
+
+
+def bench_decode_events():
+    frames = ''.join(encode_events(make_events(10000, 1000, parse_mix(DEFAULT_MIX), 0)))
+    decode_events = wire.decode_events
+    def run():
+        decode_events(frames, [])
+    return run, 10000
+
+
+def make_queue_bench(name, disorder):
+    def bench():
+        events = [Event.from_string(line.rstrip())
+                  for line in make_events(10000, 1000, parse_mix(DEFAULT_MIX), disorder)]
+        def run():
+            queue = make_event_queue(name)
+            queue.set_handler(NullHandler())
+            add, poll = queue.add, queue.poll
+            for event in events:
+                add(event)
+                poll()
+        return run, len(events)
+    return bench
+
+
+def make_graph_with_celebrity(name, followers=100000, connected_every=10):
+    '''
+    Returns graph where user '0' is followed by all other users; every connected_every-th of them is connected.
+    Graph 'csr' is CompactUserGraph loaded from a snapshot of such graph.
+    '''
+    graph = make_user_graph('compact' if name == 'csr' else name)
+    for i in xrange(1, followers + 1):
+        graph.add_follower('0', str(i))
+    if name == 'csr':
+        fd, path = tempfile.mkstemp(prefix='followermaze-bench-')
+        with os.fdopen(fd, 'wb') as f:
+            graph.write_snapshot(f)
+        graph = make_user_graph('compact')
+        graph.load_snapshot(path)
+        os.remove(path)
+    for i in xrange(connected_every, followers + 1, connected_every):
+        graph.register_user(str(i), connection=object())
+    return graph
+
+
+def make_followers_of_bench(name):
+    def bench():
+        graph = make_graph_with_celebrity(name)
+        def run():
+            for i in xrange(10):
+                graph.followers_of('0')
+        return run, 10
+    return bench
+
+
+def make_connected_followers_bench(name):
+    def bench():
+        graph = make_graph_with_celebrity(name)
+        def run():
+            for i in xrange(10):
+                for user in graph.connected_followers('0'):
+                    pass
+        return run, 10
+    return bench
+
+
+def make_on_event_bench(name):
+    def bench():
+        events = [Event.from_string(line.rstrip())
+                  for line in make_events(10000, 1000, parse_mix(DEFAULT_MIX), 0)]
+        graph = make_user_graph(name)
+        for i in xrange(1, 1001, 2):
+            graph.register_user(str(i), connection=object())
+        handler = EventHandler(graph, StubServer(), None)
+        on_event = handler.on_event
+        def run():
+            for event in events:
+                on_event(event)
+        return run, len(events)
+    return bench
+
+
+BENCHMARKS = [
+    ('event.from_string', bench_from_string),
+    ('wire.decode_events', bench_decode_events),
+]
+for queue in ('heap', 'window'):
+    for disorder in (0, 5, 50):
+        BENCHMARKS.append(('eventqueue.%s.disorder_%d' % (queue, disorder), make_queue_bench(queue, disorder)))
+for graph in ('dict', 'compact', 'csr'):
+    BENCHMARKS.append(('usergraph.%s.followers_of' % graph, make_followers_of_bench(graph)))
+    BENCHMARKS.append(('usergraph.%s.connected_followers' % graph, make_connected_followers_bench(graph)))
+for graph in ('dict', 'compact'):
+    BENCHMARKS.append(('eventhandler.%s.on_event' % graph, make_on_event_bench(graph)))
+
+
+def measure(bench, repeat):
+    '''Returns best rate of the benchmark in operations per second.'''
+    run, ops = bench()
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return ops / best
+
+
+def load_baselines():
+    if not os.path.exists(BASELINES):
+        return {}
+    with open(BASELINES) as f:
+        return json.load(f)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [name-prefix ...]')
+    parser.add_option('--repeat', type='int', default=5, help='runs per benchmark; the best one counts')
+    parser.add_option('--save', action='store_true', help='store results as baselines')
+    parser.add_option('--tolerance', type='float', default=10, help='percent of slowdown reported as regression')
+    parser.add_option('--json', action='store_true', help='print results as JSON')
+    options, prefixes = parser.parse_args()
+
+    baselines = load_baselines()
+    results = {}
+    regressions = []
+    for name, bench in BENCHMARKS:
+        if prefixes and not any(name.startswith(p) for p in prefixes):
+            continue
+        rate = results[name] = measure(bench, options.repeat)
+        baseline = baselines.get(name)
+        if baseline and rate < baseline * (1 - options.tolerance / 100.0):
+            regressions.append(name)
+        if not options.json:
+            change = '  (%+.1f%%)' % ((rate / baseline - 1) * 100) if baseline else ''
+            print '%-45s %12.0f ops/s%s' % (name, rate, change)
+
+    if options.json:
+        print json.dumps(results, indent=2, sort_keys=True)
+    if options.save:
+        baselines.update(results)
+        with open(BASELINES, 'w') as f:
+            f.write(json.dumps(baselines, indent=2, sort_keys=True) + '\n')
+    if regressions:
+        sys.stderr.write('regressions: %s\n' % ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
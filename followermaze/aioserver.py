@@ -0,0 +1,337 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import logging
+import threading
+
+from followermaze import wire
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+class AsyncConnection(object):
+    '''Connection of a user client served by AsyncServer; passed to the listener like Connection of Server.'''
+
+    __slots__ = ('transport', 'closed', 'dropping')
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.closed = False
+        # whether output is being dropped because the client is too slow
+        self.dropping = False
+
+
+class _LineProtocol(object if asyncio is None else asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.inbuf = ''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        lines = (self.inbuf + data).split('\n')
+        self.inbuf = lines.pop()
+        msgs = [msg.strip('\r') for msg in lines if msg]
+        if msgs:
+            self.lines_received(msgs)
+        self.server.listener.on_poll()
+
+
+class _EventSourceProtocol(_LineProtocol):
+    def connection_made(self, transport):
+        _LineProtocol.connection_made(self, transport)
+        self.framing = None
+        if not self.server.event_source_connected(self):
+            transport.close()
+
+    def data_received(self, data):
+        if self.framing is None:
+            data = self.inbuf + data
+            self.inbuf = ''
+            self.framing = wire.detect_framing(data)
+            if self.framing is None:
+                self.inbuf = data
+                return
+            if self.framing == wire.BINARY:
+                if not self.server.on_events_decoded:
+                    logging.warning('Binary framing is not supported by the listener; disconnecting event source.')
+                    self.transport.close()
+                    return
+                data = data[len(wire.PREAMBLE):]
+        if self.framing == wire.TEXT:
+            _LineProtocol.data_received(self, data)
+            return
+
+        data = self.inbuf + data if self.inbuf else data
+        events = []
+        try:
+            end = wire.decode_events(data, events)
+        except ValueError as v:
+            logging.warning("Bad binary event; error text: '%s'", v)
+            end = None
+        if events and not self.server.on_events_decoded(events):
+            end = None
+        if end is None:
+            logging.warning('event source will be disconnected.')
+            self.transport.close()
+        else:
+            self.inbuf = data[end:]
+        self.server.listener.on_poll()
+
+    def lines_received(self, msgs):
+        if not self.server.events_received(msgs):
+            logging.warning('event source will be disconnected.')
+            self.transport.close()
+
+    def connection_lost(self, exc):
+        self.server.event_source_disconnected(self)
+
+
+class _ClientProtocol(_LineProtocol):
+    def connection_made(self, transport):
+        _LineProtocol.connection_made(self, transport)
+        self.connection = AsyncConnection(transport)
+        self.registered = False
+        self.server.client_connected(self.connection)
+
+    def data_received(self, data):
+        # after the client id is accepted further data are discarded
+        if self.registered:
+            return
+        _LineProtocol.data_received(self, data)
+        if self.registered:
+            self.inbuf = ''
+        elif len(self.inbuf) > self.server.max_client_id_length:
+            logging.warning('Client id is too long; disconnecting client.')
+            self.transport.close()
+
+    def lines_received(self, msgs):
+        if not self.registered:
+            self.registered = not self.server.listener.on_client_id_received(self.connection, msgs[0])
+
+    def pause_writing(self):
+        self.server.slow_consumer(self.connection)
+
+    def resume_writing(self):
+        self.connection.dropping = False
+
+    def connection_lost(self, exc):
+        self.connection.closed = True
+        self.server.client_disconnected(self.connection)
+
+
+class AsyncServer(object):
+    '''
+    Alternative to Server built on asyncio (or trollius, its backport for Python 2): transports buffer output
+    and the event loop does the polling. It has the same listener contract and send()/send_many()/call_later()
+    interface as Server, so EventHandler and EventQueue work with it unchanged.
+
+    It can be embedded into an application that already runs an event loop: pass the loop to the constructor
+    and wait for the future returned by listen(). Otherwise start() runs a new loop in a separate thread,
+    like Server does.
+
+    Output buffered for a client is limited by high_watermark (in bytes, None means unlimited) using transport
+    write buffer limits; when it is reached, slow_consumer_policy 'disconnect' closes the connection,
+    and 'drop_new' drops new messages until the buffer goes down to low_watermark.
+    Dropping the oldest messages is not possible as buffered data belong to the transport.
+
+    Like Server, it accepts up to max_event_sources event sources at once (None means any number),
+    each sending either text or binary framing of followermaze.wire.
+    '''
+
+    slow_consumer_policies = ('disconnect', 'drop_new')
+
+    # longest line with client id accepted from a user client
+    max_client_id_length = 1024
+
+    def __init__(self, event_port, client_port, loop=None, use_uvloop=True,
+                 high_watermark=None, low_watermark=None, slow_consumer_policy='disconnect', max_event_sources=None,
+                 listen_backlog=1024):
+        if asyncio is None:
+            raise RuntimeError('neither asyncio nor trollius is available')
+        if slow_consumer_policy not in self.slow_consumer_policies:
+            raise ValueError("unknown slow consumer policy: '%s'" % slow_consumer_policy)
+        if loop is None:
+            loop = uvloop.new_event_loop() if uvloop and use_uvloop else asyncio.new_event_loop()
+        self.loop = loop
+        self.event_port = event_port
+        self.client_port = client_port
+        self.high_watermark = high_watermark
+        # the same default as Server, rather than the high // 4 of asyncio
+        self.low_watermark = low_watermark if low_watermark is not None or high_watermark is None else high_watermark // 2
+        self.slow_consumer_policy = slow_consumer_policy
+        self.max_event_sources = max_event_sources
+        self.listen_backlog = listen_backlog
+
+        self.servers = []
+        # error of listening on the ports in run(), raised by start()
+        self.listen_error = None
+        self.event_sources = set()
+        self.clients = set()
+
+        # output statistics
+        self.bytes_queued = 0
+        self.bytes_dropped = 0
+        self.slow_consumers_disconnected = 0
+
+
+    def set_listener(self, listener):
+        '''Sets listener that is notified when some data is ready for processing; see Server.set_listener().'''
+        self.listener = listener
+        self.on_events_received = getattr(listener, 'on_events_received', self._events_received_one_by_one)
+        self.on_events_decoded = getattr(listener, 'on_events_decoded', None)
+        self.on_client_disconnected = getattr(listener, 'on_client_disconnected', None)
+        self.on_event_source_disconnected = getattr(listener, 'on_event_source_disconnected', None)
+
+    def send(self, connection, data):
+        '''Sends given data over given connection; data for already closed connection are dropped.'''
+        self.send_many((connection,), data)
+
+    def send_many(self, connections, data):
+        '''Sends the same data over all given connections.'''
+        chunk = data + '\r\n'
+        size = len(chunk)
+        for connection in connections:
+            if connection.closed:
+                continue
+            if connection.dropping:
+                self.bytes_dropped += size
+                continue
+            connection.transport.write(chunk)
+            self.bytes_queued += size
+
+    def call_later(self, delay_s, callback):
+        '''Schedules callback to be called from the event loop in delay_s seconds; returns handle with cancel() method.'''
+        return self.loop.call_later(delay_s, callback)
+
+    def listen(self):
+        '''Starts listening on the event and client ports; returns future done when both ports are listened on.'''
+        servers = []
+        if self.event_port is not None:
+            servers.append(self.loop.create_server(lambda: _EventSourceProtocol(self), port=self.event_port,
+                                                   backlog=self.listen_backlog))
+        if self.client_port is not None:
+            servers.append(self.loop.create_server(lambda: _ClientProtocol(self), port=self.client_port,
+                                                   backlog=self.listen_backlog))
+        future = asyncio.Future(loop=self.loop)
+        # all of them are waited for, so that the ports listened on can be closed if another one fails
+        gathered = asyncio.gather(*[asyncio.ensure_future(s, loop=self.loop) for s in servers],
+                                  loop=self.loop, return_exceptions=True)
+        gathered.add_done_callback(lambda f: self._listening(f.result(), future))
+        return future
+
+    def close(self):
+        '''Stops listening and closes all connections; must be called from the event loop.'''
+        for server in self.servers:
+            server.close()
+        for protocol in list(self.event_sources):
+            protocol.transport.close()
+        for connection in list(self.clients):
+            connection.transport.close()
+
+    def start(self):
+        '''
+        Starts the event loop in a new thread; set_listener() must be called before this method.
+        Raises the error of listening on the ports (i.e. address in use), then the thread is not running.
+        '''
+        ready = threading.Event()
+        self.server_thread = threading.Thread(target=self.run, args=(ready,))
+        self.server_thread.start()
+        ready.wait()
+        if self.listen_error is not None:
+            self.server_thread.join()
+            raise self.listen_error
+
+    def run(self, ready=None):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.listen())
+        except Exception, e:
+            self.loop.close()
+            if ready is None:
+                raise
+            # to be raised by start() in the thread waiting for it
+            self.listen_error = e
+            return
+        finally:
+            if ready:
+                ready.set()
+        self.loop.run_forever()
+        # let transports finish closing
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+
+    def stop(self):
+        '''Requests the event loop thread to stop and waits for it to complete.'''
+        logging.info('AsyncServer: requesting event loop to stop ...')
+        self.loop.call_soon_threadsafe(self._stop)
+        self.server_thread.join()
+
+
+    def event_source_connected(self, protocol):
+        if self.max_event_sources is not None and len(self.event_sources) >= self.max_event_sources:
+            logging.warning('Too many event sources; rejecting connection.')
+            return False
+        self.event_sources.add(protocol)
+        return True
+
+    def event_source_disconnected(self, protocol):
+        if protocol in self.event_sources:
+            self.event_sources.remove(protocol)
+            if self.on_event_source_disconnected:
+                self.on_event_source_disconnected()
+
+    def events_received(self, msgs):
+        return self.on_events_received(msgs)
+
+    def client_connected(self, connection):
+        self.clients.add(connection)
+        if self.high_watermark is not None:
+            connection.transport.set_write_buffer_limits(self.high_watermark, self.low_watermark)
+
+    def client_disconnected(self, connection):
+        self.clients.discard(connection)
+        if self.on_client_disconnected:
+            self.on_client_disconnected(connection)
+
+    def slow_consumer(self, connection):
+        if self.slow_consumer_policy == 'drop_new':
+            connection.dropping = True
+        else:
+            logging.warning('Client is too slow; disconnecting.')
+            self.bytes_dropped += connection.transport.get_write_buffer_size()
+            self.slow_consumers_disconnected += 1
+            connection.transport.abort()
+
+    def _listening(self, results, future):
+        errors = [r for r in results if isinstance(r, Exception)]
+        self.servers = [r for r in results if not isinstance(r, Exception)]
+        if errors:
+            self.close()
+            self.servers = []
+            future.set_exception(errors[0])
+        else:
+            future.set_result(self.servers)
+
+    def _stop(self):
+        self.close()
+        self.loop.stop()
+
+    def _events_received_one_by_one(self, msgs):
+        for msg in msgs:
+            if not self.listener.on_event_received(msg):
+                return False
+        return True
@@ -0,0 +1,120 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+from collections import deque
+from itertools import islice
+
+
+class OutputQueue(object):
+    '''
+    Data waiting to be written to a socket, kept as a queue of immutable chunks.
+    Chunks are never copied on append, so the same chunk can be queued on many connections;
+    partially written head chunk is tracked by offset instead of being sliced.
+    '''
+
+    # small chunks are coalesced into one send() call up to this size
+    coalesce_limit = 64 * 1024
+
+    __slots__ = ('chunks', 'offset', 'size')
+
+    def __init__(self):
+        self.chunks = deque()
+        self.offset = 0
+        self.size = 0
+
+    def __len__(self):
+        '''Returns number of bytes waiting to be written.'''
+        return self.size
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+
+    def clear(self):
+        self.chunks.clear()
+        self.offset = 0
+        self.size = 0
+
+    def drop_oldest(self, max_size):
+        '''
+        Drops oldest chunks until at most max_size bytes are queued; partially written chunk is never dropped.
+        Returns number of bytes dropped.
+        '''
+        chunks = self.chunks
+        head = chunks.popleft() if self.offset else None
+        dropped = 0
+        while chunks and self.size > max_size:
+            n = len(chunks.popleft())
+            self.size -= n
+            dropped += n
+        if head is not None:
+            chunks.appendleft(head)
+        return dropped
+
+    def write_to(self, sock):
+        '''Writes as much of queued data to the socket as it accepts in one call; returns number of bytes written.'''
+        chunks = self.chunks
+        head = chunks[0]
+        if len(chunks) == 1 or len(head) - self.offset >= self.coalesce_limit:
+            data = buffer(head, self.offset) if self.offset else head
+        else:
+            parts = [head[self.offset:] if self.offset else head]
+            size = len(parts[0])
+            for chunk in islice(chunks, 1, None):
+                if size >= self.coalesce_limit:
+                    break
+                parts.append(chunk)
+                size += len(chunk)
+            data = ''.join(parts)
+        sent = sock.send(data)
+        self._consume(sent)
+        return sent
+
+    def _consume(self, n):
+        self.size -= n
+        n += self.offset
+        chunks = self.chunks
+        while chunks and n >= len(chunks[0]):
+            n -= len(chunks.popleft())
+        self.offset = n
+
+
+class Connection(object):
+    '''
+    Socket managed by the server together with its state: role, input and output buffers,
+    and the set of events it is registered for in the poller.
+    '''
+
+    # roles
+    EVENT_CONTROL = 'event control'
+    CLIENT_CONTROL = 'client control'
+    SERVICE = 'service'
+    # event source whose framing (text or binary) is not known yet
+    NEW_EVENT_SOURCE = 'new event source'
+    EVENT_SOURCE = 'event source'
+    BINARY_EVENT_SOURCE = 'binary event source'
+    CLIENT = 'client'
+    # client whose id has been received; only disconnect is expected from it
+    REGISTERED_CLIENT = 'registered client'
+    METRICS_CONTROL = 'metrics control'
+    # HTTP client requesting metrics
+    METRICS_CLIENT = 'metrics client'
+
+    __slots__ = ('sock', 'fd', 'role', 'inbuf', 'outbuf', 'events', 'closed', 'dropping')
+
+    def __init__(self, sock, role):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.role = role
+        self.inbuf = ''
+        self.outbuf = OutputQueue()
+        self.events = 0
+        self.closed = False
+        # whether new output is being dropped because the client is too slow
+        self.dropping = False
+
+    def fileno(self):
+        return self.fd
+
+    def __repr__(self):
+        return '<Connection fd=%d role=%s>' % (self.fd, self.role)
@@ -3,52 +3,79 @@
 
 import heapq
 import time
+from operator import itemgetter
 
 
-class Event(object):
-    '''Event is a convenient interface for working with data that comes from event source.'''
+# command codes
+FOLLOW, UNFOLLOW, BROADCAST, PRIVATE, STATUS_UPDATE = range(5)
 
+_tuple_new = tuple.__new__
+
+
+class Event(tuple):
+    '''
+    Event is a convenient interface for working with data that comes from event source.
+    It is a tuple starting with the sequence number, so events are ordered by sequence number
+    without Python-level comparison.
+    '''
+
+    __slots__ = ()
+    _fields = ('sequence_num', 'code', 'from_user', 'to_user', 'message')
+
+    sequence_num = property(itemgetter(0))
+    code = property(itemgetter(1))
+    from_user = property(itemgetter(2))
+    to_user = property(itemgetter(3))
+    message = property(itemgetter(4))
+
+    command_codes = { 'F': FOLLOW, 'U': UNFOLLOW, 'B': BROADCAST, 'P': PRIVATE, 'S': STATUS_UPDATE }
     command_lengths = { 'F': 4, 'U': 4, 'B': 2, 'P': 4, 'S': 3 }
 
-    def __init__(self, message, sequence_num, command, from_user=None, to_user=None):
-        self.message = message
-        self.sequence_num = int(sequence_num)
-        self.code = command
-        self.from_user = from_user
-        self.to_user = to_user
+    # command letter -> (command code, number of tokens)
+    _commands = { 'F': (FOLLOW, 4), 'U': (UNFOLLOW, 4), 'B': (BROADCAST, 2), 'P': (PRIVATE, 4), 'S': (STATUS_UPDATE, 3) }
 
-    def __lt__(self, other):
-        return self.sequence_num < other.sequence_num
+    def __new__(cls, message, sequence_num, command, from_user=None, to_user=None):
+        '''command is either a command letter (one of 'FUBPS') or a command code.'''
+        return _tuple_new(cls, (int(sequence_num), Event.command_codes.get(command, command), from_user, to_user, message))
+
+    def __repr__(self):
+        return 'Event(%r)' % self.message
 
     @classmethod
     def from_string(cls, message):
-        '''Constructs Event from the message, or raises ValueError if the message is of incorrect format.'''
-
-        def validate(tokens):
-            # there should be at least 2 tokens
-            if len(tokens) < 2:
-                raise ValueError("invalid command; event: '%s'" % message)
+        '''
+        Constructs Event from the message, or raises ValueError if the message is of incorrect format.
+        User ids are interned, so all events mentioning the same user share one id string.
+        '''
+        tokens = message.split('|')
+        length = len(tokens)
 
-            # 0th token should be a number
-            int(tokens[0])
+        # there should be at least 2 tokens
+        # 1st token should be a valid command code: one of 'FUBPS'
+        command = Event._commands.get(tokens[1]) if length > 1 else None
+        if not command:
+            raise ValueError("invalid command; event: '%s'" % message)
 
-            # 1st token should be a valid command code: one of 'FUBPS'
-            # number of tokens in command should be correct for the given command code
-            length = Event.command_lengths.get(tokens[1])
-            if not length:
-                raise ValueError("invalid command code; event: '%s'" % message)
-            if len(tokens) != length:
-                raise ValueError("invalid command length; event: '%s'" % message)
+        # number of tokens in command should be correct for the given command code
+        code, expected_length = command
+        if length != expected_length:
+            raise ValueError("invalid command length; event: '%s'" % message)
 
-            # 2nd and 3rd tokens should not be empty if they are present
-            for token in [tokens[i] for i in range(2, length)]:
-                if not token:
-                    raise ValueError("empty value for user id; event: '%s'" % message)
+        # 0th token should be a number
+        sequence_num = int(tokens[0])
 
-        tokens = message.split('|')
-        validate(tokens)
-        
-        return Event(message, *tokens)
+        # 2nd and 3rd tokens should not be empty if they are present
+        if length == 2:
+            return _tuple_new(cls, (sequence_num, code, None, None, message))
+        from_user = tokens[2]
+        if not from_user:
+            raise ValueError("empty value for user id; event: '%s'" % message)
+        if length == 3:
+            return _tuple_new(cls, (sequence_num, code, intern(from_user), None, message))
+        to_user = tokens[3]
+        if not to_user:
+            raise ValueError("empty value for user id; event: '%s'" % message)
+        return _tuple_new(cls, (sequence_num, code, intern(from_user), intern(to_user), message))
 
 
 class EventQueue(object):
@@ -65,6 +92,15 @@ class EventQueue(object):
         self.timeout_s = timeout_s
         self.last_sent_timestamp_s = None
 
+        self.scheduler = None
+        self.gap = None
+        self.gap_timer = None
+        self.gap_timed_out = False
+
+        # statistics of giving up on missing events
+        self.gaps_skipped = 0
+        self.events_skipped = 0
+
     def set_handler(self, handler):
         '''
         Sets handler that is notified when next (in the correct order) event is ready.
@@ -72,6 +108,19 @@ class EventQueue(object):
         '''
         self.handler = handler
 
+    def set_scheduler(self, scheduler):
+        '''
+        Sets scheduler used for timeouts instead of checking the clock in poll(), so that the events
+        waiting behind a gap are released on time even if poll() is not called.
+        scheduler should implement call_later(delay_s, callback) method returning object with cancel() method
+        (Server does).
+        '''
+        self.scheduler = scheduler
+
+    def __len__(self):
+        '''Returns number of buffered out-of-order events.'''
+        return len(self.queue)
+
 
     def add(self, event):
         '''Adds event for processing.'''
@@ -93,15 +142,134 @@ class EventQueue(object):
                 self.waiting_for += 1
             # no, but cannot wait for it any longer
             elif self._capacity_exceeded() or self._timeout_occured():
-                self.waiting_for = self.queue[0].sequence_num
-            # no, update timestamp and exit
+                self._skip_to(self.queue[0].sequence_num)
+            # no, start waiting and exit
             else:
-                self.last_sent_timestamp_s = time.time()
+                self._wait()
                 break
+        else:
+            self._stop_waiting()
 
     def _capacity_exceeded(self):
-        return self.max_capacity and len(self.queue) > self.max_capacity
+        return self.max_capacity and len(self) > self.max_capacity
 
     def _timeout_occured(self):
+        if self.scheduler:
+            return self.gap_timed_out
         return self.timeout_s and self.last_sent_timestamp_s \
             and time.time() - self.last_sent_timestamp_s > self.timeout_s
+
+    def _skip_to(self, sequence_num):
+        self.gaps_skipped += 1
+        self.events_skipped += sequence_num - self.waiting_for
+        self.waiting_for = sequence_num
+        self.gap_timed_out = False
+
+    def _wait(self):
+        '''Called when poll() is blocked waiting for the event number self.waiting_for.'''
+        if not self.scheduler:
+            self.last_sent_timestamp_s = time.time()
+        elif self.timeout_s and self.gap != self.waiting_for:
+            # new gap: restart the timer
+            self._stop_waiting()
+            self.gap = self.waiting_for
+            self.gap_timer = self.scheduler.call_later(self.timeout_s, self._on_gap_timeout)
+
+    def _stop_waiting(self):
+        if self.gap_timer:
+            self.gap_timer.cancel()
+            self.gap_timer = None
+        self.gap = None
+
+    def _on_gap_timeout(self):
+        self.gap_timer = None
+        if self.gap == self.waiting_for:
+            self.gap_timed_out = True
+            self.poll()
+
+
+class WindowEventQueue(EventQueue):
+    '''
+    EventQueue that keeps events of the next window_size sequence numbers in a ring buffer
+    indexed by sequence number, so adding them and dispatching them in order takes constant time.
+    Events further in the future (and duplicates) fall back to the heap of EventQueue.
+    Late events, whose sequence number has already been skipped, are dispatched as soon as possible.
+    '''
+
+    def __init__(self, max_capacity=None, timeout_s=None, window_size=4096):
+        EventQueue.__init__(self, max_capacity, timeout_s)
+        self.window_size = window_size
+        self.window = [None] * window_size
+        self.window_count = 0
+
+    def __len__(self):
+        return self.window_count + len(self.queue)
+
+
+    def add(self, event):
+        '''Adds event for processing.'''
+        sequence_num = event.sequence_num
+        if 0 <= sequence_num - self.waiting_for < self.window_size:
+            i = sequence_num % self.window_size
+            if self.window[i] is None:
+                self.window[i] = event
+                self.window_count += 1
+                return
+        heapq.heappush(self.queue, event)
+
+
+    def poll(self):
+        '''
+        Checks if an event that has been waited for arrived and if so, sends it and repeats.
+        Also handles buffer capacity and timeouts.
+        '''
+        window = self.window
+        queue = self.queue
+        while self.window_count or queue:
+            i = self.waiting_for % self.window_size
+            event = window[i]
+            # is the event that has been waited for in the window?
+            if event is not None:
+                window[i] = None
+                self.window_count -= 1
+            # is it (or a late one) in the heap?
+            elif queue and queue[0].sequence_num <= self.waiting_for:
+                event = heapq.heappop(queue)
+            # no, but cannot wait for it any longer
+            elif self._capacity_exceeded() or self._timeout_occured():
+                self._skip_to(self._first_buffered())
+                continue
+            # no, start waiting and exit
+            else:
+                self._wait()
+                break
+
+            self.handler.on_event(event)
+            if event.sequence_num == self.waiting_for:
+                self.waiting_for += 1
+        else:
+            self._stop_waiting()
+
+    def _first_buffered(self):
+        first = queue_first = self.queue[0].sequence_num if self.queue else None
+        if self.window_count:
+            end = self.waiting_for + self.window_size
+            if queue_first is not None:
+                end = min(end, queue_first)
+            for sequence_num in xrange(self.waiting_for, end):
+                if self.window[sequence_num % self.window_size] is not None:
+                    first = sequence_num
+                    break
+        return first
+
+
+def make_event_queue(name=None, max_capacity=None, timeout_s=None, window_size=4096):
+    '''
+    Creates event queue by name: 'heap' for EventQueue (the default) or 'window' for WindowEventQueue.
+    window_size is ignored by the heap queue.
+    '''
+    if name is None or name == 'heap':
+        return EventQueue(max_capacity, timeout_s)
+    if name == 'window':
+        return WindowEventQueue(max_capacity, timeout_s, window_size)
+    raise ValueError("unknown event queue: '%s'" % name)
@@ -2,8 +2,13 @@
 # This file is a part of my solution for 'follower-maze' challenge by SoundCloud
 
 import logging
+import time
 
-from followermaze.event import Event
+from followermaze.event import Event, FOLLOW, UNFOLLOW, BROADCAST, PRIVATE, STATUS_UPDATE
+
+
+# places where events are traced; each of them is sampled separately
+_TRACE_RECEIVED, _TRACE_RECEIVED_BATCH, _TRACE_DECODED, _TRACE_PROCESSING = range(4)
 
 
 class EventHandler(object):
@@ -11,74 +16,178 @@ class EventHandler(object):
     Serves as a controller between the system components.
     Listens to events from the server, dispatches them for reordering and then processes them,
     possibly sending notifications back using the server.
+
+    Every event is traced at INFO level; with trace_every greater than 1 only every trace_every-th one is
+    (every trace_every-th batch for batches), counted separately for events received and processed,
+    so that the trace can be kept on under load. When INFO is disabled the trace costs one attribute check
+    per event; update_log_level() must be called if the level changes after the handler is created.
+
+    If event_latency is set to a histogram (see followermaze.metrics.instrument()), the time from receiving
+    each event to passing its notifications to the server is observed in it.
     '''
 
-    def __init__(self, graph, server, queue):
+    def __init__(self, graph, server, queue, trace_every=1):
         self.graph = graph
         self.server = server
         self.queue = queue
+        # connection -> id of the user registered with it
+        self.client_ids = {}
+        # statistics of event strings received from the event source
+        self.events_parsed = 0
+        self.events_rejected = 0
+
+        # histogram of event latency; measured only if set
+        self.event_latency = None
+        # sequence number -> time the event was received, for events in the queue; kept only if measured
+        self.received_at = {}
+        self.received_time = None
+
+        # event code -> method processing it
+        self.dispatch = {
+            FOLLOW: self.follow,
+            UNFOLLOW: self.unfollow,
+            BROADCAST: self.broadcast,
+            PRIVATE: self.private,
+            STATUS_UPDATE: self.status_update,
+        }
+
+        self.trace_every = trace_every
+        # trace place -> number of traces to skip before the next one is logged, plus one
+        self.trace_countdowns = [1] * 4
+        self.update_log_level()
+
+    def update_log_level(self):
+        '''Caches whether the event trace is enabled, as checking the logging level for every event is not free.'''
+        self.trace = logging.getLogger().isEnabledFor(logging.INFO)
 
     def on_client_id_received(self, connection, msg):
         '''
         Called by server when new client id is received.
         Return value False interpreted by server as a reject to accept more messages from this connection.
         '''
-        logging.info("EventHandler: new client id received from server: '%s'" % msg)
+        logging.info("EventHandler: new client id received from server: '%s'", msg)
         self.graph.register_user(msg, connection=connection)
+        self.client_ids[connection] = msg
         return False
 
+    def on_client_disconnected(self, connection):
+        '''Called by server when user client disconnects.'''
+        user_id = self.client_ids.pop(connection, None)
+        if user_id is None:
+            return
+        logging.info("EventHandler: client '%s' disconnected", user_id)
+        # the user could have reconnected with another connection meanwhile
+        if getattr(self.graph.get_user(user_id), 'connection', None) is connection:
+            self.graph.disconnect_user(user_id)
+
     def on_event_received(self, msg):
         '''
         Called by server when new message from event source is received.
         Return value False interpreted by server as a reject to accept more events from this connection.
         '''
-        logging.info("EventHandler: new event string received from server: '%s'" % msg)
+        if self.trace:
+            self._trace(_TRACE_RECEIVED, "EventHandler: new event string received from server: '%s'", msg)
         try:
             event = Event.from_string(msg)
-            self.queue.add(event)
+            if self.event_latency is not None:
+                self.received_time = time.time()
+                self._add_received(event)
+            else:
+                self.queue.add(event)
+            self.events_parsed += 1
+            return True
+        except ValueError, v:
+            self.events_rejected += 1
+            logging.warning("EventHandler: Bad event string; error text: '%s'", v)
+            return False
+
+    def on_events_received(self, msgs):
+        '''
+        Batch version of on_event_received(): called by server with all complete messages received at once.
+        Messages preceding the malformed one are still accepted.
+        '''
+        if self.trace:
+            self._trace(_TRACE_RECEIVED_BATCH, "EventHandler: %d event strings received from server", len(msgs))
+        add = self._add_received_at_now() if self.event_latency is not None else self.queue.add
+        from_string = Event.from_string
+        try:
+            for msg in msgs:
+                add(from_string(msg))
+            self.events_parsed += len(msgs)
             return True
         except ValueError, v:
-            logging.warning("EventHandler: Bad event string; error text: '%s'" % v)
+            # the first occurrence of the malformed message is the one that failed
+            self.events_parsed += msgs.index(msg)
+            self.events_rejected += 1
+            logging.warning("EventHandler: Bad event string; error text: '%s'", v)
             return False
 
+    def on_events_decoded(self, events):
+        '''Called by server with events received from an event source using binary framing.'''
+        if self.trace:
+            self._trace(_TRACE_DECODED, "EventHandler: %d binary events received from server", len(events))
+        add = self._add_received_at_now() if self.event_latency is not None else self.queue.add
+        for event in events:
+            add(event)
+        self.events_parsed += len(events)
+        return True
+
     def on_poll(self):
         '''Called by server after some data are received over network.'''
         self.queue.poll()
 
     def on_event(self, event):
         '''Called by event queue when new event can be processed.'''
-        logging.info("EventHandler: processing event '%s'" % event.message)
-        if event.code == 'F':
-            self.follow(event)
-        elif event.code == 'U':
-            self.unfollow(event)
-        elif event.code == 'B':
-            self.broadcast(event)
-        elif event.code == 'P':
-            self.private(event)
-        elif event.code == 'S':
-            self.status_update(event)
+        if self.trace:
+            self._trace(_TRACE_PROCESSING, "EventHandler: processing event '%s'", event.message)
+        self.dispatch[event.code](event)
+        if self.event_latency is not None:
+            received = self.received_at.pop(event.sequence_num, None)
+            if received is not None:
+                self.event_latency.observe(time.time() - received)
 
     def follow(self, event):
-        user = self.graph.user(event.to_user)
-        user.add_follower(event.from_user)
-        self.notify(user, event.message)
+        user = self.graph.add_follower(event.to_user, event.from_user)
+        self.notify(user, event)
 
     def unfollow(self, event):
-        self.graph.user(event.to_user).remove_follower(event.from_user)
+        self.graph.remove_follower(event.to_user, event.from_user)
 
     def broadcast(self, event):
-        for u in self.graph.all_users():
-            self.notify(u, event.message)
+        self.notify_many(self.graph.connected_users(), event)
 
     def private(self, event):
-        self.notify(self.graph.user(event.to_user), event.message)
+        self.notify(self.graph.get_user(event.to_user), event)
 
     def status_update(self, event):
-        for u in self.graph.followers_of(event.from_user):
-            self.notify(u, event.message)
+        self.notify_many(self.graph.connected_followers(event.from_user), event)
 
-    def notify(self, user, msg):
+    # message of the event is only taken when there is someone to send it to,
+    # as events decoded from binary framing format it on demand
+
+    def notify(self, user, event):
         connection = getattr(user, 'connection', None)
         if connection:
-            self.server.send(connection, msg)
+            self.server.send(connection, event.message)
+
+    def notify_many(self, users, event):
+        connections = [c for c in (getattr(u, 'connection', None) for u in users) if c]
+        if connections:
+            self.server.send_many(connections, event.message)
+
+    def _add_received_at_now(self):
+        '''Returns function adding events to the queue with the current time as their receive time.'''
+        # one clock reading for all events received at once
+        self.received_time = time.time()
+        return self._add_received
+
+    def _add_received(self, event):
+        self.received_at[event.sequence_num] = self.received_time
+        self.queue.add(event)
+
+    def _trace(self, place, msg, arg):
+        countdowns = self.trace_countdowns
+        countdowns[place] -= 1
+        if not countdowns[place]:
+            countdowns[place] = self.trace_every
+            logging.info(msg, arg)
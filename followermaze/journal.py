@@ -0,0 +1,217 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import logging
+import mmap
+import os
+import os.path
+
+from followermaze.event import Event, FOLLOW, UNFOLLOW
+from followermaze.usergraph import CompactUserGraph, is_csr_snapshot
+
+
+SNAPSHOT_MAGIC = 'FMSNAP1\n'
+
+
+def _fsync(f):
+    f.flush()
+    getattr(os, 'fdatasync', os.fsync)(f.fileno())
+
+
+def _fsync_directory(path):
+    '''Makes renames and new files in the directory durable.'''
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _mapped_lines(f):
+    '''Yields complete lines of the file (without the newline) using memory mapping; returns nothing for empty file.'''
+    size = os.fstat(f.fileno()).st_size
+    if not size:
+        return
+    mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    try:
+        for line in iter(mm.readline, ''):
+            if line.endswith('\n'):
+                yield line[:-1]
+    finally:
+        mm.close()
+
+
+class Journal(object):
+    '''
+    Write-ahead journal of events applied by the handler, kept with periodic snapshots of the user graph
+    so that the graph and the awaited sequence number survive a restart.
+
+    Set it as the handler of the event queue in front of the real handler: every event is appended
+    to the current journal file before being passed on. Writes are buffered and synced to disk once
+    per sync_every events, and by a timer every sync_interval_s seconds if a scheduler is set.
+    After snapshot_every events the graph is written to a snapshot and a new journal file is started;
+    older files are deleted. recover() loads the latest snapshot and replays the journal written after it,
+    so recovery takes time proportional to the events since the last snapshot.
+
+    Files in directory are named by the first sequence number they do not cover:
+    snapshot-N holds the graph after all events before N, journal-N the events applied after it.
+    Graphs that can write snapshots themselves (CompactUserGraph) are saved in their binary format,
+    which is loaded by memory mapping without rebuilding the followers; others are saved as text.
+    '''
+
+    def __init__(self, directory, handler, graph, sync_every=1000, sync_interval_s=1.0, snapshot_every=1000000):
+        self.directory = directory
+        self.handler = handler
+        self.graph = graph
+        self.sync_every = sync_every
+        self.sync_interval_s = sync_interval_s
+        self.snapshot_every = snapshot_every
+
+        self.file = None
+        self.unsynced = 0
+        self.since_snapshot = 0
+        # next sequence number after the applied ones
+        self.next_sequence_num = 1
+        self.scheduler = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def set_scheduler(self, scheduler):
+        '''Sets scheduler (i.e. Server) used to sync the journal periodically; see EventQueue.set_scheduler().'''
+        self.scheduler = scheduler
+        scheduler.call_later(self.sync_interval_s, self._on_sync_timer)
+
+    def recover(self, queue=None):
+        '''
+        Restores the graph from the latest snapshot and the journal after it, and opens the journal for appending.
+        If queue is given, it is set to wait for the event following the last applied one.
+        Returns number of events replayed from the journal.
+        '''
+        snapshots = self._files('snapshot')
+        start = 1
+        if snapshots:
+            start = snapshots[-1]
+            self._load_snapshot(self._path('snapshot', start))
+        self.next_sequence_num = start
+
+        replayed = 0
+        journals = [n for n in self._files('journal') if n >= start]
+        for n in journals:
+            replayed += self._replay(self._path('journal', n))
+        self.since_snapshot = replayed
+        if queue is not None:
+            queue.waiting_for = self.next_sequence_num
+
+        self._open(journals[-1] if journals else start)
+        logging.info('Journal: recovered up to event %d; %d events replayed', self.next_sequence_num - 1, replayed)
+        return replayed
+
+    def on_event(self, event):
+        self.file.write(event.message + '\n')
+        self.handler.on_event(event)
+        if event.sequence_num >= self.next_sequence_num:
+            self.next_sequence_num = event.sequence_num + 1
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+        self.since_snapshot += 1
+        if self.since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def sync(self):
+        '''Writes buffered events to disk.'''
+        if self.unsynced:
+            _fsync(self.file)
+            self.unsynced = 0
+
+    def snapshot(self):
+        '''Writes snapshot of the graph, starts new journal file and deletes the older files.'''
+        self.sync()
+        start = self.next_sequence_num
+        path = self._path('snapshot', start)
+        with open(path + '.tmp', 'wb') as f:
+            if hasattr(self.graph, 'write_snapshot'):
+                self.graph.write_snapshot(f)
+            else:
+                f.write(SNAPSHOT_MAGIC)
+                f.write('%d\n' % start)
+                for user_id, followers in self.graph.iter_edges():
+                    f.write('%s|%s\n' % (user_id, '|'.join(followers)))
+            _fsync(f)
+        os.rename(path + '.tmp', path)
+
+        self.file.close()
+        self._open(start)
+        # the snapshot and the new journal must be on disk before the files they replace are deleted
+        _fsync_directory(self.directory)
+        self.since_snapshot = 0
+        for kind in 'snapshot', 'journal':
+            for n in self._files(kind):
+                if n < start:
+                    os.remove(self._path(kind, n))
+        logging.info('Journal: snapshot taken before event %d', start)
+
+    def close(self):
+        if self.file:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+    def _open(self, n):
+        self.file = open(self._path('journal', n), 'ab', 64 * 1024)
+
+    def _path(self, kind, n):
+        return os.path.join(self.directory, '%s-%012d' % (kind, n))
+
+    def _files(self, kind):
+        '''Returns sorted sequence numbers of the files of given kind.'''
+        prefix = kind + '-'
+        return sorted(int(name[len(prefix):]) for name in os.listdir(self.directory)
+                      if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+    def _load_snapshot(self, path):
+        if is_csr_snapshot(path):
+            if hasattr(self.graph, 'load_snapshot'):
+                self.graph.load_snapshot(path)
+                return
+            # the graph kind was changed since the snapshot was taken
+            graph = CompactUserGraph()
+            graph.load_snapshot(path)
+            for user_id, followers in graph.iter_edges():
+                self.graph.add_followers(user_id, followers)
+            return
+        with open(path, 'rb') as f:
+            lines = _mapped_lines(f)
+            if next(lines, None) != SNAPSHOT_MAGIC[:-1]:
+                raise ValueError("not a snapshot: '%s'" % path)
+            int(next(lines))
+            add_followers = self.graph.add_followers
+            for line in lines:
+                ids = line.split('|')
+                add_followers(ids[0], ids[1:])
+
+    def _replay(self, path):
+        graph = self.graph
+        replayed = 0
+        with open(path, 'r+b') as f:
+            end = 0
+            for msg in _mapped_lines(f):
+                event = Event.from_string(msg)
+                if event.code == FOLLOW:
+                    graph.add_follower(event.to_user, event.from_user)
+                elif event.code == UNFOLLOW:
+                    graph.remove_follower(event.to_user, event.from_user)
+                if event.sequence_num >= self.next_sequence_num:
+                    self.next_sequence_num = event.sequence_num + 1
+                replayed += 1
+                end += len(msg) + 1
+            # drop the line that was being written when the process stopped
+            if os.fstat(f.fileno()).st_size > end:
+                logging.warning("Journal: incomplete last event in '%s' dropped", path)
+                f.truncate(end)
+        return replayed
+
+    def _on_sync_timer(self):
+        self.sync()
+        self.scheduler.call_later(self.sync_interval_s, self._on_sync_timer)
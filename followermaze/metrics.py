@@ -0,0 +1,169 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+from bisect import bisect_left
+
+
+class Counter(object):
+    '''Monotonically increasing value.'''
+
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def samples(self):
+        return [(self.name, '', self.value)]
+
+
+class Gauge(Counter):
+    '''Value that can go up and down.'''
+
+    type = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, n=1):
+        self.value -= n
+
+
+class CallbackMetric(object):
+    '''
+    Counter or gauge whose value is read from the callback when metrics are collected.
+    Lets components keep plain integer attributes on their hot paths instead of calling into the registry.
+    '''
+
+    def __init__(self, name, help, type, callback):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.callback = callback
+
+    def samples(self):
+        return [(self.name, '', self.callback())]
+
+
+class Histogram(object):
+    '''Distribution of observed values (e.g. durations in seconds) over fixed buckets.'''
+
+    type = 'histogram'
+
+    default_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, name, help, buckets=None):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets or self.default_buckets)
+        # the last one counts values above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            samples.append((self.name + '_bucket', '{le="%r"}' % bound, cumulative))
+        samples.append((self.name + '_bucket', '{le="+Inf"}', self.count))
+        samples.append((self.name + '_sum', '', self.sum))
+        samples.append((self.name + '_count', '', self.count))
+        return samples
+
+
+class Registry(object):
+    '''
+    Collection of named metrics that can be rendered in Prometheus text exposition format.
+    Metrics are updated from the polling thread and must be rendered from it as well.
+    '''
+
+    def __init__(self):
+        self.metrics = []
+        self.names = set()
+
+    def counter(self, name, help, callback=None):
+        '''Returns new Counter; if callback is given, the value is read from it instead.'''
+        if callback:
+            return self._add(CallbackMetric(name, help, 'counter', callback))
+        return self._add(Counter(name, help))
+
+    def gauge(self, name, help, callback=None):
+        '''Returns new Gauge; if callback is given, the value is read from it instead.'''
+        if callback:
+            return self._add(CallbackMetric(name, help, 'gauge', callback))
+        return self._add(Gauge(name, help))
+
+    def histogram(self, name, help, buckets=None):
+        return self._add(Histogram(name, help, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, labels, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def _add(self, metric):
+        if metric.name in self.names:
+            raise ValueError("duplicate metric: '%s'" % metric.name)
+        self.names.add(metric.name)
+        self.metrics.append(metric)
+        return metric
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def instrument(registry, server=None, handler=None, queue=None, graph=None):
+    '''
+    Registers metrics of the given components in the registry.
+    The components count things in their own attributes; only the histograms of poll handling time
+    and of event latency are updated through the registry, and only while they are set on the server
+    and on the handler.
+    '''
+    if handler is not None:
+        registry.counter('followermaze_events_parsed_total', 'Events received from the event source and parsed.',
+                         lambda: handler.events_parsed)
+        registry.counter('followermaze_events_rejected_total', 'Malformed events received from the event source.',
+                         lambda: handler.events_rejected)
+        handler.event_latency = registry.histogram('followermaze_event_latency_seconds',
+                                                   'Time from receiving an event to passing its notifications to the server.')
+    if queue is not None:
+        registry.gauge('followermaze_event_queue_depth', 'Out-of-order events buffered in the event queue.',
+                       lambda: len(queue))
+        registry.counter('followermaze_event_queue_gaps_skipped_total',
+                         'Gaps in sequence numbers given up on because of queue capacity or timeout.',
+                         lambda: queue.gaps_skipped)
+        registry.counter('followermaze_event_queue_events_skipped_total',
+                         'Sequence numbers given up on because of queue capacity or timeout.',
+                         lambda: queue.events_skipped)
+    if graph is not None:
+        registry.gauge('followermaze_clients_connected', 'Users with a connected client.',
+                       lambda: len(graph.connected))
+    if server is not None:
+        registry.gauge('followermaze_output_pending_bytes', 'Bytes buffered for sending to clients.',
+                       lambda: sum(len(c.outbuf) for c in server.connections.itervalues()))
+        registry.counter('followermaze_output_queued_bytes_total', 'Bytes queued for sending to clients.',
+                         lambda: server.bytes_queued)
+        registry.counter('followermaze_output_dropped_bytes_total', 'Bytes dropped because clients were too slow.',
+                         lambda: server.bytes_dropped)
+        registry.counter('followermaze_slow_consumers_disconnected_total', 'Clients disconnected for being too slow.',
+                         lambda: server.slow_consumers_disconnected)
+        server.poll_time = registry.histogram('followermaze_poll_handling_seconds',
+                                              'Time spent handling the sockets ready after one poll.')
@@ -0,0 +1,132 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import select
+
+
+READ = 1
+WRITE = 2
+ERROR = 4
+
+
+class SelectPoller(object):
+    '''
+    Poller backed by select(); works everywhere but is limited by FD_SETSIZE
+    and its cost per wakeup grows with the number of registered sockets.
+    '''
+
+    def __init__(self):
+        self.readers = set()
+        self.writers = set()
+
+    def register(self, s, events):
+        '''Starts watching socket s for the given events (a combination of READ and WRITE).'''
+        self.modify(s, events)
+
+    def modify(self, s, events):
+        '''Changes the set of events socket s is watched for.'''
+        if events & READ:
+            self.readers.add(s)
+        else:
+            self.readers.discard(s)
+        if events & WRITE:
+            self.writers.add(s)
+        else:
+            self.writers.discard(s)
+
+    def unregister(self, s):
+        '''Stops watching socket s.'''
+        self.readers.discard(s)
+        self.writers.discard(s)
+
+    def poll(self, timeout=None):
+        '''
+        Waits until some of the registered sockets are ready or timeout (in seconds) expires.
+        Returns list of (socket, events) pairs.
+        '''
+        r, w, e = select.select(self.readers, self.writers, self.readers, timeout)
+        ready = {}
+        for s in r:
+            ready[s] = READ
+        for s in w:
+            ready[s] = ready.get(s, 0) | WRITE
+        for s in e:
+            ready[s] = ready.get(s, 0) | ERROR
+        return ready.items()
+
+    def close(self):
+        self.readers.clear()
+        self.writers.clear()
+
+
+class EpollPoller(object):
+    '''
+    Poller backed by epoll(); registrations are kept in the kernel,
+    so cost per wakeup depends on the number of ready sockets only.
+    '''
+
+    def __init__(self):
+        self.epoll = select.epoll()
+        self.sockets = {}
+
+    def register(self, s, events):
+        '''Starts watching socket s for the given events (a combination of READ and WRITE).'''
+        fd = s.fileno()
+        self.epoll.register(fd, self._to_epoll(events))
+        self.sockets[fd] = s
+
+    def modify(self, s, events):
+        '''Changes the set of events socket s is watched for.'''
+        self.epoll.modify(s.fileno(), self._to_epoll(events))
+
+    def unregister(self, s):
+        '''Stops watching socket s.'''
+        fd = s.fileno()
+        if self.sockets.pop(fd, None) is not None:
+            self.epoll.unregister(fd)
+
+    def poll(self, timeout=None):
+        '''
+        Waits until some of the registered sockets are ready or timeout (in seconds) expires.
+        Returns list of (socket, events) pairs.
+        '''
+        if timeout is None:
+            timeout = -1
+        ready = []
+        for fd, ev in self.epoll.poll(timeout):
+            events = 0
+            if ev & select.EPOLLIN:
+                events |= READ
+            if ev & select.EPOLLOUT:
+                events |= WRITE
+            if ev & (select.EPOLLERR | select.EPOLLHUP):
+                events |= ERROR
+            ready.append((self.sockets[fd], events))
+        return ready
+
+    def close(self):
+        self.sockets.clear()
+        self.epoll.close()
+
+    @staticmethod
+    def _to_epoll(events):
+        mask = 0
+        if events & READ:
+            mask |= select.EPOLLIN
+        if events & WRITE:
+            mask |= select.EPOLLOUT
+        return mask
+
+
+def make_poller(name=None):
+    '''
+    Creates poller by name ('epoll' or 'select').
+    If name is not given, the best poller available on this platform is used.
+    '''
+    if name is None:
+        name = 'epoll' if hasattr(select, 'epoll') else 'select'
+    if name == 'epoll':
+        return EpollPoller()
+    if name == 'select':
+        return SelectPoller()
+    raise ValueError("unknown poller: '%s'" % name)
@@ -0,0 +1,213 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+'''
+Recording of the event source traffic and its offline replay through the event processing pipeline.
+
+A recording is a text file with one event message per line, in the order the server received them
+(events from all event sources interleaved, binary framed ones converted to text).
+Replay feeds it through Event parsing, EventQueue and EventHandler exactly as the server does,
+but without sockets: messages to user clients go to a CountingSink.
+'''
+
+import mmap
+import os
+import time
+
+from followermaze.event import Event, FOLLOW, UNFOLLOW, BROADCAST, PRIVATE, STATUS_UPDATE
+from followermaze.eventhandler import EventHandler
+
+
+COMMAND_NAMES = {FOLLOW: 'follow', UNFOLLOW: 'unfollow', BROADCAST: 'broadcast',
+                 PRIVATE: 'private', STATUS_UPDATE: 'status_update'}
+
+
+class Recorder(object):
+    '''
+    Listener of the server (see Server.set_listener()) that writes event messages received from event sources
+    to a file and passes everything on to the real listener, normally EventHandler.
+    Only the messages accepted by the listener are written: the server disconnects an event source sending
+    a malformed message and discards the rest of its data, so replay must not see them either.
+    The file is overwritten: a recording must only hold one run of the server to be replayed.
+    '''
+
+    def __init__(self, path, listener):
+        self.file = open(path, 'wb', 64 * 1024)
+        self.listener = listener
+        self.recorded = 0
+
+    def __getattr__(self, name):
+        # methods of the listener not related to events are called directly
+        return getattr(self.listener, name)
+
+    def on_event_received(self, msg):
+        if not self.listener.on_event_received(msg):
+            return False
+        self._write([msg])
+        return True
+
+    def on_events_received(self, msgs):
+        if hasattr(self.listener, 'on_events_received'):
+            if self.listener.on_events_received(msgs):
+                self._write(msgs)
+                return True
+            # messages preceding the malformed one are accepted, as in EventHandler.on_events_received()
+            self._write(msgs[:_valid_prefix_length(msgs)])
+            return False
+        for i, msg in enumerate(msgs):
+            if not self.listener.on_event_received(msg):
+                self._write(msgs[:i])
+                return False
+        self._write(msgs)
+        return True
+
+    def on_events_decoded(self, events):
+        if not self.listener.on_events_decoded(events):
+            return False
+        self._write([event.message for event in events])
+        return True
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def _write(self, msgs):
+        if msgs:
+            self.file.write('\n'.join(msgs) + '\n')
+            self.recorded += len(msgs)
+
+
+def _valid_prefix_length(msgs):
+    '''Returns number of messages preceding the first malformed one.'''
+    for i, msg in enumerate(msgs):
+        try:
+            Event.from_string(msg)
+        except ValueError:
+            return i
+    return len(msgs)
+
+
+class CountingSink(object):
+    '''Replaces the server in replay: counts messages sent to user clients instead of sending them.'''
+
+    def __init__(self):
+        # one per notification, however many clients it goes to
+        self.messages = 0
+        self.deliveries = 0
+
+    def send(self, connection, data):
+        self.messages += 1
+        self.deliveries += 1
+
+    def send_many(self, connections, data):
+        self.messages += 1
+        self.deliveries += len(connections)
+
+
+class _FanoutCounter(object):
+    '''Handler of the event queue in front of EventHandler counting events and deliveries by command.'''
+
+    def __init__(self, handler, sink):
+        self.handler = handler
+        self.sink = sink
+        self.events = dict.fromkeys(COMMAND_NAMES, 0)
+        self.deliveries = dict.fromkeys(COMMAND_NAMES, 0)
+        self.max_fanout = 0
+
+    def on_event(self, event):
+        sink = self.sink
+        before = sink.deliveries
+        self.handler.on_event(event)
+        fanout = sink.deliveries - before
+        self.events[event.code] += 1
+        self.deliveries[event.code] += fanout
+        if fanout > self.max_fanout:
+            self.max_fanout = fanout
+
+
+# stands for the connections of users connected during replay; the sink does not look at it
+_CONNECTION = object()
+
+
+def recorded_user_ids(path):
+    '''Returns set of ids of all users mentioned in the recording.'''
+    user_ids = set()
+    for msgs in iter_recording(path):
+        for msg in msgs:
+            user_ids.update(msg.split('|')[2:])
+    return user_ids
+
+
+def iter_recording(path, chunk_size=64 * 1024):
+    '''
+    Yields lists of messages of the recording, reading chunk_size bytes at a time through memory mapping,
+    the same way the server splits data received from an event source.
+    '''
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            tail = ''
+            for offset in xrange(0, size, chunk_size):
+                ds = (tail + mm[offset:offset + chunk_size]).split('\n')
+                tail = ds.pop()
+                msgs = [msg.strip('\r') for msg in ds if msg]
+                if msgs:
+                    yield msgs
+            if tail.strip('\r'):
+                yield [tail.strip('\r')]
+        finally:
+            mm.close()
+
+
+def replay(path, graph, queue, connected=(), chunk_size=64 * 1024):
+    '''
+    Processes the recording with EventHandler using given graph and queue; users with ids in connected
+    are registered as connected clients before that. Returns dict of statistics.
+    Malformed messages are counted and skipped rather than ending the replay.
+    '''
+    sink = CountingSink()
+    handler = EventHandler(graph, sink, queue)
+    counter = _FanoutCounter(handler, sink)
+    queue.set_handler(counter)
+    for user_id in connected:
+        graph.register_user(user_id, connection=_CONNECTION)
+
+    on_events_received, poll = handler.on_events_received, queue.poll
+    start = time.time()
+    for msgs in iter_recording(path, chunk_size):
+        while msgs:
+            parsed = handler.events_parsed
+            if on_events_received(msgs):
+                break
+            # go on after the malformed message
+            msgs = msgs[handler.events_parsed - parsed + 1:]
+        poll()
+    elapsed = time.time() - start
+
+    processed = sum(counter.events.itervalues())
+    edges = 0
+    for user_id, followers in graph.iter_edges():
+        edges += len(followers)
+    return {
+        'events_read': handler.events_parsed + handler.events_rejected,
+        'events_rejected': handler.events_rejected,
+        'events_processed': processed,
+        'events_pending': len(queue),
+        'elapsed_s': elapsed,
+        'events_per_s': processed / elapsed if elapsed else None,
+        'messages': sink.messages,
+        'deliveries': sink.deliveries,
+        'deliveries_per_s': sink.deliveries / elapsed if elapsed else None,
+        'fanout': dict((COMMAND_NAMES[code], {
+            'events': counter.events[code],
+            'deliveries': counter.deliveries[code],
+            'mean': float(counter.deliveries[code]) / counter.events[code] if counter.events[code] else 0.0,
+        }) for code in COMMAND_NAMES),
+        'max_fanout': counter.max_fanout,
+        'connected_users': len(graph.connected),
+        'graph_users': len(graph.all_users()),
+        'graph_edges': edges,
+    }
@@ -1,8 +1,8 @@
 # Copyright 2013 Alexander Poluektov
 # This file is a part of my solution for 'follower-maze' challenge by SoundCloud
 
+import errno
 import socket
-import select
 import sys
 import logging
 import threading
@@ -10,27 +10,115 @@ import time
 import tempfile
 import os, os.path
 import shutil
-from collections import defaultdict
 
 from event import Event
+from poller import make_poller, READ, WRITE, ERROR
+from connection import Connection
+from timers import TimerQueue
+import wire
+
+
+# not exported by the socket module of Python 2; the value is for Linux
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
 
 
 class Server(object):
     '''
     Manages connections of user clients and event source, and receiving/sending data from/to them.
     Notofies registered listener when some data is ready for processing by the application.
+
+    Output buffered for a user client is limited by high_watermark (in bytes, None means unlimited).
+    When a client is too slow and the limit is reached, slow_consumer_policy decides what happens:
+    'disconnect' closes the connection, 'drop_oldest' drops the oldest buffered messages
+    and 'drop_new' drops new messages; both drop until buffered output goes down to low_watermark
+    (half of high_watermark by default). 'backpressure' drops nothing but stops reading from
+    event sources until the buffer goes down to low_watermark; it is meant for connections that must
+    not lose messages, like the links to the workers of ShardedServer, as one slow client stalls all.
+
+    Several event sources can be connected at once (up to max_event_sources, None means any number);
+    each has its own input buffer and their events are passed to the same listener, so the event queue
+    merges them by sequence number. A source sending malformed events is disconnected alone.
+    Each accepted source can choose the binary framing of followermaze.wire instead of text
+    by sending its preamble first; the listener must implement on_events_decoded() then.
+
+    If metrics_port is given, the server answers every HTTP request on it with the metrics
+    of the registry set by set_metrics() in Prometheus text format.
     '''
-    def __init__(self, event_port, client_port):
-        self.event_control_socket = self._init_control_socket(event_port)
-        self.client_control_socket = self._init_control_socket(client_port)
-        self.service_socket = self._init_service_socket()
-        self.event_socket = None
 
-        self.inputs = [self.event_control_socket, self.client_control_socket, self.service_socket]
-        self.outputs = set()
+    # longest line with client id accepted from a user client
+    max_client_id_length = 1024
+
+    # longest HTTP request accepted on the metrics port
+    max_metrics_request = 8 * 1024
 
-        self.event_data = ''
-        self.client_data = defaultdict(str)
+    # seconds a listening socket is not polled after accept() failed, i.e. when out of file descriptors
+    accept_backoff_s = 0.1
+
+    event_source_roles = (Connection.EVENT_SOURCE, Connection.NEW_EVENT_SOURCE, Connection.BINARY_EVENT_SOURCE)
+
+    slow_consumer_policies = ('disconnect', 'drop_oldest', 'drop_new', 'backpressure')
+
+    def __init__(self, event_port, client_port, poller=None, recv_size=64*1024,
+                 high_watermark=None, low_watermark=None, slow_consumer_policy='disconnect', reuse_port=False,
+                 metrics_port=None, max_event_sources=None, listen_backlog=1024, accept_batch=256):
+        '''
+        event_port or client_port can be None, then the server does not listen on it.
+        If reuse_port is True, several processes can listen on the same client port (SO_REUSEPORT);
+        the kernel distributes incoming client connections between them.
+        listen_backlog is the backlog of the listening sockets (the kernel may cap it, see somaxconn);
+        up to accept_batch pending connections are accepted each time a listening socket is ready,
+        so that a storm of reconnecting clients neither overflows the backlog nor starves other sockets.
+        '''
+        if slow_consumer_policy not in self.slow_consumer_policies:
+            raise ValueError("unknown slow consumer policy: '%s'" % slow_consumer_policy)
+        self.recv_size = recv_size
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark if low_watermark is not None or high_watermark is None else high_watermark // 2
+        self.slow_consumer_policy = slow_consumer_policy
+        self.max_event_sources = max_event_sources
+        self.listen_backlog = listen_backlog
+        self.accept_batch = accept_batch
+
+        # output statistics
+        self.bytes_queued = 0
+        self.bytes_dropped = 0
+        self.slow_consumers_disconnected = 0
+        # connections over high watermark holding event sources paused (policy 'backpressure')
+        self.blocking_consumers = set()
+
+        self.poller = make_poller(poller)
+        self.connections = {}
+        self.timers = TimerQueue()
+
+        self.event_control = None
+        if event_port is not None:
+            self.event_control = self._add_connection(self._init_control_socket(event_port), Connection.EVENT_CONTROL, READ)
+        self.client_control = None
+        if client_port is not None:
+            self.client_control = self._add_connection(self._init_control_socket(client_port, reuse_port), Connection.CLIENT_CONTROL, READ)
+        self.metrics_control = None
+        if metrics_port is not None:
+            self.metrics_control = self._add_connection(self._init_control_socket(metrics_port), Connection.METRICS_CONTROL, READ)
+        self.service = self._add_connection(self._init_service_socket(), Connection.SERVICE, READ)
+        self.event_connections = set()
+        self.stop_socket = None
+
+        self.read_handlers = {
+            Connection.EVENT_CONTROL: self._handle_event_source_connection,
+            Connection.CLIENT_CONTROL: self._handle_client_connection,
+            Connection.SERVICE: self._handle_stop_request,
+            Connection.NEW_EVENT_SOURCE: self._handle_new_event_source_data,
+            Connection.EVENT_SOURCE: self._handle_event_data,
+            Connection.BINARY_EVENT_SOURCE: self._handle_binary_event_data,
+            Connection.CLIENT: self._handle_client_data,
+            Connection.REGISTERED_CLIENT: self._handle_registered_client_data,
+            Connection.METRICS_CONTROL: self._handle_metrics_connection,
+            Connection.METRICS_CLIENT: self._handle_metrics_request,
+        }
+
+        self.metrics = None
+        # histogram of time spent handling ready sockets after each poll; measured only if set
+        self.poll_time = None
 
         self.should_stop = False
 
@@ -48,30 +136,122 @@ class Server(object):
 
             def on_poll(self):
                 # return nothing
+
+        Optionally, the listener can provide batch version of on_event_received(),
+        which is then called once for all complete messages received at once:
+            def on_events_received(self, messages):
+                # return True if wants to listen to this connection further
+
+        To accept event sources using binary framing (see followermaze.wire), the listener must provide
+            def on_events_decoded(self, events):
+                # events is list of Event objects; return True if wants to listen to this connection further
+
+        and can be notified when user client or event source disconnects:
+            def on_client_disconnected(self, connection):
+                # return nothing
+
+            def on_event_source_disconnected(self):
+                # called for each of the event sources; return nothing
         '''
         self.listener = listener
+        self.on_events_received = getattr(listener, 'on_events_received', self._events_received_one_by_one)
+        self.on_events_decoded = getattr(listener, 'on_events_decoded', None)
+        self.on_client_disconnected = getattr(listener, 'on_client_disconnected', None)
+        self.on_event_source_disconnected = getattr(listener, 'on_event_source_disconnected', None)
+
+    def set_metrics(self, registry):
+        '''Sets metrics registry (see followermaze.metrics) served on the metrics port.'''
+        self.metrics = registry
+
+    def add_event_source(self, sock, role=Connection.EVENT_SOURCE):
+        '''
+        Uses already connected socket as an event source sending text; returns its Connection.
+        With role Connection.NEW_EVENT_SOURCE the framing is chosen by the first bytes received.
+        '''
+        sock.setblocking(0)
+        connection = self._add_connection(sock, role, 0 if self.blocking_consumers else READ)
+        self.event_connections.add(connection)
+        return connection
+
+    def add_client(self, sock):
+        '''
+        Uses already connected socket as a registered user client, i.e. for sending data only;
+        returns its Connection.
+        '''
+        sock.setblocking(0)
+        return self._add_connection(sock, Connection.REGISTERED_CLIENT, READ)
 
     def send(self, connection, data):
-        '''Sends given data over given connection.'''
-        self.outputs.add(connection)
-        self.client_data[connection] += data + '\r\n'
+        '''Sends given data over given connection; data for already closed connection are dropped.'''
+        if connection.closed:
+            return
+        chunk = data + '\r\n'
+        if self.high_watermark is not None and (connection.dropping or len(connection.outbuf) + len(chunk) > self.high_watermark):
+            if not self._slow_consumer(connection, chunk):
+                return
+        connection.outbuf.append(chunk)
+        self.bytes_queued += len(chunk)
+        self._set_events(connection, connection.events | WRITE)
+
+    def send_many(self, connections, data):
+        '''
+        Sends the same data over all given connections.
+        The data are framed once and the resulting chunk is shared by all connections' output queues.
+        '''
+        chunk = data + '\r\n'
+        size = len(chunk)
+        high_watermark = self.high_watermark
+        queued = 0
+        for connection in connections:
+            if connection.closed:
+                continue
+            outbuf = connection.outbuf
+            if high_watermark is not None and (connection.dropping or len(outbuf) + size > high_watermark):
+                if not self._slow_consumer(connection, chunk):
+                    continue
+            outbuf.append(chunk)
+            queued += size
+            if not connection.events & WRITE:
+                self._set_events(connection, connection.events | WRITE)
+        self.bytes_queued += queued
 
     def client_id_received(self, connection, msg):
-        '''Notifies the listener of the client id just received.'''
+        '''
+        Notifies the listener of the client id just received.
+        If the listener does not want more messages, further data from the client are discarded;
+        the connection is still watched so that its disconnect is noticed.
+        '''
         more = self.listener.on_client_id_received(connection, msg)
         if not more:
-            connection.shutdown(socket.SHUT_RD)
-            self.inputs.remove(connection)
+            connection.role = Connection.REGISTERED_CLIENT
 
-    def event_received(self, msg):
+    def event_received(self, connection, msg):
         '''
-        Notifies the listener of the event just received.
-        If the event was malformed, disconnect the client.
+        Notifies the listener of the event just received from the event source connection.
+        If the event was malformed, disconnect the source.
         '''
         more = self.listener.on_event_received(msg)
         if not more:
             logging.warning('event source will be disconnected.')
-            self._reset_event_socket()
+            self._close_event_source(connection)
+
+    def events_received(self, connection, msgs):
+        '''
+        Notifies the listener of the batch of events just received from the event source connection.
+        If some event was malformed, disconnect the source.
+        '''
+        more = self.on_events_received(msgs)
+        if not more:
+            logging.warning('event source will be disconnected.')
+            self._close_event_source(connection)
+
+    def call_later(self, delay_s, callback):
+        '''
+        Schedules callback to be called from the polling thread in delay_s seconds.
+        Returns timer object; its cancel() method cancels the call.
+        Must be called from the polling thread (i.e. from the listener callbacks).
+        '''
+        return self.timers.call_later(delay_s, callback)
 
     def start(self):
         '''
@@ -86,50 +266,131 @@ class Server(object):
             self._poll()
         self._cleanup()
 
+    def request_stop(self):
+        '''Requests server loop to stop; must be called from the polling thread (i.e. from the listener callbacks).'''
+        self.should_stop = True
+
     def stop(self):
         '''
         Requests server thread stop and waits for it to complete.
 
         Here is the trick: server thread is listening for the service socket, and it interprets connections
         as a stop request. The beauty is that communication is done without any synchronization, and using
-        the same select() call that listens for the clients.
+        the same poller that listens for the clients.
         '''
         logging.info('Server: requesting polling thread to stop ...')
-        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        s.connect(self.service_socket_filename)
-        self.inputs.append(s)
+        self.stop_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.stop_socket.connect(self.service_socket_filename)
 
         self.server_thread.join()
 
     def _poll(self):
-        r, w, e = select.select(self.inputs, self.outputs, self.inputs)
-        for s in r:
-            if s == self.event_control_socket:
-                self._handle_event_source_connection()
-            elif s == self.client_control_socket:
-                self._handle_client_connection()
-            elif s == self.event_socket:
-                self._handle_event_data()
-            elif s == self.service_socket:
-                self.should_stop = True
-                return
-            else:
-                self._handle_client_data(s)
-        for s in w:
-            self._write_data(s)
-        for s in e:
-            self.inputs.remove(s)
-            s.close()
-
+        # the clock is only read when there are timers pending
+        timeout = self.timers.timeout(time.time()) if self.timers else None
+        ready = self.poller.poll(timeout)
+        poll_time = self.poll_time
+        if poll_time:
+            started = time.time()
+        for connection, events in ready:
+            # connection could have been closed while handling previous ones
+            if events & READ and connection.events & READ:
+                self.read_handlers[connection.role](connection)
+                if self.should_stop:
+                    return
+            if events & WRITE and connection.events & WRITE:
+                self._write_data(connection)
+            if events & ERROR and connection.events & READ:
+                if connection.role in self.event_source_roles:
+                    self._close_event_source(connection)
+                else:
+                    self._close_connection(connection)
+
+        if self.timers:
+            self.timers.run_expired(time.time())
         self.listener.on_poll()
+        if poll_time:
+            poll_time.observe(time.time() - started)
+
+    def _add_connection(self, sock, role, events):
+        connection = Connection(sock, role)
+        self.connections[connection.fd] = connection
+        self._set_events(connection, events)
+        return connection
+
+    def _close_connection(self, connection):
+        if not connection.closed:
+            self._set_events(connection, 0)
+            del self.connections[connection.fd]
+            connection.sock.close()
+            connection.closed = True
+            connection.outbuf.clear()
+            if connection in self.blocking_consumers:
+                self._unblock(connection)
+            if self.on_client_disconnected and connection.role in (Connection.CLIENT, Connection.REGISTERED_CLIENT):
+                self.on_client_disconnected(connection)
+
+    def _slow_consumer(self, connection, chunk):
+        '''
+        Applies slow consumer policy to the connection which output is about to exceed high watermark
+        or is being dropped. Returns True if the chunk should still be queued.
+        '''
+        outbuf = connection.outbuf
+        if self.slow_consumer_policy == 'drop_new':
+            if connection.dropping and len(outbuf) <= self.low_watermark:
+                connection.dropping = False
+                return True
+            connection.dropping = True
+            self.bytes_dropped += len(chunk)
+            return False
+        elif self.slow_consumer_policy == 'drop_oldest':
+            self.bytes_dropped += outbuf.drop_oldest(max(0, self.low_watermark - len(chunk)))
+            return True
+        elif self.slow_consumer_policy == 'backpressure':
+            if connection not in self.blocking_consumers:
+                if not self.blocking_consumers:
+                    logging.info('Server: output is over high watermark; pausing event sources.')
+                    self._set_event_sources_reading(False)
+                self.blocking_consumers.add(connection)
+            return True
+        else:
+            logging.warning('Client is too slow; disconnecting.')
+            self.bytes_dropped += len(outbuf) + len(chunk)
+            self.slow_consumers_disconnected += 1
+            self._close_connection(connection)
+            return False
+
+    def _unblock(self, connection):
+        '''Resumes reading event sources if the connection was the last one holding them paused.'''
+        self.blocking_consumers.discard(connection)
+        if not self.blocking_consumers:
+            logging.info('Server: output is down to low watermark; resuming event sources.')
+            self._set_event_sources_reading(True)
+
+    def _set_event_sources_reading(self, reading):
+        for connection in self.event_connections:
+            if not connection.closed:
+                self._set_events(connection, connection.events | READ if reading else connection.events & ~READ)
+
+    def _set_events(self, connection, events):
+        if events == connection.events:
+            return
+        if not events:
+            self.poller.unregister(connection)
+        elif connection.events:
+            self.poller.modify(connection, events)
+        else:
+            self.poller.register(connection, events)
+        connection.events = events
 
 
-    def _init_control_socket(self, port):
+    def _init_control_socket(self, port, reuse_port=False):
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            s.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
         s.setblocking(0)
         s.bind(('', port))
-        s.listen(5)
+        s.listen(self.listen_backlog)
         return s
 
     def _init_service_socket(self):
@@ -142,72 +403,203 @@ class Server(object):
         s.listen(1)
         return s
 
-    def _reset_event_socket(self):
-        self.inputs.remove(self.event_socket)
-        self.event_socket.close()
-        self.event_socket = None
+    def _close_event_source(self, connection):
+        self._close_connection(connection)
+        self.event_connections.discard(connection)
+        if self.on_event_source_disconnected:
+            self.on_event_source_disconnected()
+
+    def _handle_stop_request(self, connection):
+        self.should_stop = True
+
+    def _accept(self, connection):
+        '''Returns list of up to accept_batch (socket, address) pairs accepted on the listening connection.'''
+        accept = connection.sock.accept
+        accepted = []
+        while len(accepted) < self.accept_batch:
+            try:
+                conn, addr = accept()
+            except socket.error, v:
+                if v.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                if v.args[0] == errno.ECONNABORTED:
+                    continue
+                # i.e. out of file descriptors: the rest stay in the backlog and keep the listening socket ready,
+                # so it is not polled for a while instead of failing again on every poll
+                logging.warning('Problem with accepting connection: %s; not accepting for %s s.', v, self.accept_backoff_s)
+                self._set_events(connection, 0)
+                self.call_later(self.accept_backoff_s, lambda: self._resume_accepting(connection))
+                break
+            conn.setblocking(0)
+            accepted.append((conn, addr))
+        return accepted
+
+    def _resume_accepting(self, connection):
+        if not connection.closed:
+            self._set_events(connection, READ)
+
+    def _handle_event_source_connection(self, connection):
+        for conn, addr in self._accept(connection):
+            if self.max_event_sources is not None and len(self.event_connections) >= self.max_event_sources:
+                # the peer may be gone already, so its address is the one returned by accept()
+                logging.warning('Too many event sources; rejecting connection from %s.', addr)
+                conn.close()
+            else:
+                self.add_event_source(conn, Connection.NEW_EVENT_SOURCE)
 
-    def _handle_event_source_connection(self):
-        if not self.event_socket:
-            self.event_socket, addr = self.event_control_socket.accept()
-            self.event_socket.setblocking(0)
-            self.inputs.append(self.event_socket)
+    def _handle_client_connection(self, connection):
+        add_connection = self._add_connection
+        for conn, addr in self._accept(connection):
+            add_connection(conn, Connection.CLIENT, READ)
 
-    def _handle_client_connection(self):
-        conn, addr = self.client_control_socket.accept()
-        conn.setblocking(0)
-        self.inputs.append(conn)
+    def _recv_event_data(self, connection):
+        try:
+            return connection.sock.recv(self.recv_size)
+        except socket.error, v:
+            logging.warning('Problem with reading event source socket; disconnecting it.')
+            logging.warning('error text: %s', v)
+            return ''
+
+    def _handle_new_event_source_data(self, connection):
+        data = self._recv_event_data(connection)
+        if not data:
+            self._close_event_source(connection)
+            return
+        data = connection.inbuf + data
+        framing = wire.detect_framing(data)
+        if framing is None:
+            connection.inbuf = data
+        elif framing == wire.TEXT:
+            connection.role = Connection.EVENT_SOURCE
+            connection.inbuf = ''
+            self._event_data_received(connection, data)
+        elif not self.on_events_decoded:
+            logging.warning('Binary framing is not supported by the listener; disconnecting event source.')
+            self._close_event_source(connection)
+        else:
+            connection.role = Connection.BINARY_EVENT_SOURCE
+            connection.inbuf = ''
+            self._binary_event_data_received(connection, data[len(wire.PREAMBLE):])
 
-    def _handle_event_data(self):
-        data = self.event_socket.recv(1024)
+    def _handle_event_data(self, connection):
+        data = self._recv_event_data(connection)
         if data:
-            data = self.event_data + data
-            ds = data.split('\n')
-            for msg in ds[:-1]:
-                if msg:
-                    msg = msg.strip('\r')
-                    self.event_received(msg)
-            self.event_data = ds[-1]
+            self._event_data_received(connection, data)
         else:
-            self._reset_event_socket()
+            self._close_event_source(connection)
 
+    def _event_data_received(self, connection, data):
+        ds = (connection.inbuf + data).split('\n')
+        connection.inbuf = ds.pop()
+        msgs = [msg.strip('\r') for msg in ds if msg]
+        if msgs:
+            self.events_received(connection, msgs)
 
-    def _handle_client_data(self, s):
-        data = s.recv(1024)
+    def _handle_binary_event_data(self, connection):
+        data = self._recv_event_data(connection)
         if data:
-            client_data = self.client_data[s]
-            data = client_data + data
-            if data.endswith('\n'):
-                data = data.rstrip('\n').rstrip('\r')
-                self.client_id_received(s, data)
-                client_data = ''
-            else:
-                client_data = data
+            self._binary_event_data_received(connection, connection.inbuf + data if connection.inbuf else data)
+        else:
+            self._close_event_source(connection)
+
+    def _binary_event_data_received(self, connection, data):
+        events = []
+        try:
+            end = wire.decode_events(data, events)
+        except ValueError, v:
+            logging.warning("Bad binary event; error text: '%s'", v)
+            end = None
+        if events and not self.on_events_decoded(events):
+            end = None
+        if end is None:
+            logging.warning('event source will be disconnected.')
+            self._close_event_source(connection)
         else:
-            self.inputs.remove(s)
-            s.close()
+            connection.inbuf = data[end:]
+
+
+    def _handle_client_data(self, connection):
+        data = self._recv_client_data(connection)
+        if not data:
+            self._close_connection(connection)
+            return
+        if connection.inbuf:
+            data = connection.inbuf + data
+        end = data.find('\n')
+        if end >= 0:
+            connection.inbuf = ''
+            self.client_id_received(connection, data[:end].rstrip('\r'))
+        elif len(data) > self.max_client_id_length:
+            logging.warning('Client id is too long; disconnecting client.')
+            self._close_connection(connection)
+        else:
+            connection.inbuf = data
+
+    def _handle_registered_client_data(self, connection):
+        if not self._recv_client_data(connection):
+            self._close_connection(connection)
+
+    def _recv_client_data(self, connection):
+        try:
+            return connection.sock.recv(1024)
+        except socket.error, v:
+            logging.warning('Problem with reading socket; disconnecting client.')
+            logging.warning('error text: %s', v)
+            return ''
 
 
-    def _write_data(self, s):
-        client_data = self.client_data[s]
+    def _write_data(self, connection):
         try:
-            bytes_send = s.send(client_data)
-            client_data = client_data[bytes_send:]
-            if not client_data:
-                self.outputs.remove(s)
-                del self.client_data[s]
+            connection.outbuf.write_to(connection.sock)
+            if connection in self.blocking_consumers and len(connection.outbuf) <= self.low_watermark:
+                self._unblock(connection)
+            if not connection.outbuf:
+                self._set_events(connection, connection.events & ~WRITE)
+                if connection.role == Connection.METRICS_CLIENT:
+                    self._close_connection(connection)
         except socket.error, v:
             logging.warning('Problem with writing socket; disconnecting client.')
-            logging.warning('error text: %s' % v)
+            logging.warning('error text: %s', v)
             # remove the troublemaker's socket and clean up its residual data
-            self.outputs.remove(s)
-            del self.client_data[s]
+            self._close_connection(connection)
+
+
+    def _handle_metrics_connection(self, connection):
+        for conn, addr in self._accept(connection):
+            self._add_connection(conn, Connection.METRICS_CLIENT, READ)
+
+    def _handle_metrics_request(self, connection):
+        data = self._recv_client_data(connection)
+        if not data:
+            self._close_connection(connection)
+            return
+        connection.inbuf += data
+        if '\r\n\r\n' in connection.inbuf or '\n\n' in connection.inbuf:
+            body = self.metrics.render() if self.metrics else ''
+            connection.outbuf.append('HTTP/1.0 200 OK\r\n'
+                                     'Content-Type: text/plain; version=0.0.4\r\n'
+                                     'Content-Length: %d\r\n'
+                                     'Connection: close\r\n\r\n' % len(body))
+            connection.outbuf.append(body)
+            # the connection is closed as soon as the response is written
+            self._set_events(connection, WRITE)
+        elif len(connection.inbuf) > self.max_metrics_request:
+            logging.warning('Metrics request is too long; disconnecting.')
+            self._close_connection(connection)
+
+
+    def _events_received_one_by_one(self, msgs):
+        for msg in msgs:
+            if not self.listener.on_event_received(msg):
+                return False
+        return True
 
 
     def _cleanup(self):
-        for s in self.inputs:
-            s.close()
-        for s in self.outputs:
-            s.close()
-        self.service_socket.close()
+        for connection in self.connections.values():
+            connection.sock.close()
+        self.connections.clear()
+        if self.stop_socket:
+            self.stop_socket.close()
+        self.poller.close()
         shutil.rmtree(os.path.dirname(self.service_socket_filename))
@@ -0,0 +1,141 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import logging
+import multiprocessing
+import socket
+
+from followermaze.eventhandler import EventHandler
+from followermaze.server import Server
+from followermaze.usergraph import make_user_graph
+
+
+# sent by a worker to the master once it is ready to accept clients
+READY = 'R'
+
+
+class PassThroughQueue(object):
+    '''Event queue of a worker: events come from the master already ordered, so they are dispatched at once.'''
+
+    def set_handler(self, handler):
+        self.handler = handler
+
+    def __len__(self):
+        return 0
+
+    def add(self, event):
+        self.handler.on_event(event)
+
+    def poll(self):
+        pass
+
+
+class WorkerHandler(EventHandler):
+    '''EventHandler of a worker process; stops the worker when the master goes away.'''
+
+    def on_event_source_disconnected(self):
+        logging.info('Worker: master disconnected; stopping.')
+        self.server.request_stop()
+
+
+class ShardRouter(EventHandler):
+    '''
+    Listener of the master server: receives events from the event source, puts them in order
+    and forwards every event to all workers.
+    '''
+
+    def __init__(self, server, queue, workers, trace_every=1):
+        EventHandler.__init__(self, None, server, queue, trace_every=trace_every)
+        self.workers = workers
+
+    def on_event(self, event):
+        self.server.send_many(self.workers, event.message)
+
+    def on_client_disconnected(self, connection):
+        if connection in self.workers:
+            logging.error('ShardRouter: worker connection lost.')
+            self.workers.remove(connection)
+
+
+def run_worker(events_socket, unused_sockets, client_port, graph=None, log_level=None, server_options=None,
+               trace_every=1):
+    '''
+    Main function of a worker process: accepts its share of user clients on client_port (shared with
+    other workers through SO_REUSEPORT), receives ordered events from events_socket and delivers them.
+    Every worker keeps full replica of the user graph.
+    '''
+    for s in unused_sockets:
+        s.close()
+    if log_level:
+        logging.Logger.root.setLevel(log_level)
+
+    server = Server(event_port=None, client_port=client_port, reuse_port=True, **(server_options or {}))
+    queue = PassThroughQueue()
+    handler = WorkerHandler(make_user_graph(graph), server, queue, trace_every=trace_every)
+    queue.set_handler(handler)
+    server.set_listener(handler)
+    # tell the master that the client port is being listened on
+    events_socket.sendall(READY)
+    server.add_event_source(events_socket)
+    server.run()
+
+
+class ShardedServer(object):
+    '''
+    Delivers events using several worker processes, each owning a disjoint set of user client connections.
+    The master process (this object) owns the event source connection and the event queue;
+    events are forwarded in order to all workers through Unix socket pairs. When more than
+    link_high_watermark bytes are buffered for a worker, the master stops reading event sources
+    until the worker catches up, so a slow worker slows the event sources down instead of making
+    the master buffer without bound.
+    Has the same start()/stop() interface as Server.
+    '''
+
+    def __init__(self, event_port, client_port, queue, workers, graph=None, log_level=None, trace_every=1,
+                 link_high_watermark=16 * 1024 * 1024, **server_options):
+        '''
+        queue is the event queue of the master; trace_every is passed to the event handlers of the master
+        and the workers (see EventHandler); server_options are passed to Server objects of the workers
+        (the master uses only poller, recv_size, max_event_sources and listen_backlog of them:
+        connections to workers are limited by link_high_watermark only, and never lose events).
+        '''
+        pairs = [socket.socketpair() for i in range(workers)]
+        master_ends = [m for m, w in pairs]
+        worker_ends = [w for m, w in pairs]
+
+        # workers are started before the master server, so that they do not inherit its sockets
+        self.processes = []
+        for i, w in enumerate(worker_ends):
+            unused = master_ends + worker_ends[:i] + worker_ends[i + 1:]
+            p = multiprocessing.Process(target=run_worker, name='followermaze-worker-%d' % i,
+                                        args=(w, unused, client_port, graph, log_level, server_options, trace_every))
+            p.daemon = True
+            p.start()
+            self.processes.append(p)
+        for w in worker_ends:
+            w.close()
+        for m in master_ends:
+            if m.recv(1) != READY:
+                raise RuntimeError('worker process failed to start')
+
+        master_options = dict((k, v) for k, v in server_options.items() if k in ('poller', 'recv_size', 'max_event_sources', 'listen_backlog'))
+        self.server = Server(event_port=event_port, client_port=None, high_watermark=link_high_watermark,
+                             slow_consumer_policy='backpressure', **master_options)
+        self.workers = [self.server.add_client(m) for m in master_ends]
+        self.router = ShardRouter(self.server, queue, self.workers, trace_every=trace_every)
+        queue.set_handler(self.router)
+        queue.set_scheduler(self.server)
+        self.server.set_listener(self.router)
+
+    def start(self):
+        self.server.start()
+
+    def stop(self, timeout_s=5):
+        '''Stops the master; workers stop when they see their connection to the master closed.'''
+        self.server.stop()
+        for p in self.processes:
+            p.join(timeout_s)
+            if p.is_alive():
+                logging.warning('ShardedServer: worker %s did not stop; terminating.', p.name)
+                p.terminate()
+                p.join()
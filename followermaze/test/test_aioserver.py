@@ -0,0 +1,83 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import unittest
+
+import socket
+import time
+
+from followermaze.aioserver import AsyncServer, asyncio
+from followermaze.test import test_server
+from followermaze.test.test_server import init_socket
+
+
+@unittest.skipIf(asyncio is None, 'neither asyncio nor trollius is available')
+class TestAsyncServer(test_server.TestServer):
+    '''Runs the same tests as for Server against AsyncServer.'''
+
+    def setUp(self):
+        self.server = AsyncServer(event_port=9090, client_port=9099)
+        self.listener = self.Listener(self.server)
+        self.server.set_listener(self.listener)
+
+        self.server.start()
+
+
+    def test_send(self):
+        class Listener(self.Listener):
+            def on_client_id_received(listener, connection, msg):
+                self.server.send_many([connection], 'hello, %s' % msg)
+                return False
+
+        self.server.set_listener(Listener(self.server))
+        s = init_socket(9099)
+        s.settimeout(1)
+        s.sendall('me\r\n')
+        self.assertEqual(s.recv(1024), 'hello, me\r\n')
+        s.close()
+
+
+    def test_call_later(self):
+        called = []
+        self.server.loop.call_soon_threadsafe(self.server.call_later, 0, lambda: called.append(True))
+        time.sleep(0.05)
+        self.assertEqual(called, [True])
+
+
+    def test_too_long_client_id_disconnects_client(self):
+        s = init_socket(9099)
+        s.sendall('x' * (AsyncServer.max_client_id_length + 1))
+        time.sleep(0.05)
+        self.assertEqual(self.listener.clients_received, [])
+        self.assertEqual(len(self.listener.clients_disconnected), 1)
+        s.close()
+
+
+    def test_client_id_line_followed_by_more_data(self):
+        s = init_socket(9099)
+        s.sendall('me\r\n' + 'x' * (AsyncServer.max_client_id_length + 1))
+        time.sleep(0.05)
+        self.assertEqual(self.listener.clients_received, ['me'])
+        self.assertEqual(self.listener.clients_disconnected, [])
+        s.close()
+
+
+    def test_low_watermark_defaults_to_half_of_high(self):
+        self.assertEqual(self.server.low_watermark, None)
+        for low_watermark, expected in (None, 500), (100, 100):
+            server = AsyncServer(event_port=9090, client_port=9099, high_watermark=1000, low_watermark=low_watermark)
+            server.loop.close()
+            self.assertEqual(server.low_watermark, expected)
+
+
+    def test_start_fails_if_port_is_in_use(self):
+        # the client port is listened on by the server started by setUp()
+        server = AsyncServer(event_port=9092, client_port=9099)
+        self.assertRaises(socket.error, server.start)
+        self.assertFalse(server.server_thread.is_alive())
+        # the event port it managed to listen on is released
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('', 9092))
+        s.listen(1)
+        s.close()
@@ -0,0 +1,88 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import unittest
+
+from followermaze.connection import OutputQueue
+
+
+class SlowSocket(object):
+    '''Accepts at most given number of bytes per send() call.'''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.data = ''
+        self.calls = 0
+
+    def send(self, data):
+        data = str(data)[:self.max_bytes]
+        self.data += data
+        self.calls += 1
+        return len(data)
+
+
+class TestOutputQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = OutputQueue()
+
+    def drain(self, sock):
+        while self.queue:
+            self.queue.write_to(sock)
+
+
+    def test_small_chunks_are_coalesced(self):
+        for msg in 'one\r\n', 'two\r\n', 'three\r\n':
+            self.queue.append(msg)
+        self.assertEqual(len(self.queue), 17)
+
+        sock = SlowSocket(1024)
+        self.drain(sock)
+        self.assertEqual(sock.data, 'one\r\ntwo\r\nthree\r\n')
+        self.assertEqual(sock.calls, 1)
+        self.assertEqual(len(self.queue), 0)
+
+
+    def test_partial_writes_keep_order(self):
+        for msg in 'one\r\n', 'two\r\n', 'three\r\n':
+            self.queue.append(msg)
+
+        sock = SlowSocket(3)
+        self.queue.write_to(sock)
+        self.assertEqual(len(self.queue), 14)
+        self.queue.append('four\r\n')
+
+        self.drain(sock)
+        self.assertEqual(sock.data, 'one\r\ntwo\r\nthree\r\nfour\r\n')
+
+
+    def test_same_chunk_shared_between_queues(self):
+        chunk = 'broadcast\r\n'
+        other = OutputQueue()
+        self.queue.append(chunk)
+        other.append(chunk)
+        self.assertTrue(self.queue.chunks[0] is other.chunks[0])
+
+
+    def test_clear(self):
+        self.queue.append('one\r\n')
+        self.queue.write_to(SlowSocket(2))
+        self.queue.clear()
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.queue.offset, 0)
+
+
+    def test_drop_oldest(self):
+        for msg in 'one\r\n', 'two\r\n', 'three\r\n':
+            self.queue.append(msg)
+        self.assertEqual(self.queue.drop_oldest(7), 10)
+        self.assertEqual(list(self.queue.chunks), ['three\r\n'])
+
+
+    def test_drop_oldest_keeps_partially_written_chunk(self):
+        for msg in 'one\r\n', 'two\r\n', 'three\r\n':
+            self.queue.append(msg)
+        self.queue.write_to(SlowSocket(2))
+        self.assertEqual(self.queue.drop_oldest(0), 12)
+
+        sock = SlowSocket(1024)
+        self.drain(sock)
+        self.assertEqual(sock.data, 'e\r\n')
@@ -3,7 +3,7 @@
 
 import unittest
 
-from followermaze.event import Event
+from followermaze.event import Event, FOLLOW, UNFOLLOW, BROADCAST, PRIVATE, STATUS_UPDATE
 
 class TestEvent(unittest.TestCase):
     def shouldFail(self, msg):
@@ -11,8 +11,8 @@ class TestEvent(unittest.TestCase):
             Event.from_string(msg)
 
     def shouldBeEqual(self, e1, e2):
-        for k,v in vars(e1).items():
-            self.assertEqual(v, vars(e2)[k])
+        for k in Event._fields:
+            self.assertEqual(getattr(e1, k), getattr(e2, k))
 
     def test_invalid_inputs_fail(self):
         self.shouldFail('')
@@ -44,3 +44,14 @@ class TestEvent(unittest.TestCase):
 
         # from- and to- defaults to None
         self.shouldBeEqual(Event('dummy', 1, 'F'), Event('dummy', 1, 'F', None, None))
+
+    def test_command_codes(self):
+        self.assertEqual([Event.from_string(m).code for m in '1|F|1|2', '2|U|1|2', '3|B', '4|P|1|2', '5|S|1'],
+                         [FOLLOW, UNFOLLOW, BROADCAST, PRIVATE, STATUS_UPDATE])
+        self.assertEqual(Event('dummy', 1, 'S').code, STATUS_UPDATE)
+        self.assertEqual(Event('dummy', 1, STATUS_UPDATE).code, STATUS_UPDATE)
+
+    def test_user_ids_are_interned(self):
+        e1 = Event.from_string('1|F|' + '1234' + '|42')
+        e2 = Event.from_string('2|S|' + ''.join(['12', '34']))
+        self.assertTrue(e1.from_user is e2.from_user)
@@ -1,13 +1,14 @@
 # Copyright 2013 Alexander Poluektov
 # This file is a part of my solution for 'follower-maze' challenge by SoundCloud
 
+import logging
 import unittest
 from collections import defaultdict
 
 from followermaze.eventhandler import EventHandler
 from followermaze.server import Server
-from followermaze.usergraph import UserGraph
-from followermaze.event import Event
+from followermaze.usergraph import UserGraph, CompactUserGraph
+from followermaze.event import Event, EventQueue
 
 
 class FakeServer(object):
@@ -17,6 +18,10 @@ class FakeServer(object):
     def send(self, conn, msg):
         self.messages[conn].append(msg + '\n')
 
+    def send_many(self, conns, msg):
+        for conn in conns:
+            self.send(conn, msg)
+
 
 class LoggingUser(UserGraph.User):
     @classmethod
@@ -47,8 +52,11 @@ class LoggingUser(UserGraph.User):
 
 
 class TestEventHandler(unittest.TestCase):
+    def make_graph(self):
+        return UserGraph(LoggingUser)
+
     def setUp(self):
-        self.graph = UserGraph(LoggingUser)
+        self.graph = self.make_graph()
 
         self.graph.register_user('me', connection=1)
         self.graph.register_user('you', connection=2)
@@ -113,13 +121,107 @@ class TestEventHandler(unittest.TestCase):
         LoggingUser.start_logging_changes()
         self.handler.private(Event.from_string('1|P|you|him'))
         self.assertEqual(self.server.messages, {})
-        # new user can be added here by UserGraph on demand but not followers
-        self.assertFalse(LoggingUser.followers_changed())
+        # neither new user nor followers are added
+        self.assertFalse(LoggingUser.graph_changed())
+        self.assertTrue(self.graph.get_user('him') is None)
 
 
     def test_status_update_works(self):
         LoggingUser.start_logging_changes()
         self.handler.status_update(Event.from_string('1|S|me'))
         self.assertEqual(self.server.messages, {2: ['1|S|me\n'], 3: ['1|S|me\n']} )
-        # new user can be added here by UserGraph on demand but not followers
-        self.assertFalse(LoggingUser.followers_changed())
+        # graph should not have changed
+        self.assertFalse(LoggingUser.graph_changed())
+
+
+    def test_status_update_of_unknown_user_works(self):
+        LoggingUser.start_logging_changes()
+        self.handler.status_update(Event.from_string('1|S|him'))
+        self.assertEqual(self.server.messages, {})
+        self.assertFalse(LoggingUser.graph_changed())
+        self.assertTrue(self.graph.get_user('him') is None)
+
+
+    def test_events_received_in_batch(self):
+        handler = EventHandler(self.graph, self.server, EventQueue())
+        self.assertTrue(handler.on_events_received(['2|B', '1|S|me']))
+        self.assertEqual(sorted(e.message for e in handler.queue.queue), ['1|S|me', '2|B'])
+
+
+    def test_bad_event_in_batch_rejects_connection(self):
+        handler = EventHandler(self.graph, self.server, EventQueue())
+        self.assertFalse(handler.on_events_received(['1|B', 'abrakadabra', '2|B']))
+        self.assertEqual([e.message for e in handler.queue.queue], ['1|B'])
+        self.assertEqual(handler.events_parsed, 1)
+        self.assertEqual(handler.events_rejected, 1)
+
+
+    def test_decoded_events_are_queued(self):
+        handler = EventHandler(self.graph, self.server, EventQueue())
+        self.assertTrue(handler.on_events_decoded([Event.from_string('2|B'), Event.from_string('1|S|me')]))
+        self.assertEqual(sorted(e.message for e in handler.queue.queue), ['1|S|me', '2|B'])
+        self.assertEqual(handler.events_parsed, 2)
+
+
+    def test_disconnected_client_is_not_notified(self):
+        self.handler.on_client_id_received(5, 'misterx')
+        self.handler.follow(Event.from_string('1|F|me|misterx'))
+        self.handler.on_client_disconnected(5)
+
+        self.handler.follow(Event.from_string('2|F|you|misterx'))
+        self.handler.broadcast(Event.from_string('3|B'))
+        self.assertEqual(self.server.messages[5], ['1|F|me|misterx\n'])
+        self.assertTrue(self.graph.user('misterx') not in self.graph.connected_users())
+
+
+    def test_disconnect_of_replaced_connection_keeps_new_one(self):
+        self.handler.on_client_id_received(5, 'misterx')
+        self.handler.on_client_id_received(6, 'misterx')
+        self.handler.on_client_disconnected(5)
+        self.handler.on_client_disconnected(7)
+
+        self.handler.private(Event.from_string('1|P|me|misterx'))
+        self.assertEqual(self.server.messages, {6: ['1|P|me|misterx\n']})
+
+
+    def test_trace_is_sampled(self):
+        class Records(logging.Handler):
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.messages = []
+
+            def emit(self, record):
+                self.messages.append(record.getMessage())
+
+        records = Records()
+        logger = logging.getLogger()
+        level = logger.level
+        logger.addHandler(records)
+        logger.setLevel(logging.INFO)
+        try:
+            handler = EventHandler(self.graph, self.server, EventQueue(), trace_every=2)
+            for msg in '1|B', '2|B', '3|B':
+                handler.on_event_received(msg)
+                handler.on_event(Event.from_string(msg))
+            for i in range(3):
+                handler.on_events_received(['4|B'] * (i + 1))
+        finally:
+            logger.removeHandler(records)
+            logger.setLevel(level)
+
+        # events received and processed are sampled separately, batches too
+        self.assertEqual(records.messages, [
+            "EventHandler: new event string received from server: '1|B'",
+            "EventHandler: processing event '1|B'",
+            "EventHandler: new event string received from server: '3|B'",
+            "EventHandler: processing event '3|B'",
+            "EventHandler: 1 event strings received from server",
+            "EventHandler: 3 event strings received from server",
+        ])
+        # level is checked once, when the handler is created
+        self.assertFalse(self.handler.trace)
+
+
+class TestEventHandlerWithCompactGraph(TestEventHandler):
+    def make_graph(self):
+        return CompactUserGraph()
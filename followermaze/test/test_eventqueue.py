@@ -3,7 +3,7 @@
 
 import unittest
 
-from followermaze.event import Event, EventQueue
+from followermaze.event import Event, EventQueue, WindowEventQueue, make_event_queue
 
 class FakeHandler(object):
     def __init__(self):
@@ -13,14 +13,40 @@ class FakeHandler(object):
         self.messages.append(event.message)
 
 
+class FakeScheduler(object):
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay_s, callback):
+        timer = FakeTimer(delay_s, callback)
+        self.timers.append(timer)
+        return timer
+
+    def pending(self):
+        return [t for t in self.timers if not t.cancelled]
+
+
+class FakeTimer(object):
+    def __init__(self, delay_s, callback):
+        self.delay_s = delay_s
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
 class TestEventQueue(unittest.TestCase):
     def shouldReceive(self, msgs):
         self.assertEqual(self.handler.messages, msgs)
 
+    def make_queue(self, **kwargs):
+        return EventQueue(**kwargs)
+
     def setUp(self):
         self.handler = FakeHandler()
         self.timeout_s = 0.05
-        self.queue = EventQueue(max_capacity=3, timeout_s=self.timeout_s)
+        self.queue = self.make_queue(max_capacity=3, timeout_s=self.timeout_s)
         self.queue.set_handler(self.handler)
 
 
@@ -89,6 +115,8 @@ class TestEventQueue(unittest.TestCase):
         self.queue.add(Event.from_string('5|B'))
         self.queue.poll()
         self.shouldReceive(['2|S|3', '3|U|1|2', '4|P|42|123', '5|B'])
+        self.assertEqual(self.queue.gaps_skipped, 1)
+        self.assertEqual(self.queue.events_skipped, 1)
 
 
     def test_timeout_occured(self):
@@ -102,3 +130,90 @@ class TestEventQueue(unittest.TestCase):
         time.sleep(self.timeout_s)
         self.queue.poll()
         self.shouldReceive(['2|S|3', '3|U|1|2', '4|P|42|123'])
+
+
+    def test_scheduled_timeout(self):
+        scheduler = FakeScheduler()
+        self.queue.set_scheduler(scheduler)
+
+        self.queue.add(Event.from_string('2|S|3'))
+        self.queue.add(Event.from_string('3|U|1|2'))
+        self.queue.poll()
+        self.queue.poll()
+        self.shouldReceive([])
+        self.assertEqual(len(scheduler.pending()), 1)
+        self.assertEqual(scheduler.pending()[0].delay_s, self.timeout_s)
+
+        # timer fires without anybody calling poll()
+        scheduler.pending()[0].callback()
+        self.shouldReceive(['2|S|3', '3|U|1|2'])
+
+
+    def test_scheduled_timeout_cancelled_when_gap_filled(self):
+        scheduler = FakeScheduler()
+        self.queue.set_scheduler(scheduler)
+
+        self.queue.add(Event.from_string('2|S|3'))
+        self.queue.add(Event.from_string('4|B'))
+        self.queue.poll()
+        first_timer = scheduler.pending()[0]
+
+        # gap at 1 is filled, now waiting for 3
+        self.queue.add(Event.from_string('1|B'))
+        self.queue.poll()
+        self.shouldReceive(['1|B', '2|S|3'])
+        self.assertTrue(first_timer.cancelled)
+        self.assertEqual(len(scheduler.pending()), 1)
+
+        self.queue.add(Event.from_string('3|B'))
+        self.queue.poll()
+        self.shouldReceive(['1|B', '2|S|3', '3|B', '4|B'])
+        self.assertEqual(scheduler.pending(), [])
+
+
+class TestWindowEventQueue(TestEventQueue):
+    '''Runs all EventQueue tests against WindowEventQueue with a tiny window, so both window and heap are used.'''
+
+    def make_queue(self, **kwargs):
+        return WindowEventQueue(window_size=2, **kwargs)
+
+
+    def test_far_future_events(self):
+        self.queue = self.make_queue()
+        self.queue.set_handler(self.handler)
+
+        for msg in '5|B', '3|B', '4|B', '2|B':
+            self.queue.add(Event.from_string(msg))
+        self.assertEqual(len(self.queue), 4)
+        self.assertEqual(len(self.queue.queue), 3)
+        self.queue.poll()
+        self.shouldReceive([])
+
+        self.queue.add(Event.from_string('1|B'))
+        self.queue.poll()
+        self.shouldReceive(['1|B', '2|B', '3|B', '4|B', '5|B'])
+        self.assertEqual(len(self.queue), 0)
+
+
+    def test_capacity_exceeded_skips_to_first_buffered(self):
+        for msg in '6|B', '3|B', '4|B', '5|B':
+            self.queue.add(Event.from_string(msg))
+        self.queue.poll()
+        self.shouldReceive(['3|B', '4|B', '5|B', '6|B'])
+
+
+    def test_late_event_is_dispatched(self):
+        for msg in '2|B', '3|B', '4|B', '5|B':
+            self.queue.add(Event.from_string(msg))
+        self.queue.poll()
+        self.queue.add(Event.from_string('1|B'))
+        self.queue.poll()
+        self.shouldReceive(['2|B', '3|B', '4|B', '5|B', '1|B'])
+
+
+class TestMakeEventQueue(unittest.TestCase):
+    def test_make_event_queue(self):
+        self.assertTrue(type(make_event_queue()) is EventQueue)
+        self.assertTrue(type(make_event_queue('heap', max_capacity=3)) is EventQueue)
+        self.assertEqual(make_event_queue('window', window_size=8).window_size, 8)
+        self.assertRaises(ValueError, make_event_queue, 'abrakadabra')
@@ -0,0 +1,176 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from followermaze.event import Event, EventQueue, FOLLOW, UNFOLLOW
+from followermaze.journal import Journal
+from followermaze.usergraph import UserGraph, CompactUserGraph, is_csr_snapshot
+
+
+class RecordingHandler(object):
+    def __init__(self, graph):
+        self.graph = graph
+        self.events = []
+
+    def on_event(self, event):
+        self.events.append(event.message)
+        if event.code == FOLLOW:
+            self.graph.add_follower(event.to_user, event.from_user)
+        elif event.code == UNFOLLOW:
+            self.graph.remove_follower(event.to_user, event.from_user)
+
+
+class TestJournal(unittest.TestCase):
+
+    def make_graph(self):
+        return UserGraph()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='followermaze-test-')
+        self.journals = []
+
+    def tearDown(self):
+        for journal in self.journals:
+            journal.close()
+        shutil.rmtree(self.directory)
+
+    def open_journal(self, **kwargs):
+        graph = self.make_graph()
+        journal = Journal(self.directory, RecordingHandler(graph), graph, **kwargs)
+        self.journals.append(journal)
+        return journal
+
+    def apply(self, journal, *msgs):
+        for msg in msgs:
+            journal.on_event(Event.from_string(msg))
+
+    def followers(self, graph, user_id):
+        return sorted(graph.user(user_id).followers)
+
+
+    def test_recover_from_empty_directory(self):
+        journal = self.open_journal()
+        queue = EventQueue()
+        self.assertEqual(journal.recover(queue), 0)
+        self.assertEqual(queue.waiting_for, 1)
+
+
+    def test_events_are_passed_to_handler(self):
+        journal = self.open_journal()
+        journal.recover()
+        self.apply(journal, '1|F|a|b', '2|B')
+        self.assertEqual(journal.handler.events, ['1|F|a|b', '2|B'])
+
+
+    def test_recover_replays_journal(self):
+        journal = self.open_journal()
+        journal.recover()
+        self.apply(journal, '1|F|a|b', '2|F|c|b', '3|F|a|d', '4|U|a|d', '5|B')
+        journal.close()
+
+        journal = self.open_journal()
+        queue = EventQueue()
+        self.assertEqual(journal.recover(queue), 5)
+        self.assertEqual(queue.waiting_for, 6)
+        self.assertEqual(self.followers(journal.graph, 'b'), ['a', 'c'])
+        self.assertEqual(self.followers(journal.graph, 'd'), [])
+
+
+    def test_recover_from_snapshot_replays_only_tail(self):
+        journal = self.open_journal(snapshot_every=3)
+        journal.recover()
+        self.apply(journal, '1|F|a|b', '2|F|c|b', '3|F|a|d', '4|U|c|b')
+        journal.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ['journal-000000000004', 'snapshot-000000000004'])
+
+        journal = self.open_journal()
+        queue = EventQueue()
+        self.assertEqual(journal.recover(queue), 1)
+        self.assertEqual(queue.waiting_for, 5)
+        self.assertEqual(self.followers(journal.graph, 'b'), ['a'])
+        self.assertEqual(self.followers(journal.graph, 'd'), ['a'])
+
+        # the journal is appended to after recovery
+        self.apply(journal, '5|F|e|b')
+        journal.close()
+        journal = self.open_journal()
+        self.assertEqual(journal.recover(), 2)
+        self.assertEqual(self.followers(journal.graph, 'b'), ['a', 'e'])
+
+
+    def test_directory_is_synced_before_old_files_are_deleted(self):
+        journal = self.open_journal(snapshot_every=2)
+        journal.recover()
+        calls = []
+        fsync, remove = os.fsync, os.remove
+        def recording_fsync(fd):
+            if stat.S_ISDIR(os.fstat(fd).st_mode):
+                calls.append('fsync directory')
+            fsync(fd)
+        def recording_remove(path):
+            calls.append('remove')
+            remove(path)
+        os.fsync, os.remove = recording_fsync, recording_remove
+        try:
+            self.apply(journal, '1|F|a|b', '2|F|c|b')
+        finally:
+            os.fsync, os.remove = fsync, remove
+        self.assertEqual(calls, ['fsync directory', 'remove'])
+
+
+    def test_snapshot_is_loaded_by_other_graph_kind(self):
+        journal = self.open_journal(snapshot_every=2)
+        journal.recover()
+        self.apply(journal, '1|F|a|b', '2|F|c|b')
+        journal.close()
+
+        graph = UserGraph() if isinstance(journal.graph, CompactUserGraph) else CompactUserGraph()
+        journal = Journal(self.directory, RecordingHandler(graph), graph)
+        self.journals.append(journal)
+        self.assertEqual(journal.recover(), 0)
+        self.assertEqual(self.followers(graph, 'b'), ['a', 'c'])
+
+
+    def test_incomplete_last_event_is_dropped(self):
+        journal = self.open_journal()
+        journal.recover()
+        self.apply(journal, '1|F|a|b')
+        journal.file.write('2|F|c')
+        journal.close()
+
+        journal = self.open_journal()
+        queue = EventQueue()
+        self.assertEqual(journal.recover(queue), 1)
+        self.assertEqual(queue.waiting_for, 2)
+        self.apply(journal, '2|F|c|b')
+        journal.close()
+
+        journal = self.open_journal()
+        self.assertEqual(journal.recover(), 2)
+        self.assertEqual(self.followers(journal.graph, 'b'), ['a', 'c'])
+
+
+    def test_events_are_synced_in_batches(self):
+        journal = self.open_journal(sync_every=2)
+        journal.recover()
+        self.apply(journal, '1|B')
+        self.assertEqual(journal.unsynced, 1)
+        self.apply(journal, '2|B')
+        self.assertEqual(journal.unsynced, 0)
+
+
+class TestJournalWithCompactGraph(TestJournal):
+    def make_graph(self):
+        return CompactUserGraph()
+
+
+    def test_snapshot_is_binary(self):
+        journal = self.open_journal(snapshot_every=2)
+        journal.recover()
+        self.apply(journal, '1|F|a|b', '2|F|c|b')
+        self.assertTrue(is_csr_snapshot(os.path.join(self.directory, 'snapshot-000000000003')))
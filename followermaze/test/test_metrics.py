@@ -0,0 +1,104 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import unittest
+
+from followermaze.event import Event, EventQueue
+from followermaze.eventhandler import EventHandler
+from followermaze.metrics import Registry, instrument
+from followermaze.usergraph import UserGraph
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+
+    def test_counter_and_gauge(self):
+        counter = self.registry.counter('events_total', 'Events.')
+        gauge = self.registry.gauge('depth', 'Depth.')
+        counter.inc()
+        counter.inc(2)
+        gauge.set(5)
+        gauge.dec()
+
+        self.assertEqual(self.registry.render(),
+                         '# HELP events_total Events.\n'
+                         '# TYPE events_total counter\n'
+                         'events_total 3\n'
+                         '# HELP depth Depth.\n'
+                         '# TYPE depth gauge\n'
+                         'depth 4\n')
+
+
+    def test_callback_is_read_on_render(self):
+        values = [1]
+        self.registry.gauge('value', 'Value.', lambda: values[-1])
+        values.append(7)
+        self.assertTrue(self.registry.render().endswith('\nvalue 7\n'))
+
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('latency_seconds', 'Latency.', buckets=[0.1, 1.0])
+        for value in 0.05, 0.1, 0.5, 2.0:
+            histogram.observe(value)
+
+        lines = self.registry.render().splitlines()[2:]
+        self.assertEqual(lines, ['latency_seconds_bucket{le="0.1"} 2',
+                                 'latency_seconds_bucket{le="1.0"} 3',
+                                 'latency_seconds_bucket{le="+Inf"} 4',
+                                 'latency_seconds_sum 2.65',
+                                 'latency_seconds_count 4'])
+
+
+    def test_duplicate_name_rejected(self):
+        self.registry.counter('events_total', 'Events.')
+        self.assertRaises(ValueError, self.registry.gauge, 'events_total', 'Events.')
+
+
+class TestInstrument(unittest.TestCase):
+
+    class FakeServer(object):
+        def __init__(self):
+            self.connections = {}
+            self.bytes_queued = 10
+            self.bytes_dropped = 2
+            self.slow_consumers_disconnected = 1
+            self.poll_time = None
+
+    def test_component_metrics(self):
+        graph = UserGraph()
+        queue = EventQueue()
+        server = self.FakeServer()
+        handler = EventHandler(graph, server, queue)
+        queue.set_handler(handler)
+        registry = Registry()
+        instrument(registry, server, handler, queue, graph)
+
+        handler.on_events_received(['3|B', '4|B', 'bad'])
+        graph.register_user('1', connection=object())
+
+        samples = dict(line.split(' ') for line in registry.render().splitlines() if not line.startswith('#'))
+        self.assertEqual(samples['followermaze_events_parsed_total'], '2')
+        self.assertEqual(samples['followermaze_events_rejected_total'], '1')
+        self.assertEqual(samples['followermaze_event_queue_depth'], '2')
+        self.assertEqual(samples['followermaze_clients_connected'], '1')
+        self.assertEqual(samples['followermaze_output_pending_bytes'], '0')
+        self.assertEqual(samples['followermaze_output_queued_bytes_total'], '10')
+        self.assertTrue(server.poll_time is not None)
+
+    def test_event_latency(self):
+        queue = EventQueue()
+        handler = EventHandler(UserGraph(), self.FakeServer(), queue)
+        queue.set_handler(handler)
+        instrument(Registry(), handler=handler)
+
+        handler.on_events_received(['2|B', '3|B'])
+        handler.on_event_received('1|B')
+        handler.on_events_received(['5|B'])
+        queue.poll()
+
+        # the event waiting for 4 is not delivered yet
+        self.assertEqual(handler.event_latency.count, 3)
+        self.assertEqual(handler.received_at.keys(), [5])
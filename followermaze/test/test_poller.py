@@ -0,0 +1,54 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import unittest
+import socket
+
+from followermaze.poller import make_poller, SelectPoller, EpollPoller, READ, WRITE
+
+
+class TestSelectPoller(unittest.TestCase):
+    poller_name = 'select'
+
+    def setUp(self):
+        self.poller = make_poller(self.poller_name)
+        self.a, self.b = socket.socketpair()
+
+    def tearDown(self):
+        self.poller.close()
+        self.a.close()
+        self.b.close()
+
+
+    def test_writable(self):
+        self.poller.register(self.a, WRITE)
+        self.assertEqual(self.poller.poll(0), [(self.a, WRITE)])
+
+
+    def test_readable(self):
+        self.poller.register(self.a, READ)
+        self.assertEqual(self.poller.poll(0), [])
+
+        self.b.send('x')
+        self.assertEqual(self.poller.poll(0), [(self.a, READ)])
+
+
+    def test_modify_and_unregister(self):
+        self.poller.register(self.a, READ)
+        self.poller.modify(self.a, READ | WRITE)
+        self.assertEqual(self.poller.poll(0), [(self.a, WRITE)])
+
+        self.poller.unregister(self.a)
+        self.b.send('x')
+        self.assertEqual(self.poller.poll(0), [])
+
+
+class TestEpollPoller(TestSelectPoller):
+    poller_name = 'epoll'
+
+
+class TestMakePoller(unittest.TestCase):
+    def test_make_poller(self):
+        self.assertTrue(isinstance(make_poller('select'), SelectPoller))
+        self.assertTrue(isinstance(make_poller('epoll'), EpollPoller))
+        self.assertRaises(ValueError, make_poller, 'abrakadabra')
@@ -0,0 +1,163 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from followermaze import wire
+from followermaze.event import Event, EventQueue, BROADCAST
+from followermaze.eventhandler import EventHandler
+from followermaze.replay import Recorder, CountingSink, replay, recorded_user_ids, iter_recording
+from followermaze.usergraph import UserGraph, CompactUserGraph
+
+
+class ListListener(object):
+    def __init__(self):
+        self.msgs = []
+        self.clients = []
+
+    def on_event_received(self, msg):
+        self.msgs.append(msg)
+        return True
+
+    def on_events_decoded(self, events):
+        self.msgs.extend(event.message for event in events)
+        return True
+
+    def on_client_id_received(self, connection, msg):
+        self.clients.append(msg)
+        return False
+
+
+class TestReplay(unittest.TestCase):
+
+    def make_graph(self):
+        return UserGraph()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='followermaze-test-')
+        self.path = os.path.join(self.directory, 'events')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+
+    def test_recorder_writes_messages_and_passes_them_on(self):
+        listener = ListListener()
+        recorder = Recorder(self.path, listener)
+        self.assertTrue(recorder.on_event_received('1|F|1|2'))
+        self.assertTrue(recorder.on_events_received(['3|B', '2|S|1']))
+        self.assertTrue(recorder.on_events_decoded([wire.BinaryEvent(None, 4, BROADCAST)]))
+        self.assertFalse(recorder.on_client_id_received(None, '1'))
+        recorder.close()
+
+        self.assertEqual(listener.msgs, ['1|F|1|2', '3|B', '2|S|1', '4|B'])
+        self.assertEqual(listener.clients, ['1'])
+        self.assertEqual(recorder.recorded, 4)
+        self.assertEqual(open(self.path).read(), '1|F|1|2\n3|B\n2|S|1\n4|B\n')
+
+    def test_recorder_writes_only_accepted_messages(self):
+        class Listener(ListListener):
+            def on_event_received(self, msg):
+                return msg != 'bad' and ListListener.on_event_received(self, msg)
+
+        recorder = Recorder(self.path, Listener())
+        self.assertFalse(recorder.on_event_received('bad'))
+        self.assertFalse(recorder.on_events_received(['1|B', 'bad', '2|B']))
+        recorder.close()
+        self.assertEqual(recorder.recorded, 1)
+        self.assertEqual(open(self.path).read(), '1|B\n')
+
+    def test_replay_of_batch_with_malformed_message_matches_live_server(self):
+        graph = self.make_graph()
+        sink = CountingSink()
+        queue = EventQueue()
+        handler = EventHandler(graph, sink, queue)
+        queue.set_handler(handler)
+        for user_id in '1', '2':
+            graph.register_user(user_id, connection=object())
+        recorder = Recorder(self.path, handler)
+        # the server disconnects the event source on the malformed message and the rest of the batch is lost
+        self.assertFalse(recorder.on_events_received(['1|F|1|2', '2|B', '3|X', '3|B', '4|S|2']))
+        recorder.on_poll()
+        recorder.close()
+
+        result = replay(self.path, self.make_graph(), EventQueue(), connected=['1', '2'])
+        self.assertEqual(sink.deliveries, 1 + 2)
+        self.assertEqual(result['deliveries'], sink.deliveries)
+        self.assertEqual(result['events_rejected'], 0)
+
+    def test_recorder_overwrites_previous_recording(self):
+        self.write('1|B\n2|B\n')
+        recorder = Recorder(self.path, ListListener())
+        recorder.on_event_received('1|S|1')
+        recorder.close()
+        self.assertEqual(open(self.path).read(), '1|S|1\n')
+
+    def test_recorder_as_server_listener_keeps_handler_methods(self):
+        handler = EventHandler(self.make_graph(), None, EventQueue())
+        recorder = Recorder(self.path, handler)
+        self.assertEqual(recorder.on_poll, handler.on_poll)
+        self.assertEqual(recorder.on_client_disconnected, handler.on_client_disconnected)
+        recorder.close()
+
+    def test_iter_recording_splits_lines_across_chunks(self):
+        self.write('1|F|1|2\r\n2|B\n\n3|S|1\n4|P|2|1')
+        msgs = [msg for chunk in iter_recording(self.path, chunk_size=5) for msg in chunk]
+        self.assertEqual(msgs, ['1|F|1|2', '2|B', '3|S|1', '4|P|2|1'])
+
+    def test_iter_recording_of_empty_file(self):
+        self.write('')
+        self.assertEqual(list(iter_recording(self.path)), [])
+
+    def test_recorded_user_ids(self):
+        self.write('1|F|1|2\n2|B\n3|S|3\n4|P|2|4\n')
+        self.assertEqual(recorded_user_ids(self.path), set(['1', '2', '3', '4']))
+
+    def test_replay_processes_events_in_order(self):
+        # user 2 gets followed by 1 and 3, then updates status; 1 unfollows 2 before the broadcast
+        self.write('2|F|3|2\n1|F|1|2\n4|B\n3|U|1|2\n5|S|2\n6|P|2|1\n')
+        graph = self.make_graph()
+        result = replay(self.path, graph, EventQueue(), connected=['1', '2', '3'])
+
+        self.assertEqual(result['events_read'], 6)
+        self.assertEqual(result['events_processed'], 6)
+        self.assertEqual(result['events_rejected'], 0)
+        self.assertEqual(result['events_pending'], 0)
+        # follows notify the followed user, broadcast all 3, status update the remaining follower, private 1
+        self.assertEqual(result['deliveries'], 2 + 3 + 1 + 1)
+        self.assertEqual(result['messages'], 5)
+        self.assertEqual(result['max_fanout'], 3)
+        self.assertEqual(result['fanout']['broadcast'], {'events': 1, 'deliveries': 3, 'mean': 3.0})
+        self.assertEqual(result['fanout']['follow']['events'], 2)
+        self.assertEqual(result['fanout']['unfollow']['deliveries'], 0)
+        self.assertEqual(result['graph_edges'], 1)
+        self.assertEqual(result['graph_users'], 3)
+        self.assertEqual(result['connected_users'], 3)
+        self.assertEqual(sorted(graph.user('2').followers), ['3'])
+
+    def test_replay_skips_malformed_messages(self):
+        self.write('1|F|1|2\nbad\n2|B\n3|X\n3|S|2\n')
+        result = replay(self.path, self.make_graph(), EventQueue(), connected=['1'])
+        self.assertEqual(result['events_read'], 5)
+        self.assertEqual(result['events_rejected'], 2)
+        self.assertEqual(result['events_processed'], 3)
+        self.assertEqual(result['deliveries'], 2)
+
+    def test_replay_reports_events_left_in_queue(self):
+        self.write('1|B\n3|B\n')
+        result = replay(self.path, self.make_graph(), EventQueue())
+        self.assertEqual(result['events_processed'], 1)
+        self.assertEqual(result['events_pending'], 1)
+
+
+class TestReplayWithCompactGraph(TestReplay):
+
+    def make_graph(self):
+        return CompactUserGraph()
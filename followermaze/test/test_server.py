@@ -1,16 +1,22 @@
 # Copyright 2013 Alexander Poluektov
 # This file is a part of my solution for 'follower-maze' challenge by SoundCloud
 
+import errno
 import unittest
 
 import socket
+import struct
 import threading
 import time
 
 from followermaze.eventhandler import EventHandler
 from followermaze.server import Server
 from followermaze.usergraph import UserGraph
-from followermaze.event import Event, EventQueue
+from followermaze.event import Event, EventQueue, BROADCAST, FOLLOW
+from followermaze import wire
+from followermaze.connection import Connection
+from followermaze.metrics import Registry
+from followermaze.poller import READ, ERROR
 
 
 def init_socket(port):
@@ -44,6 +50,18 @@ def new_client(userid):
     return t
 
 
+def new_client_sending_in_parts(*parts, **kwargs):
+    def client():
+        s = init_socket(kwargs.get('port', 9099))
+        for part in parts:
+            s.sendall(part)
+            time.sleep(0.01)
+        receive(s, 0.05)
+
+    t = threading.Thread(target=client)
+    return t
+
+
 def event_source(*messages):
     def source():
         s = init_socket(9090)
@@ -64,6 +82,7 @@ class TestServer(unittest.TestCase):
         def __init__(self, server):
             self.clients_received = []
             self.events_received = []
+            self.clients_disconnected = []
 
         def on_client_id_received(self, s, msg):
             self.clients_received.append(msg)
@@ -71,8 +90,15 @@ class TestServer(unittest.TestCase):
 
         def on_event_received(self, msg):
             self.events_received.append(msg)
+            return msg != 'bad'
+
+        def on_events_decoded(self, events):
+            self.events_received.extend(e.message for e in events)
             return True
 
+        def on_client_disconnected(self, s):
+            self.clients_disconnected.append(s)
+
         def on_poll(self):
             pass
 
@@ -133,3 +159,317 @@ class TestServer(unittest.TestCase):
 
         self.assertClientsReceived(['me', 'me', 'you'])
         self.assertEventsReceived(['one', 'two', 'three'])
+
+
+    def test_multiple_event_sources(self):
+        sources = [event_source('1', '3', '5'), event_source('2', '4')]
+        for s in sources:
+            s.start()
+        for s in sources:
+            s.join()
+
+        events = self.listener.events_received
+        self.assertEqual(sorted(events), ['1', '2', '3', '4', '5'])
+        # events of each source are received in the order they were sent
+        self.assertEqual([e for e in events if e in '135'], ['1', '3', '5'])
+
+
+    def test_bad_event_source_is_disconnected_alone(self):
+        good = init_socket(9090)
+        bad = init_socket(9090)
+        bad.sendall('bad\r\n')
+        bad.settimeout(1)
+        self.assertEqual(bad.recv(1024), '')
+        bad.close()
+
+        good.sendall('one\r\n')
+        start_time = time.time()
+        while 'one' not in self.listener.events_received and time.time() - start_time < 1:
+            time.sleep(0.01)
+        good.close()
+        self.assertEqual(self.listener.events_received, ['bad', 'one'])
+
+
+    def test_binary_event_source(self):
+        data = wire.PREAMBLE + wire.encode_event(1, BROADCAST) + wire.encode_event(2, FOLLOW, 5, 7)
+        # preamble and frames split between sends
+        s = new_client_sending_in_parts(data[:3], data[3:10], data[10:], port=9090)
+        s.start()
+        s.join()
+        self.assertEventsReceived(['1|B', '2|F|5|7'])
+
+
+    def test_client_id_received_in_parts(self):
+        c = new_client_sending_in_parts('m', 'e', '\r\n')
+        c.start()
+        c.join()
+        self.assertClientsReceived(['me'])
+
+
+    def test_client_disconnect_is_reported(self):
+        c = new_client('me')
+        c.start()
+        c.join()
+
+        # the server notices disconnect asynchronously
+        start_time = time.time()
+        while not self.listener.clients_disconnected and time.time() - start_time < 1:
+            time.sleep(0.01)
+        self.assertEqual(len(self.listener.clients_disconnected), 1)
+        self.assertTrue(self.listener.clients_disconnected[0].closed)
+
+
+class TestServerSend(unittest.TestCase):
+    '''Checks output path of the server without running its thread.'''
+
+    class Listener(object):
+        def __init__(self):
+            self.clients_disconnected = []
+
+        def on_client_disconnected(self, connection):
+            self.clients_disconnected.append(connection)
+
+        def on_poll(self):
+            pass
+
+    def setUp(self):
+        self.server = Server(event_port=9090, client_port=9099)
+        self.server.set_listener(self.Listener())
+        self.pairs = [socket.socketpair() for i in range(3)]
+        self.connections = [self.server._add_connection(a, Connection.CLIENT, 0) for a, b in self.pairs]
+
+    def tearDown(self):
+        self.server._cleanup()
+        for a, b in self.pairs:
+            b.close()
+
+
+    def test_send_many_shares_chunk(self):
+        self.server.send_many(self.connections, '1|B')
+
+        chunks = [c.outbuf.chunks[0] for c in self.connections]
+        self.assertEqual(chunks[0], '1|B\r\n')
+        for chunk in chunks:
+            self.assertTrue(chunk is chunks[0])
+
+        self.server._poll()
+        for a, b in self.pairs:
+            self.assertEqual(b.recv(1024), '1|B\r\n')
+        for c in self.connections:
+            self.assertEqual(len(c.outbuf), 0)
+
+
+    def test_event_source_error_frees_its_slot(self):
+        disconnected = []
+        self.server.on_event_source_disconnected = lambda: disconnected.append(True)
+        a, b = socket.socketpair()
+        self.pairs.append((a, b))
+        connection = self.server.add_event_source(a)
+        # as the select poller reports a socket in the exceptional set
+        self.server.poller.poll = lambda timeout: [(connection, ERROR)]
+        self.server._poll()
+
+        self.assertTrue(connection.closed)
+        self.assertFalse(connection in self.server.event_connections)
+        self.assertEqual(disconnected, [True])
+
+
+    def test_event_source_gone_before_reject(self):
+        self.server.max_event_sources = 0
+        s = socket.create_connection(('localhost', 9090))
+        # reset the connection on close
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        s.close()
+        self.server._poll()
+        self.assertEqual(self.server.event_connections, set())
+
+
+    def test_call_later(self):
+        called = []
+        self.server.call_later(0, lambda: called.append(True))
+        self.server._poll()
+        self.assertEqual(called, [True])
+
+
+    def test_closed_connection_drops_buffered_output(self):
+        connection = self.connections[0]
+        self.server.send(connection, '1|B')
+        self.server._close_connection(connection)
+        self.server.send(connection, '2|B')
+
+        self.assertEqual(len(connection.outbuf), 0)
+        self.assertEqual(self.server.listener.clients_disconnected, [connection])
+
+
+    def set_watermarks(self, high, low, policy):
+        self.server.high_watermark = high
+        self.server.low_watermark = low
+        self.server.slow_consumer_policy = policy
+
+
+    def test_slow_consumer_is_disconnected(self):
+        self.set_watermarks(10, 5, 'disconnect')
+        fast, slow = self.connections[:2]
+        self.server.send(slow, '1|B')
+        self.server.send_many([fast, slow], '2|P|1|2')
+
+        self.assertTrue(slow.closed)
+        self.assertFalse(fast.closed)
+        self.assertEqual(self.server.bytes_dropped, 5 + 9)
+        self.assertEqual(self.server.bytes_queued, 5 + 9)
+        self.assertEqual(self.server.slow_consumers_disconnected, 1)
+        self.assertEqual(self.server.listener.clients_disconnected, [slow])
+
+
+    def test_slow_consumer_drops_oldest(self):
+        self.set_watermarks(10, 5, 'drop_oldest')
+        connection = self.connections[0]
+        for msg in '1|B', '2|B', '3|B':
+            self.server.send(connection, msg)
+
+        self.assertEqual(list(connection.outbuf.chunks), ['3|B\r\n'])
+        self.assertEqual(self.server.bytes_dropped, 10)
+
+
+    def test_slow_consumer_drops_new(self):
+        self.set_watermarks(10, 5, 'drop_new')
+        connection = self.connections[0]
+        for msg in '1|B', '2|B', '3|B':
+            self.server.send(connection, msg)
+        self.assertEqual(list(connection.outbuf.chunks), ['1|B\r\n', '2|B\r\n'])
+        self.assertTrue(connection.dropping)
+
+        # still dropping until the client catches up down to the low watermark
+        connection.outbuf.write_to(self.pairs[0][0])
+        self.server.send(connection, '4|B')
+        self.assertEqual(list(connection.outbuf.chunks), ['4|B\r\n'])
+        self.assertFalse(connection.dropping)
+        self.assertEqual(self.server.bytes_dropped, 5)
+
+
+    def test_slow_consumer_pauses_event_sources(self):
+        self.set_watermarks(10, 5, 'backpressure')
+        a, b = socket.socketpair()
+        self.pairs.append((a, b))
+        source = self.server.add_event_source(a)
+        slow, other = self.connections[:2]
+        for msg in '1|B', '2|B', '3|B':
+            self.server.send(slow, msg)
+
+        # nothing is dropped, but event sources are not read until the client catches up
+        self.assertEqual(list(slow.outbuf.chunks), ['1|B\r\n', '2|B\r\n', '3|B\r\n'])
+        self.assertEqual(self.server.bytes_dropped, 0)
+        self.assertFalse(source.events & READ)
+        c, d = socket.socketpair()
+        self.pairs.append((c, d))
+        new_source = self.server.add_event_source(c)
+        self.assertFalse(new_source.events & READ)
+
+        self.server.send_many([slow, other], '4|B')
+        self.assertEqual(self.server.blocking_consumers, set([slow]))
+        self.server._write_data(slow)
+        self.assertEqual(len(slow.outbuf), 0)
+        self.assertTrue(source.events & READ)
+        self.assertTrue(new_source.events & READ)
+        self.assertEqual(self.server.blocking_consumers, set())
+
+
+    def test_closing_slow_consumer_resumes_event_sources(self):
+        self.set_watermarks(10, 5, 'backpressure')
+        a, b = socket.socketpair()
+        self.pairs.append((a, b))
+        source = self.server.add_event_source(a)
+        slow = self.connections[0]
+        for msg in '1|B', '2|B', '3|B':
+            self.server.send(slow, msg)
+        self.assertFalse(source.events & READ)
+
+        self.server._close_connection(slow)
+        self.assertTrue(source.events & READ)
+
+
+    def client_connections(self):
+        return [c for c in self.server.connections.values() if c.role in (Connection.CLIENT, Connection.REGISTERED_CLIENT)]
+
+
+    def test_pending_connections_accepted_at_once(self):
+        clients = [socket.create_connection(('localhost', 9099)) for i in range(3)]
+        self.server._poll()
+        self.assertEqual(len(self.client_connections()), 3 + len(self.connections))
+        for s in clients:
+            s.close()
+
+
+    def test_accept_batch_limits_connections_accepted_at_once(self):
+        self.server.accept_batch = 2
+        clients = [socket.create_connection(('localhost', 9099)) for i in range(3)]
+        self.server._poll()
+        self.assertEqual(len(self.client_connections()), 2 + len(self.connections))
+        self.server._poll()
+        self.assertEqual(len(self.client_connections()), 3 + len(self.connections))
+        for s in clients:
+            s.close()
+
+
+    def test_accept_backs_off_when_out_of_file_descriptors(self):
+        class Listening(object):
+            def __init__(self, sock):
+                self.sock = sock
+
+            def accept(self):
+                raise socket.error(errno.EMFILE, 'Too many open files')
+
+            def fileno(self):
+                return self.sock.fileno()
+
+        control = self.server.client_control
+        control.sock = Listening(control.sock)
+        self.server.accept_backoff_s = 0
+        self.server._handle_client_connection(control)
+        # the listening socket is not polled until the timer expires
+        self.assertEqual(control.events, 0)
+        control.sock = control.sock.sock
+        self.server._poll()
+        self.assertEqual(control.events, READ)
+
+
+    def test_too_long_client_id_disconnects_client(self):
+        a, b = self.pairs[0]
+        connection = self.connections[0]
+        b.sendall('x' * (Server.max_client_id_length + 1))
+        # the client id is read in two parts
+        for i in range(2):
+            self.server._handle_client_data(connection)
+        self.assertTrue(connection.closed)
+
+
+    def test_client_id_line_followed_by_more_data(self):
+        received = []
+        self.server.listener.on_client_id_received = lambda connection, msg: received.append(msg)
+        a, b = self.pairs[0]
+        b.sendall('me\r\nmore')
+        self.server._handle_client_data(self.connections[0])
+        self.assertEqual(received, ['me'])
+        self.assertEqual(self.connections[0].role, Connection.REGISTERED_CLIENT)
+
+
+    def test_metrics_endpoint(self):
+        self.server._cleanup()
+        self.server = Server(event_port=9090, client_port=9099, metrics_port=9091)
+        self.server.set_listener(self.Listener())
+        registry = Registry()
+        registry.counter('test_total', 'Test counter.').inc(3)
+        self.server.set_metrics(registry)
+
+        s = init_socket(9091)
+        s.sendall('GET /metrics HTTP/1.0\r\n\r\n')
+        for i in range(3):
+            self.server._poll()
+        response = s.recv(4096)
+        s.close()
+
+        self.assertTrue(response.startswith('HTTP/1.0 200 OK\r\n'))
+        self.assertTrue(response.endswith('\ntest_total 3\n'))
+        # the connection is closed once the response is written
+        roles = [c.role for c in self.server.connections.values()]
+        self.assertFalse(Connection.METRICS_CLIENT in roles)
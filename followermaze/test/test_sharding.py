@@ -0,0 +1,70 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import unittest
+
+import socket
+import time
+
+from followermaze.event import EventQueue
+from followermaze.sharding import ShardedServer
+
+
+def connect(port):
+    s = socket.create_connection(('localhost', port))
+    s.settimeout(1)
+    return s
+
+
+def read_lines(s, count):
+    data = ''
+    while data.count('\n') < count:
+        chunk = s.recv(1024)
+        if not chunk:
+            break
+        data += chunk
+    return data.splitlines()
+
+
+class TestShardedServer(unittest.TestCase):
+    '''Runs real worker processes, so it is rather an integration test.'''
+
+    def setUp(self):
+        self.server = ShardedServer(event_port=9090, client_port=9099, queue=EventQueue(), workers=2)
+        self.server.start()
+        self.sockets = []
+
+    def tearDown(self):
+        for s in self.sockets:
+            s.close()
+        self.server.stop()
+        for p in self.server.processes:
+            self.assertFalse(p.is_alive())
+
+
+    def test_events_are_delivered_through_workers(self):
+        clients = {}
+        for user_id in '1', '2', '3', '4':
+            s = connect(9099)
+            s.sendall('%s\r\n' % user_id)
+            clients[user_id] = s
+            self.sockets.append(s)
+        # let workers register the clients
+        time.sleep(0.2)
+
+        source = connect(9090)
+        self.sockets.append(source)
+        # out of order on purpose: the master puts events in order before forwarding them
+        source.sendall('2|F|2|1\r\n1|F|3|1\r\n4|S|1\r\n3|B\r\n5|P|4|2\r\n')
+
+        self.assertEqual(read_lines(clients['1'], 3), ['1|F|3|1', '2|F|2|1', '3|B'])
+        self.assertEqual(read_lines(clients['2'], 3), ['3|B', '4|S|1', '5|P|4|2'])
+        self.assertEqual(read_lines(clients['3'], 2), ['3|B', '4|S|1'])
+        self.assertEqual(read_lines(clients['4'], 1), ['3|B'])
+
+
+    def test_links_to_workers_apply_backpressure(self):
+        master = self.server.server
+        self.assertEqual(master.high_watermark, 16 * 1024 * 1024)
+        self.assertEqual(master.slow_consumer_policy, 'backpressure')
+        self.assertEqual(len(self.server.workers), 2)
@@ -0,0 +1,51 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import unittest
+
+from followermaze.timers import TimerQueue
+
+
+class TestTimerQueue(unittest.TestCase):
+    def setUp(self):
+        self.timers = TimerQueue()
+        self.called = []
+
+    def callback(self, name):
+        return lambda: self.called.append(name)
+
+
+    def test_no_timers(self):
+        self.assertEqual(self.timers.timeout(0), None)
+        self.timers.run_expired(100)
+        self.assertEqual(self.called, [])
+
+
+    def test_timers_run_in_deadline_order(self):
+        self.timers.call_later(2, self.callback('two'), now=0)
+        self.timers.call_later(1, self.callback('one'), now=0)
+        self.timers.call_later(3, self.callback('three'), now=0)
+        self.assertEqual(self.timers.timeout(0.5), 0.5)
+
+        self.timers.run_expired(2)
+        self.assertEqual(self.called, ['one', 'two'])
+        self.assertEqual(self.timers.timeout(2), 1)
+
+        self.timers.run_expired(10)
+        self.assertEqual(self.called, ['one', 'two', 'three'])
+        self.assertEqual(self.timers.timeout(10), None)
+
+
+    def test_overdue_timeout_is_zero(self):
+        self.timers.call_later(1, self.callback('one'), now=0)
+        self.assertEqual(self.timers.timeout(5), 0)
+
+
+    def test_cancelled_timer_is_not_called(self):
+        timer = self.timers.call_later(1, self.callback('one'), now=0)
+        self.timers.call_later(2, self.callback('two'), now=0)
+        timer.cancel()
+
+        self.assertEqual(self.timers.timeout(0), 2)
+        self.timers.run_expired(10)
+        self.assertEqual(self.called, ['two'])
@@ -1,9 +1,13 @@
 # Copyright 2013 Alexander Poluektov
 # This file is a part of my solution for 'follower-maze' challenge by SoundCloud
 
+import os
+import shutil
+import tempfile
 import unittest
+from array import array
 
-from followermaze.usergraph import UserGraph
+from followermaze.usergraph import UserGraph, CompactUserGraph, make_user_graph, is_csr_snapshot
 
 
 class TestUserGraph(unittest.TestCase):
@@ -19,8 +23,11 @@ class TestUserGraph(unittest.TestCase):
             self.graph.register_user(u, key=i)
         return user_ids
 
+    def make_graph(self):
+        return UserGraph()
+
     def setUp(self):
-        self.graph = UserGraph()
+        self.graph = self.make_graph()
 
 
     def test_register_user_works(self):
@@ -90,3 +97,231 @@ class TestUserGraph(unittest.TestCase):
 
         self.assertListOfUsersEqual(self.graph.followers_of('me'), self.users('you'))
         self.assertListOfUsersEqual(self.graph.all_users(), self.users(*some_users))
+
+
+    def test_lookups_do_not_create_users(self):
+        self.register_some_users()
+
+        self.assertTrue(self.graph.get_user('ghost') is None)
+        self.assertListOfUsersEqual(self.graph.iter_followers('ghost'), [])
+        self.assertListOfUsersEqual(self.graph.connected_followers('ghost'), [])
+        self.graph.remove_follower('ghost', 'me')
+        self.assertTrue(self.graph.get_user('ghost') is None)
+
+
+    def test_followers_are_not_users_until_created(self):
+        self.graph.add_follower('star', 'fan')
+        self.assertEqual(len(self.graph.all_users()), 1)
+        self.assertEqual(self.graph.get_user('fan'), None)
+        self.assertEqual(list(self.graph.iter_followers('star')), [])
+
+        self.graph.register_user('fan')
+        self.assertEqual(len(self.graph.all_users()), 2)
+        self.assertListOfUsersEqual(self.graph.iter_followers('star'), self.users('fan'))
+
+        self.graph.add_follower('star', 'other')
+        self.assertEqual(len(self.graph.followers_of('star')), 2)
+        self.assertEqual(len(self.graph.all_users()), 3)
+
+
+    def test_add_and_remove_follower(self):
+        self.register_some_users()
+        self.assertEqual(self.graph.add_follower('me', 'you'), self.graph.user('me'))
+        self.graph.add_follower('me', 'they')
+        self.graph.remove_follower('me', 'they')
+        self.graph.remove_follower('me', 'nobody')
+
+        self.assertListOfUsersEqual(self.graph.iter_followers('me'), self.users('you'))
+
+
+    def test_connected_followers(self):
+        self.graph.register_user('me')
+        self.graph.register_user('you', connection=1)
+        self.graph.register_user('they')
+        self.graph.add_follower('me', 'you')
+        self.graph.add_follower('me', 'they')
+        self.graph.add_follower('me', 'nobody')
+
+        self.assertListOfUsersEqual(self.graph.connected_followers('me'), self.users('you'))
+
+
+    def test_connected_users(self):
+        self.graph.register_user('me', connection=1)
+        self.graph.register_user('you', connection=2)
+        self.graph.register_user('they')
+        self.graph.add_follower('they', 'nobody')
+        self.assertListOfUsersEqual(self.graph.connected_users(), self.users('me', 'you'))
+
+        self.graph.disconnect_user('me')
+        self.graph.disconnect_user('ghost')
+        self.assertListOfUsersEqual(self.graph.connected_users(), self.users('you'))
+        self.assertEqual(getattr(self.graph.user('me'), 'connection', None), None)
+
+        self.graph.register_user('you', connection=None)
+        self.assertListOfUsersEqual(self.graph.connected_users(), [])
+
+
+    def test_connected_followers_of_high_fanout_user(self):
+        self.graph.register_user('star')
+        for i in range(100):
+            self.graph.add_follower('star', str(i))
+        for i in range(0, 100, 10):
+            self.graph.register_user(str(i), connection=i + 1)
+        self.graph.register_user('outsider', connection=1000)
+
+        self.assertListOfUsersEqual(self.graph.connected_followers('star'), self.users(*[str(i) for i in range(0, 100, 10)]))
+
+
+class TestCompactUserGraph(TestUserGraph):
+    def make_graph(self):
+        return CompactUserGraph()
+
+
+    def test_attributes_are_kept_in_side_table(self):
+        self.graph.register_user('me', connection=1)
+        self.graph.register_user('you')
+
+        self.assertEqual(self.graph.user('me').connection, 1)
+        self.assertEqual(getattr(self.graph.user('you'), 'connection', None), None)
+
+        self.graph.register_user('me', connection=2)
+        self.assertEqual(self.graph.user('me').connection, 2)
+
+
+    def test_missing_attribute_lookup_adds_no_table(self):
+        self.graph.register_user('me', connection=1)
+        attributes = dict(self.graph.attributes)
+        user = self.graph.user('me')
+        self.assertFalse(hasattr(user, 'foo'))
+        self.assertEqual(getattr(user, 'bar', None), None)
+        self.assertEqual(self.graph.attributes, attributes)
+
+
+    def test_followers_are_sorted_integers(self):
+        for u in 'me', 'you', 'they':
+            self.graph.register_user(u)
+        self.graph.user('me').add_follower('they')
+        self.graph.user('me').add_follower('you')
+
+        self.assertEqual(list(self.graph.followers[self.graph.ids['me']]), [1, 2])
+        self.assertEqual(self.graph.user('me').followers, set(['you', 'they']))
+
+
+class TestCompactUserGraphSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='followermaze-test-')
+        self.path = os.path.join(self.directory, 'graph')
+        self.graph = CompactUserGraph()
+        for user_id, follower_id in ('me', 'you'), ('me', 'they'), ('they', 'me'), ('star', 'me'):
+            self.graph.add_follower(user_id, follower_id)
+        self.graph.register_user('nobody')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, graph, path=None):
+        with open(path or self.path, 'wb') as f:
+            graph.write_snapshot(f)
+
+    def load(self):
+        graph = CompactUserGraph()
+        graph.load_snapshot(self.path)
+        return graph
+
+    def edges(self, graph):
+        return sorted((user_id, sorted(followers)) for user_id, followers in graph.iter_edges())
+
+
+    def test_snapshot_round_trip(self):
+        self.write(self.graph)
+        self.assertTrue(is_csr_snapshot(self.path))
+        graph = self.load()
+
+        self.assertEqual(graph.names, self.graph.names)
+        self.assertEqual(graph.ids, self.graph.ids)
+        self.assertEqual(self.edges(graph), self.edges(self.graph))
+        self.assertEqual(graph.user('me').followers, set(['you', 'they']))
+        self.assertEqual(graph.followers_of('nobody'), [])
+        # 'you' only follows, so it is not a user
+        self.assertEqual([u.user_id for u in graph.iter_followers('me')], ['they'])
+        self.assertEqual(graph.get_user('you'), None)
+        self.assertEqual(len(graph.all_users()), len(self.graph.all_users()))
+
+        graph.register_user('they', connection=1)
+        self.assertEqual([u.user_id for u in graph.connected_followers('me')], ['they'])
+
+    def test_followers_in_snapshot_are_not_copied(self):
+        self.write(self.graph)
+        graph = self.load()
+        followers = graph._followers(graph.ids['me'])
+        self.assertFalse(type(followers) is array)
+        self.assertEqual(list(followers), [graph.ids['you'], graph.ids['they']])
+
+    def test_connected_followers_copies_followers_out_of_snapshot(self):
+        self.write(self.graph)
+        graph = self.load()
+        graph.register_user('you', connection=1)
+        self.assertEqual([u.user_id for u in graph.connected_followers('me')], ['you'])
+        self.assertTrue(type(graph.followers[graph.ids['me']]) is array)
+        self.assertEqual(graph.user('me').followers, set(['you', 'they']))
+        self.assertFalse(type(graph._followers(graph.ids['star'])) is array)
+
+    def test_changes_after_loading_do_not_touch_snapshot(self):
+        self.write(self.graph)
+        graph = self.load()
+        graph.add_follower('me', 'nobody')
+        graph.remove_follower('they', 'me')
+        graph.add_follower('newcomer', 'star')
+
+        self.assertEqual(graph.user('me').followers, set(['you', 'they', 'nobody']))
+        self.assertEqual(graph.user('they').followers, set())
+        self.assertEqual(graph.user('newcomer').followers, set(['star']))
+        self.assertTrue(type(graph.followers[graph.ids['me']]) is array)
+        # untouched users are still in the snapshot
+        self.assertEqual(graph.user('star').followers, set(['me']))
+        self.assertEqual(self.edges(self.load()), self.edges(self.graph))
+
+        self.write(graph, os.path.join(self.directory, 'graph2'))
+        graph2 = CompactUserGraph()
+        graph2.load_snapshot(os.path.join(self.directory, 'graph2'))
+        self.assertEqual(self.edges(graph2), self.edges(graph))
+
+    def test_snapshot_file_can_be_deleted_after_loading(self):
+        self.write(self.graph)
+        graph = self.load()
+        os.remove(self.path)
+        self.assertEqual(graph.user('me').followers, set(['you', 'they']))
+
+    def test_empty_graph_snapshot(self):
+        self.write(CompactUserGraph())
+        graph = self.load()
+        self.assertEqual(graph.all_users(), [])
+        graph.add_follower('me', 'you')
+        self.assertEqual(graph.user('me').followers, set(['you']))
+
+    def test_load_snapshot_errors(self):
+        self.write(self.graph)
+        self.assertRaises(ValueError, self.graph.load_snapshot, self.path)
+
+        with open(self.path, 'wb') as f:
+            f.write('1|2|3\n' * 10)
+        self.assertFalse(is_csr_snapshot(self.path))
+        self.assertRaises(ValueError, CompactUserGraph().load_snapshot, self.path)
+
+
+    def test_truncated_or_corrupt_snapshot_is_not_loaded(self):
+        self.write(self.graph)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # the last user id 'nobody' is split in two, keeping the size
+        for bad in data[:-1], data + 'x', data[:-len('nobody')] + 'no\nbod':
+            with open(self.path, 'wb') as f:
+                f.write(bad)
+            self.assertRaises(ValueError, CompactUserGraph().load_snapshot, self.path)
+
+
+class TestMakeUserGraph(unittest.TestCase):
+    def test_make_user_graph(self):
+        self.assertTrue(type(make_user_graph()) is UserGraph)
+        self.assertTrue(type(make_user_graph('compact')) is CompactUserGraph)
+        self.assertRaises(ValueError, make_user_graph, 'abrakadabra')
@@ -0,0 +1,66 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import unittest
+
+from followermaze import wire
+from followermaze.event import Event, FOLLOW, UNFOLLOW, BROADCAST, PRIVATE, STATUS_UPDATE
+from followermaze.wire import PREAMBLE, TEXT, BINARY, FRAME_SIZE, detect_framing, encode_event, decode_events
+
+
+class TestWire(unittest.TestCase):
+
+    def test_detect_framing(self):
+        self.assertEqual(detect_framing('1|B\r\n'), TEXT)
+        self.assertEqual(detect_framing(PREAMBLE[:3]), None)
+        self.assertEqual(detect_framing(PREAMBLE), BINARY)
+        self.assertEqual(detect_framing(PREAMBLE + encode_event(1, BROADCAST)), BINARY)
+        self.assertEqual(detect_framing('\x00xyz12'), TEXT)
+
+
+    def test_decoded_events_equal_parsed_ones(self):
+        data = ''.join([encode_event(1, FOLLOW, 60, 50), encode_event(2, UNFOLLOW, 60, 50), encode_event(3, BROADCAST),
+                        encode_event(4, PRIVATE, 1, 2), encode_event(5, STATUS_UPDATE, 7)])
+        events = []
+        self.assertEqual(decode_events(data, events), len(data))
+        expected = ['1|F|60|50', '2|U|60|50', '3|B', '4|P|1|2', '5|S|7']
+        for event, msg in zip(events, expected):
+            parsed = Event.from_string(msg)
+            for field in Event._fields:
+                self.assertEqual(getattr(event, field), getattr(parsed, field))
+
+
+    def test_user_ids_are_shared(self):
+        events = []
+        decode_events(encode_event(1, FOLLOW, 60, 50) + encode_event(2, FOLLOW, 50, 60), events)
+        self.assertTrue(events[0].from_user is events[1].to_user)
+
+
+    def test_user_id_cache_is_bounded(self):
+        limit = wire._max_user_names
+        wire._max_user_names = 10
+        wire._user_names.clear()
+        try:
+            data = ''.join(encode_event(i, STATUS_UPDATE, 1000 + i) for i in range(1, 21))
+            events = []
+            decode_events(data, events)
+            self.assertEqual(len(wire._user_names), 20)
+            decode_events(encode_event(21, STATUS_UPDATE, 5), events)
+            self.assertEqual(wire._user_names, {5: '5'})
+            self.assertEqual(events[-1].from_user, '5')
+        finally:
+            wire._max_user_names = limit
+
+
+    def test_incomplete_frame_is_left(self):
+        data = encode_event(1, BROADCAST) + encode_event(2, BROADCAST)[:5]
+        events = []
+        self.assertEqual(decode_events(data, events), FRAME_SIZE)
+        self.assertEqual([e.message for e in events], ['1|B'])
+
+
+    def test_bad_frame(self):
+        data = encode_event(1, BROADCAST) + encode_event(2, 9) + encode_event(3, BROADCAST)
+        events = []
+        self.assertRaises(ValueError, decode_events, data, events)
+        self.assertEqual([e.message for e in events], ['1|B'])
@@ -0,0 +1,60 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+import heapq
+import itertools
+import time
+
+
+class Timer(object):
+    '''Handle of a scheduled callback; cancel() prevents the callback from being called.'''
+
+    __slots__ = ('deadline', 'callback', 'cancelled')
+
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerQueue(object):
+    '''
+    Min-heap of timer deadlines.
+    Cancelled timers are not removed from the heap but skipped when they reach its top.
+    '''
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def call_later(self, delay_s, callback, now=None):
+        '''Schedules callback to be called (without arguments) in delay_s seconds; returns Timer.'''
+        if now is None:
+            now = time.time()
+        timer = Timer(now + delay_s, callback)
+        # counter keeps timers with equal deadlines in the order of scheduling
+        heapq.heappush(self.heap, (timer.deadline, next(self.counter), timer))
+        return timer
+
+    def timeout(self, now):
+        '''Returns number of seconds until the nearest deadline, or None if there are no timers.'''
+        heap = self.heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return max(0, heap[0][0] - now)
+
+    def run_expired(self, now):
+        '''Calls callbacks of all timers with deadlines not later than now.'''
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            timer = heapq.heappop(heap)[2]
+            if not timer.cancelled:
+                timer.callback()
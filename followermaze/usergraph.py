@@ -1,7 +1,13 @@
 # Copyright 2013 Alexander Poluektov
 # This file is a part of my solution for 'follower-maze' challenge by SoundCloud
 
+import ctypes
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
 from collections import defaultdict
+from itertools import count, izip
 
 class UserGraph(object):
     '''Manages user graph where directed edges are follower-to-followee relationsheep.'''
@@ -20,23 +26,433 @@ class UserGraph(object):
         if not user_factory:
             user_factory = self.User
         self.users = defaultdict(user_factory)
+        # ids of users with connection
+        self.connected = set()
 
     def register_user(self, user_id, **kwargs):
         '''
         Register user in the graph.
         kwargs is arbitrary arguments that be convenient to store in user object (i.e. connection info).
+        Users registered with non-empty connection are considered connected.
         Re-registering user with same userid does not affect their followers but overwrite kwargs.
         '''
         user = self.users[user_id]
         for k,v in kwargs.items():
             setattr(user, k, v)
+        if 'connection' in kwargs:
+            if kwargs['connection']:
+                self.connected.add(user_id)
+            else:
+                self.connected.discard(user_id)
         return user
 
+    def disconnect_user(self, user_id):
+        '''Forgets connection of the user.'''
+        user = self.users.get(user_id)
+        if user is not None:
+            user.connection = None
+        self.connected.discard(user_id)
+
     def user(self, user_id):
+        '''Returns user by id; the user is created if it does not exist.'''
         return self.users[user_id]
 
+    def get_user(self, user_id):
+        '''Returns user by id, or None if it does not exist.'''
+        return self.users.get(user_id)
+
     def followers_of(self, user_id):
+        '''Returns list of followers of the user; the user and its followers are created if they do not exist.'''
         return [self.user(user_id) for user_id in self.users[user_id].followers]
 
+    def iter_followers(self, user_id):
+        '''Yields existing followers of the user without creating any users.'''
+        user = self.users.get(user_id)
+        if user is not None:
+            users = self.users
+            for follower_id in user.followers:
+                follower = users.get(follower_id)
+                if follower is not None:
+                    yield follower
+
+    def connected_followers(self, user_id):
+        '''
+        Yields followers of the user that have connection.
+        Takes time proportional to the number of followers or connected users, whichever is less.
+        Followers of the user still in the snapshot are copied out of it on the first call (not zero-copy).
+        '''
+        user = self.users.get(user_id)
+        if user is not None:
+            users = self.users
+            # set intersection iterates over the smaller set
+            for follower_id in user.followers & self.connected:
+                yield users[follower_id]
+
+    def connected_users(self):
+        '''Returns list of users that have connection.'''
+        users = self.users
+        return [users[user_id] for user_id in self.connected]
+
+    def add_follower(self, user_id, follower_id):
+        '''Makes follower_id follow user_id; returns the followed user (created if it does not exist).'''
+        user = self.users[user_id]
+        user.add_follower(follower_id)
+        return user
+
+    def remove_follower(self, user_id, follower_id):
+        '''Makes follower_id stop following user_id; does not create any users.'''
+        user = self.users.get(user_id)
+        if user is not None:
+            user.remove_follower(follower_id)
+
+    def add_followers(self, user_id, follower_ids):
+        '''Makes all follower_ids follow user_id at once (i.e. when loading a snapshot).'''
+        self.users[user_id].followers.update(follower_ids)
+
+    def iter_edges(self):
+        '''Yields (user id, collection of follower ids) for every user having followers.'''
+        for user_id, user in self.users.iteritems():
+            if user.followers:
+                yield user_id, user.followers
+
     def all_users(self):
         return self.users.values()
+
+
+# snapshot of CompactUserGraph in compressed sparse row format, in native byte order:
+#   header: magic, byte order mark, number of users N, number of follow edges E, size of the names block
+#   int64[N + 1] offsets: followers of user uid are at [offsets[uid], offsets[uid + 1]) of the next array
+#   int32[E] follower uids, sorted for every user
+#   uint8[N] 1 for users that exist, 0 for ids only known as followers (see CompactUserGraph.exists)
+#   names block: ids of users 0..N-1 joined by newlines (user ids cannot contain newlines)
+SNAPSHOT_MAGIC = 'FMCSR1\n\0'
+_snapshot_header = struct.Struct('=8sIIQQ')
+_BYTE_ORDER_MARK = 0x01020304
+
+
+def is_csr_snapshot(path):
+    '''Tells whether the file is a snapshot written by CompactUserGraph.write_snapshot().'''
+    with open(path, 'rb') as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+class _CSRSnapshot(object):
+    '''Memory-mapped snapshot file giving followers of users as arrays sharing memory with the mapping.'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # private writable mapping: ctypes needs a writable buffer, but nothing writes to it,
+            # so the pages stay shared with the page cache and other processes mapping the file
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        if len(self.mm) < _snapshot_header.size:
+            raise ValueError("not a user graph snapshot: '%s'" % path)
+        magic, mark, users, edges, names_size = _snapshot_header.unpack_from(self.mm)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("not a user graph snapshot: '%s'" % path)
+        if mark != _BYTE_ORDER_MARK:
+            raise ValueError("user graph snapshot '%s' is of different byte order" % path)
+        self.users = users
+        self.base = _snapshot_header.size + 8 * (users + 1)
+        exists_start = self.base + 4 * edges
+        names_start = exists_start + users
+        # a truncated or corrupt file must fail here rather than on some lookup later
+        if len(self.mm) != names_start + names_size:
+            raise ValueError("user graph snapshot '%s' is truncated or corrupt: size %d, expected %d"
+                             % (path, len(self.mm), names_start + names_size))
+        self.offsets = (ctypes.c_int64 * (users + 1)).from_buffer(self.mm, _snapshot_header.size)
+        if self.offsets[0] != 0 or self.offsets[users] != edges:
+            raise ValueError("user graph snapshot '%s' is corrupt: bad offsets" % path)
+        self.exists = bytearray(self.mm[exists_start:names_start])
+        self.names = self.mm[names_start:names_start + names_size].split('\n') if users else []
+        if len(self.names) != users:
+            raise ValueError("user graph snapshot '%s' is corrupt: %d user ids, expected %d"
+                             % (path, len(self.names), users))
+
+    def followers(self, uid):
+        '''Returns sorted array of follower uids of the user, or None if it has none; no data are copied.'''
+        start, end = self.offsets[uid], self.offsets[uid + 1]
+        if start == end:
+            return None
+        return (ctypes.c_int32 * (end - start)).from_buffer(self.mm, self.base + 4 * start)
+
+
+# marks followers of a user not looked up in the snapshot yet
+_IN_SNAPSHOT = object()
+
+
+class CompactUserGraph(object):
+    '''
+    UserGraph with the same interface but compact storage, suitable for millions of users:
+    user ids are interned to dense integers, followers of each user are kept in a sorted array of integers,
+    and user attributes (i.e. connection) are kept in side tables instead of per-user objects.
+    User objects returned by its methods are lightweight views created on demand.
+    Followers get ids too, but like in UserGraph they are not users (i.e. listed by all_users())
+    until they are registered, followed or created by user().
+
+    The graph can be saved to a snapshot file and loaded back from it in time proportional to the number
+    of users only: followers stay in the memory-mapped file, and the followers of a user are copied
+    out of it only when they are changed or notified of a status update.
+    Only loading and the lookups not delivering anything (followers_of(), iter_followers(), iter_edges())
+    are zero-copy: iterating the mapping is several times slower than an array, so connected_followers()
+    keeps a private copy of the followers of every user it is called for.
+    '''
+
+    class User(object):
+        __slots__ = ('graph', 'uid')
+
+        def __init__(self, graph, uid):
+            self.graph = graph
+            self.uid = uid
+
+        def __eq__(self, other):
+            return isinstance(other, CompactUserGraph.User) and self.uid == other.uid and self.graph is other.graph
+
+        def __ne__(self, other):
+            return not self == other
+
+        def __hash__(self):
+            return self.uid
+
+        def __getattr__(self, name):
+            # not indexing the defaultdict: a lookup of a missing attribute (i.e. hasattr()) must not add a table
+            table = self.graph.attributes.get(name)
+            if table is None or self.uid not in table:
+                raise AttributeError(name)
+            return table[self.uid]
+
+        @property
+        def user_id(self):
+            return self.graph.names[self.uid]
+
+        @property
+        def followers(self):
+            return set(self.graph.names[f] for f in self.graph._followers(self.uid) or ())
+
+        def add_follower(self, follower):
+            self.graph._add_follower(self.uid, self.graph._intern_id(follower))
+
+        def remove_follower(self, follower):
+            follower = self.graph.ids.get(follower)
+            if follower is not None:
+                self.graph._remove_follower(self.uid, follower)
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        # uid -> 1 if the user exists, 0 if the id is only known as a follower
+        self.exists = bytearray()
+        # uid -> sorted array of follower uids, or None if the user has no followers,
+        # or _IN_SNAPSHOT if the followers are to be looked up in the snapshot
+        self.followers = []
+        self.snapshot = None
+        # attribute name -> {uid: value}
+        self.attributes = defaultdict(dict)
+        # uids of users with connection
+        self.connected = set()
+
+    def register_user(self, user_id, **kwargs):
+        '''
+        Register user in the graph.
+        kwargs is arbitrary arguments that be convenient to store with the user (i.e. connection info).
+        Users registered with non-empty connection are considered connected.
+        Re-registering user with same userid does not affect their followers but overwrite kwargs.
+        '''
+        uid = self._intern(user_id)
+        for k,v in kwargs.items():
+            self.attributes[k][uid] = v
+        if 'connection' in kwargs:
+            if kwargs['connection']:
+                self.connected.add(uid)
+            else:
+                self.connected.discard(uid)
+        return self.User(self, uid)
+
+    def disconnect_user(self, user_id):
+        '''Forgets connection of the user.'''
+        uid = self.ids.get(user_id)
+        if uid is not None:
+            self.attributes['connection'].pop(uid, None)
+            self.connected.discard(uid)
+
+    def user(self, user_id):
+        '''Returns user by id; the user is created if it does not exist.'''
+        return self.User(self, self._intern(user_id))
+
+    def get_user(self, user_id):
+        '''Returns user by id, or None if it does not exist.'''
+        uid = self.ids.get(user_id)
+        if uid is not None and self.exists[uid]:
+            return self.User(self, uid)
+
+    def followers_of(self, user_id):
+        '''Returns list of followers of the user; the user and its followers are created if they do not exist.'''
+        uid = self._intern(user_id)
+        followers = self._followers(uid) or ()
+        exists = self.exists
+        for f in followers:
+            exists[f] = 1
+        return [self.User(self, f) for f in followers]
+
+    def iter_followers(self, user_id):
+        '''Yields existing followers of the user without creating any users.'''
+        uid = self.ids.get(user_id)
+        if uid is not None:
+            exists = self.exists
+            for f in self._followers(uid) or ():
+                if exists[f]:
+                    yield self.User(self, f)
+
+    def connected_followers(self, user_id):
+        '''
+        Yields followers of the user that have connection.
+        Takes time proportional to the number of followers or connected users, whichever is less.
+        Followers of the user still in the snapshot are copied out of it on the first call (not zero-copy).
+        '''
+        uid = self.ids.get(user_id)
+        if uid is None:
+            return
+        followers = self.followers[uid]
+        if type(followers) is not array:
+            # arrays are iterated much faster than views of the snapshot: fan-out copies followers once per user
+            followers = self._writable_followers(uid)
+        if not followers:
+            return
+        connected = self.connected
+        if len(followers) <= len(connected):
+            for f in followers:
+                if f in connected:
+                    yield self.User(self, f)
+        else:
+            n = len(followers)
+            for c in connected:
+                i = bisect_left(followers, c)
+                if i != n and followers[i] == c:
+                    yield self.User(self, c)
+
+    def connected_users(self):
+        '''Returns list of users that have connection.'''
+        return [self.User(self, uid) for uid in self.connected]
+
+    def add_follower(self, user_id, follower_id):
+        '''Makes follower_id follow user_id; returns the followed user (created if it does not exist).'''
+        uid = self._intern(user_id)
+        self._add_follower(uid, self._intern_id(follower_id))
+        return self.User(self, uid)
+
+    def remove_follower(self, user_id, follower_id):
+        '''Makes follower_id stop following user_id; does not create any users.'''
+        uid = self.ids.get(user_id)
+        follower = self.ids.get(follower_id)
+        if uid is not None and follower is not None:
+            self._remove_follower(uid, follower)
+
+    def add_followers(self, user_id, follower_ids):
+        '''Makes all follower_ids follow user_id at once (i.e. when loading a snapshot).'''
+        uid = self._intern(user_id)
+        followers = set(self._intern_id(f) for f in follower_ids)
+        followers.update(self._followers(uid) or ())
+        self.followers[uid] = array('i', sorted(followers)) if followers else None
+
+    def iter_edges(self):
+        '''Yields (user id, collection of follower ids) for every user having followers.'''
+        names = self.names
+        for uid in xrange(len(names)):
+            followers = self._followers(uid)
+            if followers:
+                yield names[uid], [names[f] for f in followers]
+
+    def all_users(self):
+        exists = self.exists
+        return [self.User(self, uid) for uid in xrange(len(self.names)) if exists[uid]]
+
+    def write_snapshot(self, f):
+        '''Writes the users and their followers (but not user attributes) as a snapshot to the binary file f.'''
+        users = len(self.names)
+        offsets = (ctypes.c_int64 * (users + 1))()
+        edges = 0
+        for uid in xrange(users):
+            offsets[uid] = edges
+            edges += len(self._followers(uid) or ())
+        offsets[users] = edges
+        names = '\n'.join(self.names)
+        f.write(_snapshot_header.pack(SNAPSHOT_MAGIC, _BYTE_ORDER_MARK, users, edges, len(names)))
+        f.write(buffer(offsets))
+        for uid in xrange(users):
+            followers = self._followers(uid)
+            if followers:
+                f.write(buffer(followers))
+        f.write(self.exists)
+        f.write(names)
+
+    def load_snapshot(self, path):
+        '''
+        Loads users and followers from a snapshot file written by write_snapshot(); the graph must be empty.
+        The file is memory-mapped and must not be changed while the graph is in use (it can be deleted).
+        '''
+        if self.names:
+            raise ValueError('snapshot can only be loaded into empty graph')
+        self.snapshot = _CSRSnapshot(path)
+        self.names = [intern(name) for name in self.snapshot.names]
+        self.ids = dict(izip(self.names, count()))
+        self.exists = self.snapshot.exists
+        self.followers = [_IN_SNAPSHOT] * len(self.names)
+
+    def _intern(self, user_id):
+        '''Returns uid of the user, creating the user if it does not exist.'''
+        uid = self._intern_id(user_id)
+        self.exists[uid] = 1
+        return uid
+
+    def _intern_id(self, user_id):
+        '''Returns uid for the id without creating the user.'''
+        uid = self.ids.get(user_id)
+        if uid is None:
+            uid = self.ids[user_id] = len(self.names)
+            self.names.append(user_id)
+            self.followers.append(None)
+            self.exists.append(0)
+        return uid
+
+    def _followers(self, uid):
+        '''Returns sorted follower uids of the user, or None if it has none.'''
+        followers = self.followers[uid]
+        if followers is _IN_SNAPSHOT:
+            followers = self.followers[uid] = self.snapshot.followers(uid)
+        return followers
+
+    def _writable_followers(self, uid):
+        '''Returns follower uids of the user as an array that can be changed, copying them out of the snapshot.'''
+        followers = self._followers(uid)
+        if followers is not None and type(followers) is not array:
+            copy = self.followers[uid] = array('i')
+            copy.fromstring(buffer(followers))
+            followers = copy
+        return followers
+
+    def _add_follower(self, uid, follower):
+        followers = self._writable_followers(uid)
+        if followers is None:
+            self.followers[uid] = array('i', [follower])
+            return
+        i = bisect_left(followers, follower)
+        if i == len(followers) or followers[i] != follower:
+            followers.insert(i, follower)
+
+    def _remove_follower(self, uid, follower):
+        followers = self._writable_followers(uid)
+        if followers is None:
+            return
+        i = bisect_left(followers, follower)
+        if i != len(followers) and followers[i] == follower:
+            del followers[i]
+            if not followers:
+                self.followers[uid] = None
+
+
+def make_user_graph(name=None):
+    '''Creates user graph by name: 'dict' for UserGraph (the default) or 'compact' for CompactUserGraph.'''
+    if name is None or name == 'dict':
+        return UserGraph()
+    if name == 'compact':
+        return CompactUserGraph()
+    raise ValueError("unknown user graph: '%s'" % name)
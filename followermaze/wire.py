@@ -0,0 +1,109 @@
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+'''
+Binary framing of events, an alternative to the pipe-delimited text protocol for high-rate event sources.
+
+An event source chooses it by sending PREAMBLE as the first bytes of the connection; any other first byte
+means text. After the preamble every event is a frame of FRAME_SIZE bytes in network byte order:
+    uint16  length of the rest of the frame (always 13)
+    uint32  sequence number
+    uint8   command code (FOLLOW, UNFOLLOW, BROADCAST, PRIVATE or STATUS_UPDATE of followermaze.event)
+    uint32  from user id (0 if the command has none)
+    uint32  to user id (0 if the command has none)
+User ids are therefore numbers; they become the same strings as in the text protocol, and the message
+delivered to user clients is the text form of the event, formatted only when it is asked for.
+'''
+
+import struct
+
+from followermaze.event import Event, FOLLOW, UNFOLLOW, BROADCAST, PRIVATE, STATUS_UPDATE
+
+
+PREAMBLE = '\x00FMB1'
+
+# framing of an event source connection
+TEXT, BINARY = 'text', 'binary'
+
+_frame = struct.Struct('!HIBII')
+FRAME_SIZE = _frame.size
+BODY_SIZE = FRAME_SIZE - 2
+
+# command code -> format of the text message
+_formats = {
+    FOLLOW: '%d|F|%s|%s',
+    UNFOLLOW: '%d|U|%s|%s',
+    BROADCAST: '%d|B',
+    PRIVATE: '%d|P|%s|%s',
+    STATUS_UPDATE: '%d|S|%s',
+}
+
+# user id -> interned string of it, shared by all events; cleared when it grows beyond _max_user_names,
+# so that the ids of all users ever seen are not kept
+_user_names = {}
+_max_user_names = 100000
+
+_tuple_new = tuple.__new__
+
+
+class BinaryEvent(Event):
+    '''Event decoded from binary framing; its text message is formatted on demand.'''
+
+    __slots__ = ()
+
+    @property
+    def message(self):
+        sequence_num, code, from_user, to_user = self[:4]
+        if code == BROADCAST:
+            return _formats[code] % sequence_num
+        if code == STATUS_UPDATE:
+            return _formats[code] % (sequence_num, from_user)
+        return _formats[code] % (sequence_num, from_user, to_user)
+
+    def __repr__(self):
+        return 'BinaryEvent(%r)' % self.message
+
+
+def detect_framing(data):
+    '''Returns TEXT or BINARY by the first bytes received from an event source, or None if more bytes are needed.'''
+    if data[:1] != PREAMBLE[:1]:
+        return TEXT
+    if len(data) < len(PREAMBLE):
+        return None if PREAMBLE.startswith(data) else TEXT
+    return BINARY if data.startswith(PREAMBLE) else TEXT
+
+
+def encode_event(sequence_num, code, from_user=0, to_user=0):
+    '''Returns frame of the event; user ids are integers.'''
+    return _frame.pack(BODY_SIZE, sequence_num, code, from_user, to_user)
+
+
+def decode_events(data, events, offset=0):
+    '''
+    Decodes complete frames of data starting at offset and appends the resulting Events to the list events.
+    Returns offset of the first byte not decoded (beginning of an incomplete frame).
+    Raises ValueError on a malformed frame; events decoded before it are already in the list.
+    '''
+    unpack_from = _frame.unpack_from
+    names = _user_names
+    if len(names) > _max_user_names:
+        names.clear()
+    append = events.append
+    last = len(data) - FRAME_SIZE
+    while offset <= last:
+        length, sequence_num, code, from_id, to_id = unpack_from(data, offset)
+        if length != BODY_SIZE or code not in _formats:
+            raise ValueError('invalid frame at offset %d: length %d, command code %d' % (offset, length, code))
+        offset += FRAME_SIZE
+
+        from_user = to_user = None
+        if code != BROADCAST:
+            from_user = names.get(from_id)
+            if from_user is None:
+                from_user = names[from_id] = intern(str(from_id))
+            if code != STATUS_UPDATE:
+                to_user = names.get(to_id)
+                if to_user is None:
+                    to_user = names[to_id] = intern(str(to_id))
+        append(_tuple_new(BinaryEvent, (sequence_num, code, from_user, to_user, None)))
+    return offset
@@ -4,3 +4,66 @@
 event_port = 9090
 client_port = 9099
 log_level = 'WARN'
+# with log_level 'INFO' every event is traced; set this to N to trace only every N-th one
+trace_every = 1
+
+# 'poll' (own polling loop) or 'asyncio' (asyncio/trollius event loop, uvloop if installed)
+server = 'poll'
+
+# 'epoll' or 'select'; None picks the best one available
+poller = None
+
+# backlog of the listening sockets; the kernel caps it at net.core.somaxconn
+listen_backlog = 1024
+# maximum number of connections accepted at once when a listening socket is ready
+accept_batch = 256
+
+# maximum number of event sources connected at once; their events are merged by sequence number.
+# None means any number
+max_event_sources = None
+
+# maximum number of bytes read from event source at once
+event_recv_size = 64 * 1024
+
+# 'heap' or 'window' (ring buffer with heap fallback); the heap is faster unless events come heavily out of order
+event_queue = 'heap'
+# number of sequence numbers ahead of the awaited one kept in the ring buffer of the 'window' queue
+event_queue_window = 4096
+# maximum number of out-of-order events buffered before giving up on the missing one; None means unlimited
+event_queue_capacity = None
+# seconds to wait for the missing event before giving up on it; None means forever
+event_queue_timeout_s = None
+
+# 'dict' (object per user) or 'compact' (integer ids and arrays, for millions of users)
+user_graph = 'dict'
+
+# maximum number of bytes buffered for a user client; None means unlimited
+output_high_watermark = None
+# buffered bytes a slow client has to get down to before output is queued normally again; None means half of the above
+output_low_watermark = None
+# what to do with a client that reached the high watermark: 'disconnect', 'drop_oldest' or 'drop_new'
+slow_consumer_policy = 'disconnect'
+
+# number of worker processes delivering events to user clients; 1 means everything runs in one thread
+workers = 1
+# bytes of events buffered for a worker before the master stops reading event sources until it catches up
+# (to half of that); None means unlimited
+worker_link_high_watermark = 16 * 1024 * 1024
+
+# port of the HTTP endpoint serving metrics in Prometheus text format; None disables it
+# (only supported by the 'poll' server running in one process)
+metrics_port = None
+
+# directory of the journal of applied events and snapshots of the user graph, restored at startup;
+# None disables it (only supported when running in one process)
+journal_dir = None
+# applied events are synced to disk in batches of this many events, and at least every interval
+journal_sync_every = 1000
+journal_sync_interval_s = 1.0
+# number of events after which a snapshot is taken and older journal is deleted
+journal_snapshot_every = 1000000
+
+# event messages received from event sources are recorded for replaying them with replay.py to a new file
+# for every run of the server, named record_file.<start time>.<pid>;
+# None disables recording (only supported when running in one process)
+record_file = None
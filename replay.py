@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# Copyright 2013 Alexander Poluektov
+# This file is a part of my solution for 'follower-maze' challenge by SoundCloud
+
+'''
+Replays a recording of event source traffic (see record_file in followermaze_config) through the event
+processing pipeline without sockets, as fast as it goes, and prints events per second, fan-out of
+the events and the size of the resulting user graph.
+
+    python replay.py [options] recording
+
+The user graph and event queue are configured as in followermaze_config unless overridden.
+By default every user mentioned in the recording is connected; --clients N connects users 1..N only.
+'''
+
+import cProfile
+import json
+import optparse
+import pstats
+import sys
+
+from followermaze.event import make_event_queue
+from followermaze.replay import replay, recorded_user_ids
+from followermaze.usergraph import make_user_graph
+
+import followermaze_config as config
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] recording')
+    parser.add_option('--user-graph', default=config.user_graph)
+    parser.add_option('--event-queue', default=config.event_queue)
+    parser.add_option('--clients', type='int', help='connect users 1..N instead of all recorded users')
+    parser.add_option('--json', action='store_true', help='print results as JSON')
+    parser.add_option('--profile', type='int', metavar='N', help='profile the replay and print N top functions')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expected one recording')
+    path = args[0]
+
+    graph = make_user_graph(options.user_graph)
+    queue = make_event_queue(options.event_queue, max_capacity=config.event_queue_capacity,
+                             window_size=config.event_queue_window)
+    if options.clients is None:
+        connected = recorded_user_ids(path)
+    else:
+        connected = [str(i) for i in xrange(1, options.clients + 1)]
+
+    if options.profile:
+        profile = cProfile.Profile()
+        result = profile.runcall(replay, path, graph, queue, connected)
+    else:
+        result = replay(path, graph, queue, connected)
+
+    if options.json:
+        print json.dumps(result, indent=2, sort_keys=True)
+    else:
+        print 'events: %d read, %d rejected, %d processed, %d pending in queue' % (
+            result['events_read'], result['events_rejected'], result['events_processed'], result['events_pending'])
+        print 'elapsed: %.3f s; %.0f events/s, %.0f deliveries/s' % (
+            result['elapsed_s'], result['events_per_s'] or 0, result['deliveries_per_s'] or 0)
+        print 'deliveries: %d in %d messages; max fan-out %d' % (
+            result['deliveries'], result['messages'], result['max_fanout'])
+        for name, fanout in sorted(result['fanout'].items()):
+            print '    %-14s %10d events %12d deliveries %10.1f per event' % (
+                name, fanout['events'], fanout['deliveries'], fanout['mean'])
+        print 'graph: %d users, %d follow edges, %d users connected' % (
+            result['graph_users'], result['graph_edges'], result['connected_users'])
+    if options.profile:
+        pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(options.profile)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,27 +2,90 @@
 # Copyright 2013 Alexander Poluektov
 # This file is a part of my solution for 'follower-maze' challenge by SoundCloud
 
+import atexit
 import logging
+import os
 import time
 
-from followermaze.event import EventQueue
+from followermaze.event import make_event_queue
 from followermaze.server import Server
-from followermaze.usergraph import UserGraph
+from followermaze.usergraph import make_user_graph
 from followermaze.eventhandler import EventHandler
+from followermaze.sharding import ShardedServer
+from followermaze.aioserver import AsyncServer
+from followermaze.metrics import Registry, instrument
+from followermaze.journal import Journal
+from followermaze.replay import Recorder
 
 import followermaze_config as config
 
 
+def server_options(config):
+    return dict(poller=config.poller, recv_size=config.event_recv_size,
+                high_watermark=config.output_high_watermark, low_watermark=config.output_low_watermark,
+                slow_consumer_policy=config.slow_consumer_policy, max_event_sources=config.max_event_sources,
+                listen_backlog=config.listen_backlog, accept_batch=config.accept_batch)
+
+
+def make_server(config):
+    '''
+    Sets up all the components according to config (a module or object with the same attributes
+    as followermaze_config) and returns the server ready to be started.
+    '''
+    queue = make_event_queue(config.event_queue, max_capacity=config.event_queue_capacity,
+                             timeout_s=config.event_queue_timeout_s, window_size=config.event_queue_window)
+    if config.metrics_port is not None and (config.workers > 1 or config.server != 'poll'):
+        logging.warning("Metrics are only served by the 'poll' server in one process; metrics_port ignored.")
+    if config.journal_dir is not None and config.workers > 1:
+        logging.warning('Journal is only supported in one process; journal_dir ignored.')
+    if config.record_file is not None and config.workers > 1:
+        logging.warning('Recording is only supported in one process; record_file ignored.')
+    if config.workers > 1:
+        return ShardedServer(config.event_port, config.client_port, queue, config.workers,
+                             graph=config.user_graph, log_level=config.log_level, trace_every=config.trace_every,
+                             link_high_watermark=config.worker_link_high_watermark, **server_options(config))
+
+    graph = make_user_graph(config.user_graph)
+    if config.server == 'asyncio':
+        server = AsyncServer(event_port=config.event_port, client_port=config.client_port,
+                             high_watermark=config.output_high_watermark, low_watermark=config.output_low_watermark,
+                             slow_consumer_policy=config.slow_consumer_policy,
+                             max_event_sources=config.max_event_sources, listen_backlog=config.listen_backlog)
+    else:
+        server = Server(event_port=config.event_port, client_port=config.client_port,
+                        metrics_port=config.metrics_port, **server_options(config))
+    handler = EventHandler(graph, server, queue, trace_every=config.trace_every)
+    queue.set_handler(handler)
+    if config.journal_dir is not None:
+        journal = Journal(config.journal_dir, handler, graph, sync_every=config.journal_sync_every,
+                          sync_interval_s=config.journal_sync_interval_s, snapshot_every=config.journal_snapshot_every)
+        journal.recover(queue)
+        journal.set_scheduler(server)
+        queue.set_handler(journal)
+        # the polling thread has finished by the time the interpreter exits
+        atexit.register(journal.close)
+    queue.set_scheduler(server)
+    if config.record_file is not None:
+        # a recording holds one run only, as sequence numbers start over when the server restarts
+        path = '%s.%s.%d' % (config.record_file, time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+        logging.info("Recording events to '%s'", path)
+        recorder = Recorder(path, handler)
+        atexit.register(recorder.close)
+        server.set_listener(recorder)
+    else:
+        server.set_listener(handler)
+    if config.metrics_port is not None and config.server == 'poll':
+        registry = Registry()
+        instrument(registry, server, handler, queue, graph)
+        server.set_metrics(registry)
+    return server
+
+
 def run():
 
     # set up everything
-    graph = UserGraph()
-    queue = EventQueue()
-    server = Server(event_port=config.event_port, client_port=config.client_port)
-    handler = EventHandler(graph, server, queue)
-    queue.set_handler(handler)
-    server.set_listener(handler)
     logging.Logger.root.setLevel(config.log_level)
+    server = make_server(config)
 
     # start polling thread
     server.start()
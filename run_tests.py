@@ -6,10 +6,19 @@ import unittest
 
 
 from followermaze.test.test_event import TestEvent
-from followermaze.test.test_eventqueue import TestEventQueue
-from followermaze.test.test_eventhandler import TestEventHandler
-from followermaze.test.test_usergraph import TestUserGraph
-from followermaze.test.test_server import TestServer
+from followermaze.test.test_eventqueue import TestEventQueue, TestWindowEventQueue, TestMakeEventQueue
+from followermaze.test.test_eventhandler import TestEventHandler, TestEventHandlerWithCompactGraph
+from followermaze.test.test_usergraph import TestUserGraph, TestCompactUserGraph, TestCompactUserGraphSnapshot, TestMakeUserGraph
+from followermaze.test.test_server import TestServer, TestServerSend
+from followermaze.test.test_poller import TestSelectPoller, TestEpollPoller, TestMakePoller
+from followermaze.test.test_connection import TestOutputQueue
+from followermaze.test.test_timers import TestTimerQueue
+from followermaze.test.test_sharding import TestShardedServer
+from followermaze.test.test_aioserver import TestAsyncServer
+from followermaze.test.test_metrics import TestRegistry, TestInstrument
+from followermaze.test.test_journal import TestJournal, TestJournalWithCompactGraph
+from followermaze.test.test_wire import TestWire
+from followermaze.test.test_replay import TestReplay, TestReplayWithCompactGraph
 
 if __name__ == '__main__':
     unittest.main()